@@ -11,4 +11,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DLBackend.settings')
-application = get_asgi_application()
\ No newline at end of file
+os.environ.setdefault('TILE_ASYNC', '1')      # Tiles are served by the async view, without a thread per request
+application = get_asgi_application()
+
+from api.tile_app import TileASGIApp     # Needs the apps loaded by get_asgi_application
+application = TileASGIApp(application)     # Stored tiles are answered without the Django middleware chain
+
+from api.views import warm_tile_cache
+warm_tile_cache()                           # In the background, the server accepts requests immediately
\ No newline at end of file
@@ -160,6 +160,20 @@ STATICFILES_DIRS = [
 # Images
 IMAGE_ROOT = os.path.join(BASE_DIR, 'image_data')
 
+# Tiles
+TILE_CACHE_BYTES = int(os.environ.get('TILE_CACHE_BYTES', 64 * 1024 * 1024))  # Memory budget of the cache of stored tiles
+TILE_SHARED_CACHE = os.environ.get('TILE_SHARED_CACHE', '')  # File shared by the workers of one deployment (e.g. /dev/shm/dlbackend-tiles), empty for a cache per process
+TILE_PREFETCH_QUEUE = int(os.environ.get('TILE_PREFETCH_QUEUE', 256))  # Tiles waiting to be prefetched, further ones are dropped
+TILE_PREFETCH_WORKERS = int(os.environ.get('TILE_PREFETCH_WORKERS', 2))  # Threads loading prefetched tiles per process, 0 disables prefetching
+TILE_WARM_COUNT = int(os.environ.get('TILE_WARM_COUNT', 1000))  # Most requested tiles loaded into the cache at startup and after a layer is published
+TILE_POPULARITY_FILE = os.environ.get('TILE_POPULARITY_FILE', os.path.join(BASE_DIR, 'image_data', 'tile_popularity.json'))  # Rolling request counts of the tiles, outside of the served tiles folder
+TILE_ASYNC = os.environ.get('TILE_ASYNC', '') == '1'  # Serve tiles with the async view, set by asgi.py
+TILE_SENDFILE = os.environ.get('TILE_SENDFILE', '')  # 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache, lighttpd) lets the front server send stored tiles
+TILE_SENDFILE_PREFIX = os.environ.get('TILE_SENDFILE_PREFIX', '/protected-tiles/')  # Internal nginx location mapped to the tiles folder
+TILE_SIGNED_URLS = os.environ.get('TILE_SIGNED_URLS', '') == '1'  # Only serve tiles through the signed layer URLs handed out by the catalog
+TILE_URL_LIFETIME = int(os.environ.get('TILE_URL_LIFETIME', 60 * 60))  # Seconds a signed layer URL stays valid at least, at most twice as long
+TILE_SIGNING_KEY = os.environ.get('TILE_SIGNING_KEY', '')  # Secret of the tile URL signatures, SECRET_KEY when empty, shared by all workers
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
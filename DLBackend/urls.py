@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.urls import path, include, re_path
-from api.views import CreateUserView, tile_serving, serve_image  # import serve_image here
+from api.views import CreateUserView, tile_serving, async_tile_serving, batch_tile_serving, dynamic_tile_serving, serve_image  # import serve_image here
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.views.static import serve
 from django.conf import settings
@@ -14,5 +14,7 @@ urlpatterns = [
     path ('api-auth/', include('rest_framework.urls')),
     path ('api/', include('api.urls')),
     path('map/', serve_image, name='serve_image'),
-    re_path(r'^tiles/(?P<path>.*)$', tile_serving, name='tile_serving'),
+    re_path(r'^tiles/dynamic/(?P<img_id>\d+)/(?P<alg_id>\d+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.(?P<extension>png|webp)$', dynamic_tile_serving, name='dynamic_tile_serving'),
+    re_path(r'^tiles/batch/(?P<img_id>\d+)/(?P<alg_id>\d+)/$', batch_tile_serving, name='batch_tile_serving'),
+    re_path(r'^tiles/(?P<path>.*)$', async_tile_serving if settings.TILE_ASYNC else tile_serving, name='tile_serving'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)  # Serve files from MEDIA_ROOT
@@ -12,3 +12,9 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DLBackend.settings')
 application = get_wsgi_application()
+
+from api.tile_app import TileWSGIApp     # Needs the apps loaded by get_wsgi_application
+application = TileWSGIApp(application)     # Stored tiles are answered without the Django middleware chain
+
+from api.views import warm_tile_cache
+warm_tile_cache()                           # In the background, the server accepts requests immediately
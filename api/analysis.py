@@ -0,0 +1,196 @@
+from functools import lru_cache
+from image_util import export, histograms, sampling
+import numpy as np
+
+max_sample_points: int = 10000      # Largest number of locations sampled by one request
+max_zones: int = 50000              # Largest number of polygons summarized by one request
+max_series_window: int = 32         # Largest side in pixels of the window averaged by a time series request
+statistics_cache_size: int = 256    # Number of statistics summaries kept in memory
+
+def parse_samples(data: dict) -> dict:
+    """Read the body of a point sampling request
+
+    Keyword arguments:
+    - data -- The request body: "alg_id" of an index algorithm, "points" as a list of [lon, lat] in degrees
+              and optionally "img_id" (all published images covering the points when not given)
+
+    Returns:
+    - Dictionary of alg_id, img_id (None when not given) and the lons and lats as arrays
+
+    Exceptions:
+    - ValueError when the body is invalid
+    """
+
+    try:
+        alg_id: int = int(data["alg_id"])
+        img_id: int = int(data["img_id"]) if data.get("img_id") is not None else None
+        points: np.ndarray = np.asarray(data["points"], dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("alg_id and points ([[lon, lat], ...]) are required")
+
+    if alg_id not in sampling.index_algorithms:
+        raise ValueError(f"alg_id must be one of {sampling.index_algorithms}")
+    if points.ndim != 2 or points.shape[1] != 2 or not 0 < len(points) <= max_sample_points:
+        raise ValueError(f"points must be a list of 1 to {max_sample_points} [lon, lat] pairs")
+
+    return {"alg_id": alg_id, "img_id": img_id, "lons": points[:, 0], "lats": points[:, 1]}
+
+def json_values(values: np.ndarray) -> list:
+    # NaN is not valid JSON, locations without a value are returned as null
+    return [None if np.isnan(value) else round(float(value), 6) for value in values]
+
+def parse_zonal(data: dict) -> dict:
+    """Read the body of a zonal statistics request
+
+    Keyword arguments:
+    - data -- The request body: "img_id", "alg_id" of an index algorithm, "features" as a GeoJSON
+              FeatureCollection (or list of Features) of Polygons and MultiPolygons in degrees,
+              and optionally "percentiles" between 0 and 100
+
+    Returns:
+    - Dictionary of img_id, alg_id, the feature ids (None when a feature has none), the geometries and the percentiles
+
+    Exceptions:
+    - ValueError when the body is invalid
+    """
+
+    try:
+        img_id: int = int(data["img_id"])
+        alg_id: int = int(data["alg_id"])
+        features: list = data["features"]["features"] if isinstance(data["features"], dict) else data["features"]
+        geometries: list[dict] = [feature["geometry"] for feature in features]
+        percentiles: list[float] = [float(p) for p in data.get("percentiles", [])]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("img_id, alg_id and features (GeoJSON Polygons) are required")
+
+    if alg_id not in sampling.index_algorithms:
+        raise ValueError(f"alg_id must be one of {sampling.index_algorithms}")
+    if not 0 < len(geometries) <= max_zones:
+        raise ValueError(f"features must contain 1 to {max_zones} polygons")
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles must be between 0 and 100")
+
+    return {"img_id": img_id, "alg_id": alg_id, "ids": [feature.get("id") for feature in features], "geometries": geometries, "percentiles": percentiles}
+
+def parse_series(query: dict) -> dict:
+    """Read the query of a time series request
+
+    Keyword arguments:
+    - query -- The query parameters: alg_id of an index algorithm, point (lon,lat) in degrees and optionally
+               window, the side in pixels of the window around the point which is averaged (1 by default)
+
+    Returns:
+    - Dictionary of alg_id, lon, lat and window
+
+    Exceptions:
+    - ValueError when the query is invalid
+    """
+
+    try:
+        alg_id: int = int(query["alg_id"])
+        lon, lat = (float(value) for value in query["point"].split(","))
+        window: int = int(query.get("window", 1))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("alg_id and point (lon,lat) are required")
+
+    if alg_id not in sampling.index_algorithms:
+        raise ValueError(f"alg_id must be one of {sampling.index_algorithms}")
+    if not 1 <= window <= max_series_window:
+        raise ValueError(f"window must be between 1 and {max_series_window} pixels")
+
+    return {"alg_id": alg_id, "lon": lon, "lat": lat, "window": window}
+
+def parse_export(data: dict) -> dict:
+    """Read the parameters of an export request
+
+    Keyword arguments:
+    - data -- The query parameters or request body: img_id, alg_id of an index algorithm and either bbox
+              (west,south,east,north in degrees, or a list) or "geometry" as a GeoJSON Polygon or MultiPolygon in degrees
+
+    Returns:
+    - Dictionary of img_id, alg_id and the geometry
+
+    Exceptions:
+    - ValueError when the parameters are invalid
+    """
+
+    try:
+        img_id: int = int(data["img_id"])
+        alg_id: int = int(data["alg_id"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("img_id and alg_id are required")
+
+    if alg_id not in sampling.index_algorithms:
+        raise ValueError(f"alg_id must be one of {sampling.index_algorithms}")
+
+    if data.get("geometry"):
+        geometry: dict = data["geometry"]
+    elif data.get("bbox"):
+        try:
+            bounds: list[float] = [float(value) for value in (data["bbox"].split(",") if isinstance(data["bbox"], str) else data["bbox"])]
+        except (TypeError, ValueError):
+            bounds = []
+        if len(bounds) != 4 or bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+            raise ValueError("bbox must be given as west,south,east,north")
+        geometry: dict = export.bbox_geometry(bounds)
+    else:
+        raise ValueError("Either bbox or geometry is required")
+
+    return {"img_id": img_id, "alg_id": alg_id, "geometry": geometry}
+
+def parse_statistics(query: dict) -> dict:
+    """Read the query of a statistics request
+
+    Keyword arguments:
+    - query -- The query parameters: img_id, alg_id of an index algorithm and optionally a bbox
+               (west,south,east,north in degrees) and percentiles (comma separated, between 0 and 100)
+
+    Returns:
+    - Dictionary of img_id, alg_id, bbox (None when not given) and the percentiles as a tuple
+
+    Exceptions:
+    - ValueError when the query is invalid
+    """
+
+    try:
+        img_id: int = int(query["img_id"])
+        alg_id: int = int(query["alg_id"])
+        bbox: tuple = tuple(float(value) for value in query["bbox"].split(",")) if query.get("bbox") else None
+        percentiles: tuple = tuple(float(p) for p in query["percentiles"].split(",")) if query.get("percentiles") else tuple(histograms.default_percentiles)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("img_id and alg_id are required, bbox and percentiles must be numbers")
+
+    if alg_id not in sampling.index_algorithms:
+        raise ValueError(f"alg_id must be one of {sampling.index_algorithms}")
+    if bbox is not None and (len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]):
+        raise ValueError("bbox must be given as west,south,east,north")
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles must be between 0 and 100")
+
+    return {"img_id": img_id, "alg_id": alg_id, "bbox": bbox, "percentiles": percentiles}
+
+@lru_cache(maxsize=16)
+def load_statistics(path: str, mtime_ns: int) -> dict:
+    # Keyed by the modification time, so statistics are read again once the layer was rendered again
+    return histograms.read_statistics(path)
+
+@lru_cache(maxsize=statistics_cache_size)
+def layer_statistics(path: str, mtime_ns: int, bbox: tuple, percentiles: tuple) -> dict:
+    """Get the statistics of a rendered layer, or of the part of it covering a bbox, keeping the result in memory
+
+    Keyword arguments:
+    - path        -- The path of the statistics stored while rendering (see histograms.statistics_path)
+    - mtime_ns    -- The modification time of the statistics, invalidating cached results when the layer is rendered again
+    - bbox        -- The bbox as west, south, east, north in degrees, or None for the whole layer
+    - percentiles -- The percentiles to compute
+
+    Returns:
+    - The statistics (see histograms.summarize), with the covered blocks when a bbox is given
+    """
+
+    stats: dict = load_statistics(path, mtime_ns)
+    if bbox is None:
+        return histograms.summarize(stats, percentiles=list(percentiles))
+
+    blocks: tuple = histograms.block_window(stats, bbox)
+    return dict(histograms.summarize(stats, blocks, list(percentiles)), blocks=list(blocks))
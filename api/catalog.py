@@ -0,0 +1,78 @@
+from functools import lru_cache
+from django.core.paginator import Paginator
+from django.urls import reverse
+from image_util import dynamic
+from image_util.models import Image, catalog_published_file
+from .serializers import CatalogImageSerializer
+from .tiles import sign_layer
+import json, os
+
+catalog_cache_size: int = 64        # Number of catalog pages kept in memory
+catalog_page_size: int = 20
+max_catalog_page_size: int = 100
+
+def published(images_directory: str) -> int:
+    """Get the time the catalog was last published by the pipeline
+
+    Keyword arguments:
+    - images_directory -- The folder where the band files of the created images are stored
+
+    Returns:
+    - The modification time of the publish marker, or 0 when the catalog was never published
+    """
+
+    try:
+        return os.stat(os.path.join(images_directory, catalog_published_file)).st_mtime_ns
+    except OSError:
+        return 0
+
+@lru_cache(maxsize=catalog_cache_size)
+def catalog_page(published_ns: int, page: int, page_size: int) -> dict:
+    """Get a page of the published images with their tiled layers, keeping the result in memory
+
+    Keyword arguments:
+    - published_ns -- The time the catalog was last published, invalidating cached pages when it is published again
+    - page         -- The number of the page, starting at 1
+    - page_size    -- The number of images per page
+
+    Returns:
+    - Dictionary of the total count of images, the page, the number of pages and the images of the page
+
+    Exceptions:
+    - django.core.paginator.InvalidPage when the page does not exist
+    """
+
+    images = Image.manager.prefetch_related("layers").order_by("img_id")
+    paginator: Paginator = Paginator(images, page_size)
+    current = paginator.page(page)
+
+    results: list = json.loads(json.dumps(CatalogImageSerializer(current.object_list, many=True).data))      # Plain data, without references to the serializer
+    return {"count": paginator.count, "page": page, "pages": paginator.num_pages, "results": results}
+
+def sign_catalog(page: dict, key: bytes, expires: int) -> dict:
+    """Get a copy of a catalog page with signed tile URLs, which the tile views accept until they expire
+
+    Keyword arguments:
+    - page    -- The catalog page (see catalog_page)
+    - key     -- The signing key (see tiles.signing_key)
+    - expires -- The Unix time until which the URLs are valid
+
+    Returns:
+    - The page with the signed URL, signature and expiry of every layer, per image the signatures of all
+      algorithms as "signatures" (also for layers which are not tiled yet, served as dynamic tiles), and
+      the time they expire as "tiles_expire"
+    """
+
+    root: str = reverse("tile_serving", kwargs={"path": ""})
+    results: list[dict] = []
+    for image in page["results"]:
+        layers: list[dict] = []
+        for layer in image["layers"]:
+            signature: str = sign_layer(key, f"{image['img_id']}/{layer['alg_id']}", expires)
+            layers.append(dict(layer, url=f"{root}s/{expires}/{signature}/{layer['url'][len(root):]}", signature=signature, expires=expires))
+
+        # The expires and signature query parameters of the batch, dynamic tile and overview views, for every algorithm
+        signatures: list[dict] = [{"alg_id": alg_id, "name": algorithm["name"], "signature": sign_layer(key, f"{image['img_id']}/{alg_id}", expires), "expires": expires}
+                                  for alg_id, algorithm in dynamic.algorithms.items()]
+        results.append(dict(image, layers=layers, signatures=signatures))
+    return dict(page, results=results, tiles_expire=expires)
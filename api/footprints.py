@@ -0,0 +1,104 @@
+from image_util.models import Image
+import sqlite3, threading
+
+footprint_crs: dict[str, tuple[str, str, str, str]] = {
+    "EPSG:4326": ("west", "south", "east", "north"),        # Footprint fields of Image in each supported CRS
+    "EPSG:3857": ("min_x", "min_y", "max_x", "max_y"),
+}
+
+def parse_query(query: dict) -> tuple[str, tuple[float, float, float, float]]:
+    """Read a footprint query of a request
+
+    Keyword arguments:
+    - query -- The query parameters: point (x,y) or bbox (min x,min y,max x,max y), and optionally
+               crs (EPSG:4326 degrees, the default, or EPSG:3857 meters)
+
+    Returns:
+    - The CRS and the queried bounds, a point being a bbox without area
+
+    Exceptions:
+    - ValueError when the query is invalid
+    """
+
+    crs: str = query.get("crs", "EPSG:4326").upper()
+    if crs not in footprint_crs:
+        raise ValueError(f"crs must be one of {list(footprint_crs)}")
+
+    if query.get("point"):
+        x, y = (float(value) for value in query["point"].split(","))
+        return crs, (x, y, x, y)
+
+    if query.get("bbox"):
+        bounds: tuple = tuple(float(value) for value in query["bbox"].split(","))
+        if len(bounds) != 4 or bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+            raise ValueError("bbox must be given as min x,min y,max x,max y")
+        return crs, bounds
+
+    raise ValueError("Either point or bbox is required")
+
+
+class FootprintIndex():
+    """In-memory R-tree over the footprints of the published images
+
+    The footprints are loaded from the database once per publish into an SQLite R*Tree, one per CRS, so
+    intersection queries do not scan every image. The R*Tree stores rounded bounds, candidates are
+    checked against the exact footprint.
+    """
+
+    def __init__(self):
+        self.lock: threading.Lock = threading.Lock()
+        self.connection: sqlite3.Connection = None
+        self.footprints: dict[int, dict] = {}
+        self.published_ns: int = None
+
+    def load(self, published_ns: int):
+        """Build the index from the catalog in the database, unless it was built for the same publish
+
+        Keyword arguments:
+        - published_ns -- The time the catalog was last published (see catalog.published)
+        """
+
+        with self.lock:
+            if self.published_ns == published_ns:
+                return
+
+            connection = sqlite3.connect(":memory:", check_same_thread=False)
+            footprints: dict[int, dict] = {}
+            for crs in footprint_crs:
+                connection.execute(f"CREATE VIRTUAL TABLE \"{crs}\" USING rtree(img_id, min_x, max_x, min_y, max_y)")
+
+            images = Image.manager.exclude(west=None).values("img_id", "title", *footprint_crs["EPSG:4326"], *footprint_crs["EPSG:3857"])
+            for image in images:
+                footprints[image["img_id"]] = {"img_id": image["img_id"], "title": image["title"],
+                                               "bounds": {crs: [image[field] for field in fields] for crs, fields in footprint_crs.items()}}
+            for crs in footprint_crs:
+                rows: list[tuple] = []
+                for img_id, footprint in footprints.items():
+                    min_x, min_y, max_x, max_y = footprint["bounds"][crs]
+                    rows.append((img_id, min_x, max_x, min_y, max_y))
+                connection.executemany(f"INSERT INTO \"{crs}\" VALUES (?, ?, ?, ?, ?)", rows)
+
+            self.connection, self.footprints, self.published_ns = connection, footprints, published_ns
+
+    def query(self, crs: str, bounds: tuple[float, float, float, float]) -> list[dict]:
+        """Get the images whose footprint intersects the given bounds
+
+        Keyword arguments:
+        - crs    -- The CRS of the bounds (see footprint_crs)
+        - bounds -- The queried bounds as (min x, min y, max x, max y)
+
+        Returns:
+        - The img_id, title and bounds in the given CRS of every intersecting image, ordered by img_id
+        """
+
+        with self.lock:
+            rows: list = self.connection.execute(f"SELECT img_id FROM \"{crs}\" WHERE min_x <= ? AND max_x >= ? AND min_y <= ? AND max_y >= ? ORDER BY img_id",
+                                                 (bounds[2], bounds[0], bounds[3], bounds[1])).fetchall()
+            footprints: dict[int, dict] = self.footprints
+
+        result: list[dict] = []
+        for (img_id,) in rows:
+            footprint: list[float] = footprints[img_id]["bounds"][crs]
+            if footprint[0] <= bounds[2] and footprint[2] >= bounds[0] and footprint[1] <= bounds[3] and footprint[3] >= bounds[1]:
+                result.append({"img_id": img_id, "title": footprints[img_id]["title"], "bounds": footprint})
+        return result
@@ -0,0 +1,121 @@
+from functools import lru_cache
+from PIL import Image as PILImage
+from image_util import tiles
+import rasterio as rio
+import rasterio.warp
+import numpy as np
+import math
+
+overview_cache_size: int = 128         # Number of produced overviews kept in memory
+max_overview_size: int = 4096          # Largest width or height of a produced overview in pixels
+overview_encoding: str = "webp"
+geographic_crs: str = "EPSG:4326"
+
+def parse_overview(query: dict) -> dict:
+    """Read the overview parameters of a request
+
+    Keyword arguments:
+    - query -- The query parameters: width and/or height in pixels, optionally a layer (img#id/alg#id)
+               and a bbox (west,south,east,north in degrees) within that layer
+
+    Returns:
+    - Dictionary of width, height (None when not given), layer and bbox
+
+    Exceptions:
+    - ValueError when a parameter is invalid, or a layer is given without width and height
+    """
+
+    def size(name: str) -> int:
+        if not query.get(name):
+            return None
+        value: int = int(query[name])
+        if not 0 < value <= max_overview_size:
+            raise ValueError(f"{name} must be between 1 and {max_overview_size}")
+        return value
+
+    width, height = size("width"), size("height")
+
+    layer: str = query.get("layer") or None
+    if layer is not None and (len(layer.split("/")) != 2 or not all(part.isdigit() for part in layer.split("/"))):
+        raise ValueError("layer must be given as img#id/alg#id")
+
+    if layer is not None and width is None and height is None:
+        raise ValueError("A layer overview requires a width or height")      # The render output itself can be far larger than an overview
+
+    bbox: tuple = None
+    if query.get("bbox"):
+        if layer is None:
+            raise ValueError("bbox requires a layer")
+        bbox = tuple(float(value) for value in query["bbox"].split(","))
+        if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+            raise ValueError("bbox must be given as west,south,east,north")
+
+    return {"width": width, "height": height, "layer": layer, "bbox": bbox}
+
+def fit(source_width: int, source_height: int, width: int, height: int) -> tuple[int, int]:
+    """Get the size of an overview fitting in the requested size, keeping the aspect ratio and never upscaling
+
+    Keyword arguments:
+    - source_width, source_height -- The size of the source in pixels
+    - width, height               -- The requested size, either may be None
+
+    Returns:
+    - The width and height of the overview, at most max_overview_size per side
+    """
+
+    scale: float = min(width / source_width if width else math.inf, height / source_height if height else math.inf, 1.0,
+                       max_overview_size / source_width, max_overview_size / source_height)
+    return max(1, round(source_width * scale)), max(1, round(source_height * scale))
+
+@lru_cache(maxsize=overview_cache_size)
+def image_overview(image_path: str, mtime_ns: int, width: int, height: int) -> bytes:
+    """Downscale a plain image, keeping the result in memory
+
+    Keyword arguments:
+    - image_path    -- The path of the image
+    - mtime_ns      -- The modification time of the image, invalidating cached results when it changes
+    - width, height -- The requested size, either may be None
+
+    Returns:
+    - The encoded overview
+    """
+
+    with PILImage.open(image_path) as image:
+        image.draft(image.mode, fit(image.width, image.height, width, height))          # Formats with reduced decoding (JPEG) decode smaller
+        overview: PILImage.Image = image.resize(fit(image.width, image.height, width, height), PILImage.Resampling.LANCZOS, reducing_gap=3.0)
+
+    return tiles.encode_tile(overview, overview_encoding)
+
+@lru_cache(maxsize=overview_cache_size)
+def render_overview(rendered_path: str, mtime_ns: int, width: int, height: int, bbox: tuple) -> bytes:
+    """Downscale (part of) a render output, keeping the result in memory
+
+    The render output is read at the size of the overview, so rasterio uses its internal overviews or
+    decimated reads instead of decoding the full resolution raster.
+
+    Keyword arguments:
+    - rendered_path -- The path of the render output
+    - mtime_ns      -- The modification time of the render output, invalidating cached results when it is rerendered
+    - width, height -- The requested size, either may be None
+    - bbox          -- (Optional) The part of the render output as (west, south, east, north) in degrees
+
+    Returns:
+    - The encoded overview, or None when the bbox does not overlap the render output
+    """
+
+    with rio.open(rendered_path) as src:
+        window = rio.windows.Window(0, 0, src.width, src.height)
+        if bbox is not None:
+            bounds: tuple = rio.warp.transform_bounds(geographic_crs, src.crs, *bbox, densify_pts=21)
+            try:
+                window = rio.windows.from_bounds(*bounds, transform=src.transform).round_offsets().round_lengths().intersection(window)
+            except rio.errors.WindowError:          # No overlap
+                return None
+
+        size: tuple = fit(int(window.width), int(window.height), width, height)
+        out_shape: tuple = (size[1], size[0])
+        rgb: np.ndarray = src.read([1, 2, 3], window=window, out_shape=(3,) + out_shape, resampling=rio.enums.Resampling.average)
+        alpha: np.ndarray = src.dataset_mask(window=window, out_shape=out_shape)
+
+    overview: PILImage.Image = PILImage.fromarray(np.dstack([rgb[0], rgb[1], rgb[2], alpha]).astype(np.uint8), "RGBA")
+    return tiles.encode_tile(overview, overview_encoding)
@@ -1,5 +1,8 @@
 from django.contrib.auth.models import User
+from django.urls import reverse
 from rest_framework import serializers
+from image_util import dynamic
+from image_util.models import Image, Layer
 
 # the serializer class is used to convert complex data types into native python data types that can be rendered into JSON, XML or other content types
 
@@ -14,7 +17,39 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
+class LayerSerializer(serializers.ModelSerializer):
+    name = serializers.SerializerMethodField()
+    bounds = serializers.SerializerMethodField()
+    url = serializers.SerializerMethodField()
 
+    class Meta:
+        model = Layer
+        fields = ['alg_id', 'name', 'version', 'minzoom', 'maxzoom', 'tilesize', 'bounds', 'url']
+
+    def get_name(self, layer):
+        return dynamic.algorithms[layer.alg_id]["name"] if layer.alg_id in dynamic.algorithms else None
+
+    def get_bounds(self, layer):
+        return [layer.west, layer.south, layer.east, layer.north]
 
+    def get_url(self, layer):
+        # Versioned URL template of the tiles, cached by clients until the layer is retiled
+        return reverse('tile_serving', args=[f"{layer.image.img_id}/{layer.alg_id}/v{layer.version}/"]) + "{z}/{x}/{y}.png"
 
 
+class CatalogImageSerializer(serializers.ModelSerializer):
+    bounds = serializers.SerializerMethodField()
+    layers = LayerSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Image
+        fields = ['img_id', 'title', 'bounds', 'layers']
+
+    def get_bounds(self, image):
+        # Footprint of the image, or the union of the bounds of its layers when it was published without one
+        if image.west is not None:
+            return [image.west, image.south, image.east, image.north]
+        layers = image.layers.all()
+        if not layers:
+            return None
+        return [min(layer.west for layer in layers), min(layer.south for layer in layers), max(layer.east for layer in layers), max(layer.north for layer in layers)]
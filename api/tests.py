@@ -1,10 +1,25 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, AsyncRequestFactory, RequestFactory
+from django.http import Http404
 from django.urls import reverse
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from rest_framework import status
 from api.serializers import UserSerializer
 from unittest.mock import patch, MagicMock
+from PIL import Image as PILImage
+from image_util import tiles
+from api.tiles import SharedTileCache, TileCache, TilePopularity, TilePrefetcher, read_bundle, sign_layer
+from api.tile_app import TileASGIApp, TileWSGIApp
+from api import overviews
+from api.catalog import catalog_page
+from api.footprints import FootprintIndex
+from image_util.models import Image, Layer, Profile
+import api.views
+import rasterio as rio
+import rasterio.warp
+import numpy as np
+from image_util import histograms
+import io, json, os, shutil, tempfile, threading, time
 
 LOCAL_TESTING = False
 
@@ -54,6 +69,92 @@ class ServeImageViewTest(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
+class OverviewViewTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.work_dir = tempfile.mkdtemp()
+        self.previous_directory = api.views.TILES_DIRECTORY
+        api.views.TILES_DIRECTORY = self.work_dir
+
+        # Render output of 400x200 pixels of 60m in UTM zone 34N, west half red and east half blue
+        self.rendered = os.path.join(self.work_dir, 'scene_TC.tiff')
+        data = np.zeros((3, 200, 400), dtype=np.uint8)
+        data[0, :, :200] = 200
+        data[2, :, 200:] = 100
+        with rio.open(self.rendered, 'w', driver='GTiff', width=400, height=200, count=3, dtype='uint8', crs='EPSG:32634',
+                      transform=rio.transform.from_origin(600000.0, 4800000.0, 60.0, 60.0)) as dst:
+            dst.write(data)
+
+        os.makedirs(os.path.join(self.work_dir, '0', '0'))
+        with open(os.path.join(self.work_dir, '0', '0', 'layer.json'), 'w') as manifest:
+            json.dump({'source': self.rendered}, manifest)
+
+    def tearDown(self):
+        api.views.TILES_DIRECTORY = self.previous_directory
+        shutil.rmtree(self.work_dir)
+
+    def test_layer_overview(self):
+        response = self.client.get(reverse('serve_image'), {'layer': '0/0', 'width': 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+        overview = PILImage.open(io.BytesIO(response.content))
+        self.assertEqual(overview.size, (100, 50))          # Aspect ratio of the render output is kept
+
+        # Never larger than the render output
+        overview = PILImage.open(io.BytesIO(self.client.get(reverse('serve_image'), {'layer': '0/0', 'width': 4000, 'height': 4000}).content))
+        self.assertEqual(overview.size, (400, 200))
+
+    def test_overview_size_limit(self):
+        self.assertEqual(overviews.fit(10980, 10980, None, None), (overviews.max_overview_size, overviews.max_overview_size))
+        self.assertEqual(overviews.fit(20000, 10000, 8000, None), (overviews.max_overview_size, overviews.max_overview_size // 2))
+
+    def test_layer_overview_signed(self):
+        expires = int(time.time()) + 600
+        with self.settings(TILE_SIGNED_URLS=True):
+            self.assertEqual(self.client.get(reverse('serve_image'), {'layer': '0/0', 'width': 100}).status_code, 403)
+            response = self.client.get(reverse('serve_image'), {'layer': '0/0', 'width': 100, 'expires': expires,
+                                                                'signature': sign_layer(api.views.TILE_SIGNING_KEY, '0/0', expires)})
+            self.assertEqual(response.status_code, 200)
+
+    def test_layer_overview_bbox(self):
+        west, south, east, north = rio.warp.transform_bounds('EPSG:32634', 'EPSG:4326', 600000.0, 4788000.0, 612000.0, 4800000.0)
+        response = self.client.get(reverse('serve_image'), {'layer': '0/0', 'height': 50, 'bbox': f'{west},{south},{east},{north}'})
+        self.assertEqual(response.status_code, 200)
+
+        overview = PILImage.open(io.BytesIO(response.content)).convert('RGB')
+        self.assertEqual(overview.height, 50)
+        red, _, blue = overview.getpixel((overview.width // 2, 25))
+        self.assertGreater(red, 150)            # Only the red west half
+        self.assertLess(blue, 50)
+
+        self.assertEqual(self.client.get(reverse('serve_image'), {'layer': '0/0', 'width': 50, 'bbox': '10,10,11,11'}).status_code, 404)
+
+    def test_overview_cached(self):
+        overviews.render_overview.cache_clear()
+        for _ in range(2):
+            response = self.client.get(reverse('serve_image'), {'layer': '0/0', 'width': 64})
+        self.assertEqual(overviews.render_overview.cache_info().hits, 1)
+
+        # The cached response revalidates with its ETag
+        self.assertEqual(self.client.get(reverse('serve_image'), {'layer': '0/0', 'width': 64}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_image_overview(self):
+        image_path = os.path.join(self.work_dir, 'compressed.webp')
+        PILImage.new('RGB', (800, 600), (10, 20, 30)).save(image_path, format='WEBP')
+
+        with patch.object(api.views, 'OVERVIEW_IMAGE', image_path):
+            response = self.client.get(reverse('serve_image'), {'height': 150})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PILImage.open(io.BytesIO(response.content)).size, (200, 150))
+        self.assertLess(len(response.content), os.path.getsize(image_path))
+
+    def test_overview_invalid(self):
+        for query in [{'width': 0}, {'width': 'abc'}, {'width': 100000}, {'bbox': '0,0,1,1'}, {'layer': '0/0', 'bbox': '1,1,0,0'}, {'layer': 'a/b'}, {'layer': '0/0'}]:
+            self.assertEqual(self.client.get(reverse('serve_image'), query).status_code, 400)
+        self.assertEqual(self.client.get(reverse('serve_image'), {'layer': '5/5', 'width': 10}).status_code, 404)
+
+
 class CreateUserViewTest(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -77,3 +178,915 @@ class CreateUserViewTest(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(User.objects.count(), 1)
 
+
+class TileServingViewTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.tile_dir = tempfile.mkdtemp()
+        self.previous_directory = api.views.TILES_DIRECTORY
+        api.views.TILES_DIRECTORY = self.tile_dir
+
+        os.makedirs(os.path.join(self.tile_dir, '0', '0', '6', '35'))
+        for extension in ['png', 'webp']:
+            with open(os.path.join(self.tile_dir, '0', '0', '6', '35', f'23.{extension}'), 'wb') as tile:
+                tile.write(extension.encode())
+
+    def tearDown(self):
+        api.views.TILES_DIRECTORY = self.previous_directory
+        shutil.rmtree(self.tile_dir)
+
+    def test_tile_serving_negotiates_webp(self):
+        response = self.client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/avif,image/webp,*/*;q=0.8')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('Accept', response['Vary'])
+
+    def test_tile_serving_falls_back_to_png(self):
+        response = self.client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+    def test_tile_serving_etag(self):
+        response = self.client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/png')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertTrue(response['ETag'].startswith('"'))
+
+        # Revalidation of an unchanged tile does not send the tile again
+        response = self.client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/png', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # Each variant has its own ETag
+        webp = self.client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/webp', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(webp.status_code, 200)
+        self.assertNotEqual(webp['ETag'], response['ETag'])
+
+    def test_tile_serving_versioned(self):
+        with open(os.path.join(self.tile_dir, '0', '0', 'layer.json'), 'w') as manifest:
+            json.dump({'version': '0a1b2c3d4e5f', 'minzoom': 6, 'maxzoom': 6, 'tilesize': 128}, manifest)
+
+        response = self.client.get('/tiles/0/0/v0a1b2c3d4e5f/6/35/23.png', HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+        # Outdated versions are redirected to the current one
+        response = self.client.get('/tiles/0/0/v999999999999/6/35/23.png', HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], '/tiles/0/0/v0a1b2c3d4e5f/6/35/23.png')
+
+        self.assertEqual(self.client.get('/tiles/0/1/v0a1b2c3d4e5f/6/35/23.png').status_code, 404)     # Layer without manifest
+
+    async def test_async_tile_serving(self):
+        request = AsyncRequestFactory().get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/webp')
+        response = await api.views.async_tile_serving(request, '0/0/6/35/23.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response.content, b'webp')
+
+        request = AsyncRequestFactory().get('/tiles/0/0/6/35/99.png')
+        with self.assertRaises(Http404):
+            await api.views.async_tile_serving(request, '0/0/6/35/99.png')
+
+    async def test_async_tile_serving_versioned(self):
+        with open(os.path.join(self.tile_dir, '0', '0', 'layer.json'), 'w') as manifest:
+            json.dump({'version': '0a1b2c3d4e5f', 'minzoom': 6, 'maxzoom': 6, 'tilesize': 128}, manifest)
+
+        request = AsyncRequestFactory().get('/tiles/0/0/v999999999999/6/35/23.png')
+        response = await api.views.async_tile_serving(request, '0/0/v999999999999/6/35/23.png')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], '/tiles/0/0/v0a1b2c3d4e5f/6/35/23.png')
+
+    async def test_async_tile_serving_off_loop(self):
+        # The lookup and the cache, which locks, never run on the thread of the event loop
+        threads: list = []
+        locate, get = api.views.locate_tile, api.views.TILE_CACHE.get
+        def record(function):
+            return lambda *args, **kwargs: threads.append(threading.get_ident()) or function(*args, **kwargs)
+
+        request = AsyncRequestFactory().get('/tiles/0/0/6/35/23.png', headers={'Accept': 'image/png'})
+        with patch('api.views.locate_tile', record(locate)), patch.object(api.views.TILE_CACHE, 'get', record(get)):
+            response = await api.views.async_tile_serving(request, '0/0/6/35/23.png')
+        self.assertEqual(response.content, b'png')
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_tile_serving_offload(self):
+        with self.settings(TILE_SENDFILE='X-Accel-Redirect'):
+            response = self.client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/webp')
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-tiles/0/0/6/35/23.webp')
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            self.assertEqual(response.content, b'')
+
+            response = self.client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/webp', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertNotIn('X-Accel-Redirect', response)
+
+        with self.settings(TILE_SENDFILE='X-Sendfile'):
+            response = self.client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/png')
+            self.assertEqual(response['X-Sendfile'], os.path.abspath(os.path.join(self.tile_dir, '0', '0', '6', '35', '23.png')))
+
+    def test_batch_tile_serving(self):
+        response = self.client.get('/tiles/batch/0/0/', {'tiles': '6/35/23,6/35/24'}, HTTP_ACCEPT='image/webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.dlbackend.tile-bundle')
+
+        records = read_bundle(b''.join(response.streaming_content))
+        self.assertEqual([(r['z'], r['x'], r['y'], r['status']) for r in records], [(6, 35, 23, 200), (6, 35, 24, 404)])
+        self.assertEqual((records[0]['content_type'], records[0]['data']), ('image/webp', b'webp'))
+
+        # A range of columns and rows
+        response = self.client.get('/tiles/batch/0/0/', {'z': 6, 'x': '34-35', 'y': '23'}, HTTP_ACCEPT='image/png')
+        records = read_bundle(b''.join(response.streaming_content))
+        self.assertEqual([(r['x'], r['status'], r['data']) for r in records], [(34, 404, b''), (35, 200, b'png')])
+
+    def test_batch_tile_serving_invalid(self):
+        self.assertEqual(self.client.get('/tiles/batch/0/0/', {'z': 6}).status_code, 400)
+        self.assertEqual(self.client.get('/tiles/batch/0/0/', {'tiles': '6/35'}).status_code, 400)
+        self.assertEqual(self.client.get('/tiles/batch/0/0/', {'z': 6, 'x': '0-63', 'y': '0-63'}).status_code, 400)
+        self.assertEqual(self.client.get('/tiles/batch/0/0/', {'tiles': '5/99999999999/1'}).status_code, 400)
+        self.assertEqual(self.client.get('/tiles/batch/0/0/', {'tiles': '6/35/64'}).status_code, 400)
+        self.assertEqual(self.client.get('/tiles/batch/0/0/', {'tiles': '25/0/0'}).status_code, 400)
+        self.assertEqual(self.client.get('/tiles/batch/0/0/', {'z': 3, 'x': '0-99999999999999999999', 'y': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/tiles/batch/0/0/', {'z': 99999999999, 'x': 0, 'y': 0}).status_code, 400)
+
+    def test_tile_serving_missing_tile(self):
+        response = self.client.get('/tiles/0/0/6/35/99.png')
+        self.assertEqual(response.status_code, 404)
+
+    def test_tile_serving_only_tiles(self):
+        with open(os.path.join(self.tile_dir, '0', '0', 'layer.json'), 'w') as manifest:
+            json.dump({'version': 'a'}, manifest)
+        with open(os.path.join(self.tile_dir, '.popularity.json'), 'w') as table:
+            json.dump({'counts': {}}, table)
+
+        for path in ['/tiles/0/0/layer.json', '/tiles/.popularity.json', '/tiles/0/0/6/35/../35/23.png']:
+            self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_tile_serving_signed(self):
+        expires = int(time.time()) + 600
+        signature = sign_layer(api.views.TILE_SIGNING_KEY, '0/0', expires)
+        with self.settings(TILE_SIGNED_URLS=True):
+            self.assertEqual(self.client.get('/tiles/0/0/6/35/23.png').status_code, 403)
+
+            response = self.client.get(f'/tiles/s/{expires}/{signature}/0/0/6/35/23.png', HTTP_ACCEPT='image/png')
+            self.assertEqual((response.status_code, response.content), (200, b'png'))
+            self.assertLessEqual(int(response['Cache-Control'].split('max-age=')[1].split(',')[0]), 600)      # Not cached beyond the signature
+
+            # Another layer, a changed expiry and an expired signature are rejected
+            self.assertEqual(self.client.get(f'/tiles/s/{expires}/{signature}/0/1/6/35/23.png').status_code, 403)
+            self.assertEqual(self.client.get(f'/tiles/s/{expires + 1}/{signature}/0/0/6/35/23.png').status_code, 403)
+            expired = int(time.time()) - 1
+            self.assertEqual(self.client.get(f'/tiles/s/{expired}/{sign_layer(api.views.TILE_SIGNING_KEY, "0/0", expired)}/0/0/6/35/23.png').status_code, 403)
+
+            # Batched tiles carry the signature in the query
+            self.assertEqual(self.client.get('/tiles/batch/0/0/', {'tiles': '6/35/23'}).status_code, 403)
+            self.assertEqual(self.client.get('/tiles/batch/0/0/', {'tiles': '6/35/23', 'expires': expires, 'signature': signature}).status_code, 200)
+
+        # Signed URLs keep working when signatures are not required
+        self.assertEqual(self.client.get(f'/tiles/s/{expires}/{signature}/0/0/6/35/23.png').status_code, 200)
+
+    def test_tile_serving_signed_stays_in_layer(self):
+        os.makedirs(os.path.join(self.tile_dir, '0', '1', '6', '35'))
+        with open(os.path.join(self.tile_dir, '0', '1', '6', '35', '23.png'), 'wb') as tile:
+            tile.write(b'other')
+        expires = int(time.time()) + 600
+        prefix = f's/{expires}/{sign_layer(api.views.TILE_SIGNING_KEY, "0/0", expires)}/'
+
+        with self.settings(TILE_SIGNED_URLS=True):
+            for path in ['0/0/../1/6/35/23.png', '0/0/6/../../1/6/35/23.png', '0/0/./6/35/23.png', '0/0//6/35/23.png']:
+                response = api.views.tile_serving(RequestFactory().get('/'), prefix + path)
+                self.assertEqual(response.status_code, 403)
+
+    def test_tile_serving_signed_redirect(self):
+        with open(os.path.join(self.tile_dir, '0', '0', 'layer.json'), 'w') as manifest:
+            json.dump({'version': '0a1b2c3d4e5f'}, manifest)
+        expires = int(time.time()) + 600
+        prefix = f'/tiles/s/{expires}/{sign_layer(api.views.TILE_SIGNING_KEY, "0/0", expires)}/'
+
+        response = self.client.get(f'{prefix}0/0/v999999999999/6/35/23.png')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], f'{prefix}0/0/v0a1b2c3d4e5f/6/35/23.png')
+
+
+class TileAppTest(TestCase):
+    def setUp(self):
+        self.tile_dir = tempfile.mkdtemp()
+        self.previous_directory = api.views.TILES_DIRECTORY
+        api.views.TILES_DIRECTORY = self.tile_dir
+
+        os.makedirs(os.path.join(self.tile_dir, '0', '0', '6', '35'))
+        with open(os.path.join(self.tile_dir, '0', '0', '6', '35', '23.png'), 'wb') as tile:
+            tile.write(b'png')
+
+        self.django_app = MagicMock(return_value=[b'django'])
+
+    def tearDown(self):
+        api.views.TILES_DIRECTORY = self.previous_directory
+        shutil.rmtree(self.tile_dir)
+
+    def call_wsgi(self, path: str, **headers):
+        environ = RequestFactory().get(path, **headers).environ
+        start_response = MagicMock()
+        body = b''.join(TileWSGIApp(self.django_app)(environ, start_response))
+        status, response_headers = start_response.call_args[0]
+        return status, dict(response_headers), body
+
+    def test_tile_app_wsgi(self):
+        status, headers, body = self.call_wsgi('/tiles/0/0/6/35/23.png', HTTP_ORIGIN='http://localhost:3000')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(body, b'png')
+        self.assertEqual(headers['access-control-allow-origin'], '*')         # Same CORS headers as behind the middleware stack
+        self.django_app.assert_not_called()
+
+        status, _, _ = self.call_wsgi('/tiles/0/0/6/35/99.png')
+        self.assertEqual(status, '404 Not Found')
+
+        # Preflight requests are answered by the CORS middleware
+        status, headers, _ = self.call_wsgi('/tiles/0/0/6/35/23.png', REQUEST_METHOD='OPTIONS', HTTP_ORIGIN='http://localhost:3000', HTTP_ACCESS_CONTROL_REQUEST_METHOD='GET')
+        self.assertEqual(status, '200 OK')
+        self.assertIn('GET', headers['access-control-allow-methods'])
+
+    def test_tile_app_error(self):
+        with patch('api.views.locate_tile', side_effect=ValueError('broken')), self.assertLogs('django.request', 'ERROR'):
+            status, _, _ = self.call_wsgi('/tiles/0/0/6/35/23.png')
+        self.assertEqual(status, '500 Internal Server Error')
+
+    def test_tile_app_passes_other_requests(self):
+        app = TileWSGIApp(self.django_app)
+        self.assertEqual(app(RequestFactory().get('/api/image/').environ, MagicMock()), [b'django'])
+        self.assertEqual(app(RequestFactory().get('/tiles/dynamic/0/0/6/35/23.png').environ, MagicMock()), [b'django'])
+        self.assertEqual(self.django_app.call_count, 2)
+
+    async def test_tile_app_asgi(self):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/tiles/0/0/6/35/23.png', 'root_path': '', 'query_string': b'',
+                 'headers': [(b'origin', b'http://localhost:3000'), (b'accept', b'image/png')]}
+        await TileASGIApp(MagicMock())(scope, None, send)
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'access-control-allow-origin', b'*'), sent[0]['headers'])
+        self.assertEqual(sent[1]['body'], b'png')
+
+        sent.clear()
+        with patch('api.views.locate_tile', side_effect=ValueError('broken')), self.assertLogs('django.request', 'ERROR'):
+            await TileASGIApp(MagicMock())(scope, None, send)
+        self.assertEqual(sent[0]['status'], 500)
+
+
+class TileCacheTest(TestCase):
+    def setUp(self):
+        self.tile_dir = tempfile.mkdtemp()
+        self.paths = []
+        for name in ['a', 'b', 'c']:
+            self.paths.append(os.path.join(self.tile_dir, f'{name}.png'))
+            with open(self.paths[-1], 'wb') as tile:
+                tile.write(name.encode() * 40)
+
+    def tearDown(self):
+        shutil.rmtree(self.tile_dir)
+
+    def test_tile_cache_lru_eviction(self):
+        cache = TileCache(100)
+        cache.read(self.paths[0])
+        cache.read(self.paths[1])
+        self.assertEqual(cache.read(self.paths[0])[0], b'a' * 40)       # a becomes the most recently used tile
+        cache.read(self.paths[2])                                       # b is evicted to stay within 100 bytes
+
+        self.assertEqual(cache.stats(), {'entries': 2, 'bytes': 80, 'max_bytes': 100, 'hits': 1, 'misses': 3, 'evictions': 1})
+        self.assertEqual(list(cache.entries), [self.paths[0], self.paths[2]])
+
+    def test_tile_cache_reads_changed_files(self):
+        cache = TileCache(100)
+        cache.read(self.paths[0])
+
+        with open(self.paths[0], 'wb') as tile:
+            tile.write(b'new')
+        os.utime(self.paths[0], ns=(0, 10 ** 9))
+
+        self.assertEqual(cache.read(self.paths[0])[0], b'new')
+        self.assertEqual(cache.stats()['misses'], 2)
+        self.assertEqual(cache.stats()['bytes'], 3)
+
+    def test_tile_serving_uses_cache(self):
+        previous_directory, previous_cache = api.views.TILES_DIRECTORY, api.views.TILE_CACHE
+        api.views.TILES_DIRECTORY, api.views.TILE_CACHE = self.tile_dir, TileCache(1000)
+        try:
+            os.makedirs(os.path.join(self.tile_dir, '0', '0', '6', '35'))
+            shutil.copy(self.paths[0], os.path.join(self.tile_dir, '0', '0', '6', '35', '23.png'))
+            client = Client()
+            self.assertEqual(client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/png').content, b'a' * 40)
+            response = client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/png')
+            self.assertEqual(response.content, b'a' * 40)
+            self.assertEqual(api.views.TILE_CACHE.stats()['hits'], 1)
+
+            response = client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/png', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304)
+
+            self.assertEqual(client.get('/tiles/../a.png').status_code, 404)
+        finally:
+            api.views.TILES_DIRECTORY, api.views.TILE_CACHE = previous_directory, previous_cache
+
+
+class SharedTileCacheTest(TestCase):
+    def setUp(self):
+        self.tile_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tile_dir, 'tiles.cache')
+        self.paths = []
+        for name in ['a', 'b', 'c']:
+            self.paths.append(os.path.join(self.tile_dir, f'{name}.png'))
+            with open(self.paths[-1], 'wb') as tile:
+                tile.write(name.encode() * 40)
+
+    def tearDown(self):
+        shutil.rmtree(self.tile_dir)
+
+    def test_shared_tile_cache_between_workers(self):
+        first = SharedTileCache(self.cache_path, 4096, stripes=2)
+        self.assertEqual(first.read(self.paths[0])[0], b'a' * 40)
+
+        # Another worker process finds the tile cached by the first one
+        pid = os.fork()
+        if pid == 0:
+            second = SharedTileCache(self.cache_path, 4096, stripes=2)
+            os._exit(0 if second.read(self.paths[0])[0] == b'a' * 40 and second.stats()['hits'] == 1 else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertEqual(first.stats()['hits'], 1)
+
+        # A changed file is read again
+        with open(self.paths[0], 'wb') as tile:
+            tile.write(b'new')
+        os.utime(self.paths[0], ns=(0, 10 ** 9))
+        self.assertEqual(first.read(self.paths[0])[0], b'new')
+        self.assertEqual(first.stats()['misses'], 2)
+
+    def test_shared_tile_cache_overwrites_oldest(self):
+        cache = SharedTileCache(self.cache_path, 128, stripes=1)        # Room for two records of 60 bytes
+        for path in self.paths:
+            cache.read(path)
+
+        self.assertGreaterEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.read(self.paths[2])[0], b'c' * 40)
+        self.assertEqual(cache.read(self.paths[0])[0], b'a' * 40)      # Overwritten record is read from the file again
+        self.assertEqual(cache.stats()['hits'], 1)
+
+
+class TilePrefetcherTest(TestCase):
+    def setUp(self):
+        self.tile_dir = tempfile.mkdtemp()
+        for z, x, y in [(6, 35, 23), (6, 34, 23), (6, 36, 24), (7, 70, 47), (7, 71, 46), (7, 72, 46)]:
+            os.makedirs(os.path.join(self.tile_dir, '0', '0', str(z), str(x)), exist_ok=True)
+            with open(os.path.join(self.tile_dir, '0', '0', str(z), str(x), f'{y}.png'), 'wb') as tile:
+                tile.write(f'{z}/{x}/{y}'.encode())
+
+    def tearDown(self):
+        shutil.rmtree(self.tile_dir)
+
+    def test_prefetcher_candidates(self):
+        candidates = TilePrefetcher(TileCache(1000), 16, 1).candidates(self.tile_dir, '0/0/6/35/23.png')
+        self.assertEqual(len(candidates), 12)
+        self.assertIn(os.path.join(self.tile_dir, '0', '0', '7', '71', '47.png'), candidates)
+        self.assertEqual(len(TilePrefetcher(TileCache(1000), 16, 1).candidates(self.tile_dir, '0/0/0/0/0.png')), 4)     # No neighbours at zoom 0
+
+    def test_prefetcher_loads_neighbours_and_children(self):
+        cache = TileCache(1000)
+        prefetcher = TilePrefetcher(cache, 16, 2)
+        prefetcher.missed(self.tile_dir, '0/0/6/35/23.png')
+        prefetcher.queue.join()
+
+        # Existing neighbour and children, but not the tile outside of the children of 6/35/23
+        child = os.path.join(self.tile_dir, '0', '0', '7', '71', '46.png')
+        self.assertEqual(sorted(os.path.relpath(path, self.tile_dir) for path in cache.entries),
+                         [os.path.join('0', '0', '6', '34', '23.png'), os.path.join('0', '0', '6', '36', '24.png'),
+                          os.path.join('0', '0', '7', '70', '47.png'), os.path.join('0', '0', '7', '71', '46.png')])
+        self.assertEqual(cache.stats()['hits'] + cache.stats()['misses'], 0)        # Lookups of the prefetcher are not counted
+
+        prefetcher.served(child)
+        prefetcher.served(child)
+        self.assertEqual(prefetcher.stats()['loaded'], 4)
+        self.assertEqual(prefetcher.stats()['hits'], 1)
+        self.assertEqual(prefetcher.stats()['hit_rate'], 0.25)
+
+    def test_prefetcher_serves_relative_directory(self):
+        # The tiles folder is relative by default, the prefetched entries must still be the ones requests look up
+        previous = api.views.TILES_DIRECTORY, api.views.TILE_CACHE, api.views.PREFETCHER
+        cache = TileCache(1000)
+        api.views.TILES_DIRECTORY, api.views.TILE_CACHE, api.views.PREFETCHER = os.path.relpath(self.tile_dir), cache, TilePrefetcher(cache, 16, 1)
+        try:
+            client = Client()
+            client.get('/tiles/0/0/6/35/23.png', HTTP_ACCEPT='image/png')
+            api.views.PREFETCHER.queue.join()
+
+            response = client.get('/tiles/0/0/6/34/23.png', HTTP_ACCEPT='image/png')
+            self.assertEqual(response.content, b'6/34/23')
+            self.assertEqual(cache.stats()['hits'], 1)
+            self.assertEqual(api.views.PREFETCHER.stats()['hits'], 1)
+            self.assertEqual(len(cache.entries), 5)             # The requested tile and four prefetched ones, each stored once
+        finally:
+            api.views.TILES_DIRECTORY, api.views.TILE_CACHE, api.views.PREFETCHER = previous
+
+    def test_prefetcher_bounded_queue(self):
+        prefetcher = TilePrefetcher(TileCache(1000), 3, 1)
+        with patch.object(TilePrefetcher, 'start'):         # No worker takes jobs from the queue
+            prefetcher.missed(self.tile_dir, '0/0/6/35/23.png')
+
+        self.assertEqual(prefetcher.stats()['queued'], 3)
+        self.assertEqual(prefetcher.stats()['dropped'], 9)
+        self.assertEqual(prefetcher.stats()['pending'], 3)
+
+    def test_tile_stats_view(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/tiles/stats/').status_code, 401)
+
+        client.force_authenticate(user=User.objects.create_user(username='viewer', password='viewerpass'))
+        response = client.get('/api/tiles/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hits', response.data['cache'])
+        self.assertIn('hit_rate', response.data['prefetch'])
+
+
+class TilePopularityTest(TestCase):
+    def setUp(self):
+        self.tile_dir = tempfile.mkdtemp()
+        self.table = os.path.join(self.tile_dir, '.popularity.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tile_dir)
+
+    def test_popularity_merges_processes(self):
+        first, second = TilePopularity(), TilePopularity()
+        for _ in range(4):
+            first.record('0/0/6/35/23.png')
+        first.record('0/1/6/35/23.png')
+        second.record('0/1/6/35/23.png')
+        second.record('0/1/6/35/23.png')
+        first.flush(self.table)
+        second.flush(self.table)
+
+        self.assertEqual(first.top(self.table, 10), ['0/0/6/35/23.png', '0/1/6/35/23.png'])
+        self.assertEqual(first.top(self.table, 10, ['0/1']), ['0/1/6/35/23.png'])
+        self.assertEqual(first.top(self.table, 1), ['0/0/6/35/23.png'])
+
+    def test_popularity_capacity_and_decay(self):
+        popularity = TilePopularity(capacity=2, half_life=60)
+        for tile, count in [('a.png', 1), ('b.png', 2), ('c.png', 3)]:
+            for _ in range(count):
+                popularity.record(tile)
+        popularity.flush(self.table)
+        self.assertEqual(popularity.top(self.table, 10), ['c.png', 'b.png'])      # The least requested tile is dropped
+
+        with open(self.table) as file:
+            table = json.load(file)
+        table['updated'] -= 120         # Two half-lives ago
+        with open(self.table, 'w') as file:
+            json.dump(table, file)
+
+        popularity.record('a.png')
+        popularity.flush(self.table)
+        with open(self.table) as file:
+            counts = json.load(file)['counts']
+        self.assertEqual(sorted(counts), ['a.png', 'c.png'])
+        self.assertAlmostEqual(counts['c.png'], 0.75, places=3)
+
+    def test_popularity_published_layers(self):
+        popularity = TilePopularity()
+        os.makedirs(os.path.join(self.tile_dir, '0', '1'))
+        with open(os.path.join(self.tile_dir, '0', '1', 'layer.json'), 'w') as manifest:
+            json.dump({'version': 'a'}, manifest)
+        self.assertEqual(popularity.published_layers(self.tile_dir), [])        # The first check only records the layers
+        self.assertEqual(popularity.published_layers(self.tile_dir), [])
+
+        os.makedirs(os.path.join(self.tile_dir, '1', '0'))
+        with open(os.path.join(self.tile_dir, '1', '0', 'layer.json'), 'w') as manifest:
+            json.dump({'version': 'b'}, manifest)
+        self.assertEqual(popularity.published_layers(self.tile_dir), ['1/0'])
+
+    def test_warm_tile_cache(self):
+        os.makedirs(os.path.join(self.tile_dir, '0', '0', '6', '35'))
+        with open(os.path.join(self.tile_dir, '0', '0', '6', '35', '23.png'), 'wb') as tile:
+            tile.write(b'tile')
+        popularity = TilePopularity()
+        popularity.record('0/0/6/35/23.png')
+        popularity.record('0/0/6/35/24.png')          # Not stored anymore
+        popularity.flush(self.table)
+
+        cache = TileCache(1000)
+        started = []
+        with patch.object(api.views, 'TILES_DIRECTORY', self.tile_dir), patch.object(api.views, 'POPULARITY_TABLE', self.table), patch.object(api.views, 'TILE_CACHE', cache), \
+                patch('api.views.threading.Thread', side_effect=lambda target, daemon: started.append(target) or MagicMock()):
+            api.views.warm_tile_cache()
+            started[0]()
+
+        self.assertEqual(list(cache.entries), [os.path.join(self.tile_dir, '0', '0', '6', '35', '23.png')])
+        self.assertEqual(cache.stats()['hits'] + cache.stats()['misses'], 0)
+
+
+class CatalogViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(username='viewer', password='viewerpass'))
+        self.image_dir = tempfile.mkdtemp()
+        self.previous_directory = api.views.IMAGES_DIRECTORY
+        api.views.IMAGES_DIRECTORY = self.image_dir
+
+        for img_id in range(3):
+            profile = Profile.objects.create(driver='GTiff', dtype='uint16', nodata=None, width=10, height=10, count=1, crs=32634,
+                                             transform='[60, 0, 600000, 0, -60, 4800000]', blockxsize=10, blockysize=10, tiled=False)
+            Image.manager.create(img_id=img_id, title=f'scene{img_id}', profile=profile)
+        image = Image.manager.get(img_id=0)
+        Layer.objects.create(image=image, alg_id=0, version='abc', minzoom=8, maxzoom=12, tilesize=128, west=20.0, south=42.0, east=21.0, north=43.0)
+        Layer.objects.create(image=image, alg_id=1, version='def', minzoom=8, maxzoom=11, tilesize=128, west=20.5, south=41.0, east=21.5, north=42.5)
+
+    def tearDown(self):
+        api.views.IMAGES_DIRECTORY = self.previous_directory
+        shutil.rmtree(self.image_dir)
+        catalog_page.cache_clear()
+
+    def test_catalog_layers(self):
+        response = self.client.get('/api/catalog/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['count'], response.data['pages']), (3, 1))
+
+        image = response.data['results'][0]
+        self.assertEqual(image['title'], 'scene0')
+        self.assertEqual(image['bounds'], [20.0, 41.0, 21.5, 43.0])
+        self.assertEqual([layer['name'] for layer in image['layers']], ['TC', 'NDVI'])
+        self.assertEqual(image['layers'][0]['url'], '/tiles/0/0/vabc/{z}/{x}/{y}.png')
+        self.assertEqual((image['layers'][1]['minzoom'], image['layers'][1]['maxzoom']), (8, 11))
+        self.assertIsNone(response.data['results'][1]['bounds'])
+
+    def test_catalog_signed_urls(self):
+        with self.settings(TILE_SIGNED_URLS=True, TILE_URL_LIFETIME=3600):
+            response = self.client.get('/api/catalog/')
+        expires = response.data['tiles_expire']
+        self.assertGreaterEqual(expires, time.time() + 3600)
+
+        layer = response.data['results'][0]['layers'][0]
+        signature = sign_layer(api.views.TILE_SIGNING_KEY, "0/0", expires)
+        self.assertEqual(layer['url'], f'/tiles/s/{expires}/{signature}/0/0/vabc/{{z}}/{{x}}/{{y}}.png')
+        self.assertEqual((layer['signature'], layer['expires']), (signature, expires))
+
+        # Every algorithm of every image is signed, also images without tiled layers which are only served as dynamic tiles
+        untiled = response.data['results'][2]
+        self.assertEqual(untiled['layers'], [])
+        self.assertEqual([(entry['alg_id'], entry['name']) for entry in untiled['signatures']], [(0, 'TC'), (1, 'NDVI'), (2, 'NDWI'), (3, 'NDMI')])
+        self.assertEqual(untiled['signatures'][3]['signature'], sign_layer(api.views.TILE_SIGNING_KEY, "2/3", expires))
+        self.assertEqual(untiled['signatures'][3]['expires'], expires)
+
+        # The cached page itself is not signed
+        self.assertEqual(self.client.get('/api/catalog/').data['results'][0]['layers'][0]['url'], '/tiles/0/0/vabc/{z}/{x}/{y}.png')
+
+    def test_catalog_pagination(self):
+        response = self.client.get('/api/catalog/', {'page': 2, 'page_size': 2})
+        self.assertEqual((response.data['count'], response.data['pages']), (3, 2))
+        self.assertEqual([image['img_id'] for image in response.data['results']], [2])
+
+        self.assertEqual(self.client.get('/api/catalog/', {'page': 3, 'page_size': 2}).status_code, 404)
+        self.assertEqual(self.client.get('/api/catalog/', {'page': 'x'}).status_code, 400)
+        self.assertEqual(APIClient().get('/api/catalog/').status_code, 401)
+
+    def test_catalog_cached_until_published(self):
+        self.client.get('/api/catalog/')
+        Image.manager.filter(img_id=2).delete()
+        self.assertEqual(self.client.get('/api/catalog/').data['count'], 3)         # Served from memory
+
+        with open(os.path.join(self.image_dir, 'catalog.published'), 'w') as marker:       # Written by the pipeline when it publishes
+            marker.write('1')
+        self.assertEqual(self.client.get('/api/catalog/').data['count'], 2)
+
+class FootprintViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(username='viewer', password='viewerpass'))
+        self.image_dir = tempfile.mkdtemp()
+        self.previous_directory = api.views.IMAGES_DIRECTORY
+        api.views.IMAGES_DIRECTORY = self.image_dir
+        self.previous_index = api.views.FOOTPRINTS
+        api.views.FOOTPRINTS = FootprintIndex()
+
+        # A grid of 1x1 degree scenes, and one image without a footprint
+        for img_id, (west, south) in enumerate([(lon, lat) for lon in range(20, 30) for lat in range(40, 45)] + [(None, None)]):
+            profile = Profile.objects.create(driver='GTiff', dtype='uint16', nodata=None, width=10, height=10, count=1, crs=32634,
+                                             transform='[60, 0, 600000, 0, -60, 4800000]', blockxsize=10, blockysize=10, tiled=False)
+            bounds = {}
+            if west is not None:
+                min_x, min_y, max_x, max_y = rio.warp.transform_bounds('EPSG:4326', 'EPSG:3857', west, south, west + 1, south + 1)
+                bounds = {'west': west, 'south': south, 'east': west + 1, 'north': south + 1, 'min_x': min_x, 'min_y': min_y, 'max_x': max_x, 'max_y': max_y}
+            Image.manager.create(img_id=img_id, title=f'scene{img_id}', profile=profile, **bounds)
+
+    def tearDown(self):
+        api.views.IMAGES_DIRECTORY = self.previous_directory
+        api.views.FOOTPRINTS = self.previous_index
+        shutil.rmtree(self.image_dir)
+
+    def test_footprint_point(self):
+        response = self.client.get('/api/footprints/', {'point': '23.5,42.5'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([image['title'] for image in response.data['results']], ['scene17'])
+        self.assertEqual(response.data['results'][0]['bounds'], [23, 42, 24, 43])
+
+        # On a shared edge both scenes cover the point
+        self.assertEqual(self.client.get('/api/footprints/', {'point': '23,42.5'}).data['count'], 2)
+        self.assertEqual(self.client.get('/api/footprints/', {'point': '0,0'}).data['count'], 0)
+
+    def test_footprint_bbox(self):
+        response = self.client.get('/api/footprints/', {'bbox': '20.5,40.5,21.5,41.5'})
+        self.assertEqual([image['img_id'] for image in response.data['results']], [0, 1, 5, 6])
+
+        x, y = rio.warp.transform('EPSG:4326', 'EPSG:3857', [29.5], [44.5])
+        response = self.client.get('/api/footprints/', {'point': f'{x[0]},{y[0]}', 'crs': 'EPSG:3857'})
+        self.assertEqual([image['img_id'] for image in response.data['results']], [49])
+
+    def test_footprint_reloaded_when_published(self):
+        self.assertEqual(self.client.get('/api/footprints/', {'point': '23.5,42.5'}).data['count'], 1)
+        Image.manager.filter(img_id=17).delete()
+        self.assertEqual(self.client.get('/api/footprints/', {'point': '23.5,42.5'}).data['count'], 1)
+
+        with open(os.path.join(self.image_dir, 'catalog.published'), 'w') as marker:
+            marker.write('1')
+        self.assertEqual(self.client.get('/api/footprints/', {'point': '23.5,42.5'}).data['count'], 0)
+
+    def test_footprint_invalid(self):
+        for query in [{}, {'point': '1'}, {'point': 'a,b'}, {'bbox': '1,1,0,0'}, {'point': '1,1', 'crs': 'EPSG:32634'}]:
+            self.assertEqual(self.client.get('/api/footprints/', query).status_code, 400)
+
+class IndexImageMixin():
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(username='viewer', password='viewerpass'))
+        self.image_dir = tempfile.mkdtemp()
+        self.previous_directory = api.views.IMAGES_DIRECTORY
+        api.views.IMAGES_DIRECTORY = self.image_dir
+        self.previous_index = api.views.FOOTPRINTS
+        api.views.FOOTPRINTS = FootprintIndex()
+
+        # 600x600 pixels of 60m in UTM zone 34N, one constant value per band
+        image = {'img_id': 3, 'title': 'scene'}
+        for band, value in {'b3': 120, 'b4': 200, 'b8': 100}.items():
+            image[band] = os.path.join(self.image_dir, f'scene_{band}.tiff')
+            with rio.open(image[band], 'w', driver='GTiff', width=600, height=600, count=1, dtype='uint8', crs='EPSG:32634',
+                          transform=rio.transform.from_origin(600000.0, 4800000.0, 60.0, 60.0)) as dst:
+                dst.write(np.full((1, 600, 600), value, dtype=np.uint8))
+        with open(os.path.join(self.image_dir, 'images.json'), 'w') as catalog:
+            json.dump({'images': [image]}, catalog)
+
+        west, south, east, north = rio.warp.transform_bounds('EPSG:32634', 'EPSG:4326', 600000.0, 4764000.0, 636000.0, 4800000.0)
+        profile = Profile.objects.create(driver='GTiff', dtype='uint8', nodata=None, width=600, height=600, count=1, crs=32634,
+                                         transform='[60, 0, 600000, 0, -60, 4800000]', blockxsize=600, blockysize=1, tiled=False)
+        Image.manager.create(img_id=3, title='scene', profile=profile, west=west, south=south, east=east, north=north, min_x=0, min_y=0, max_x=0, max_y=0)
+        self.inside = [(west + east) / 2, (south + north) / 2]
+
+    def tearDown(self):
+        api.views.IMAGES_DIRECTORY = self.previous_directory
+        api.views.FOOTPRINTS = self.previous_index
+        shutil.rmtree(self.image_dir)
+
+
+class SampleViewTest(IndexImageMixin, TestCase):
+    def test_sample_image(self):
+        response = self.client.post('/api/sample/', {'img_id': 3, 'alg_id': 1, 'points': [self.inside, [0, 0]]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['img_id'], 3)
+        self.assertAlmostEqual(response.data['results'][0]['values'][0], -1 / 3, places=5)       # NDVI (100 - 200) / (100 + 200)
+        self.assertIsNone(response.data['results'][0]['values'][1])
+
+        response = self.client.post('/api/sample/', {'img_id': 3, 'alg_id': 2, 'points': [self.inside]}, format='json')
+        self.assertAlmostEqual(response.data['results'][0]['values'][0], 20 / 220, places=5)     # NDWI (120 - 100) / (120 + 100)
+
+    def test_sample_all_images(self):
+        response = self.client.post('/api/sample/', {'alg_id': 1, 'points': [self.inside]}, format='json')
+        self.assertEqual([result['img_id'] for result in response.data['results']], [3])
+
+        response = self.client.post('/api/sample/', {'alg_id': 1, 'points': [[0, 0], [1, 1]]}, format='json')
+        self.assertEqual(response.data['results'], [])
+
+    def test_sample_invalid(self):
+        for body in [{}, {'alg_id': 0, 'points': [self.inside]}, {'alg_id': 1, 'points': []}, {'alg_id': 1, 'points': [[1, 2, 3]]},
+                     {'alg_id': 1, 'points': [[0, 0]] * 10001}, {'alg_id': 'x', 'points': [self.inside]}]:
+            self.assertEqual(self.client.post('/api/sample/', body, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/sample/', {'img_id': 9, 'alg_id': 1, 'points': [self.inside]}, format='json').status_code, 404)
+
+class ZonalViewTest(IndexImageMixin, TestCase):
+    def feature(self, feature_id, west, south, east, north):
+        return {'type': 'Feature', 'id': feature_id, 'properties': {},
+                'geometry': {'type': 'Polygon', 'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]}}
+
+    def test_zonal_image(self):
+        lon, lat = self.inside
+        features = {'type': 'FeatureCollection', 'features': [self.feature('field', lon - 0.01, lat - 0.01, lon + 0.01, lat + 0.01), self.feature(None, 0, 0, 1, 1)]}
+        response = self.client.post('/api/zonal/', {'img_id': 3, 'alg_id': 1, 'features': features, 'percentiles': [50]}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        field, outside = response.data['results']
+        self.assertEqual(field['id'], 'field')
+        self.assertGreater(field['count'], 0)
+        self.assertAlmostEqual(field['mean'], -1 / 3)
+        self.assertAlmostEqual(field['percentiles']['50'], -1 / 3, delta=0.01)
+        self.assertEqual((outside['id'], outside['count'], outside['mean']), (None, 0, None))
+
+    def test_zonal_invalid(self):
+        lon, lat = self.inside
+        feature = self.feature(1, lon - 0.01, lat - 0.01, lon + 0.01, lat + 0.01)
+        for body in [{}, {'img_id': 3, 'alg_id': 0, 'features': [feature]}, {'img_id': 3, 'alg_id': 1, 'features': []},
+                     {'img_id': 3, 'alg_id': 1, 'features': [feature], 'percentiles': [101]},
+                     {'img_id': 3, 'alg_id': 1, 'features': [{'geometry': {'type': 'Point', 'coordinates': [lon, lat]}}]}]:
+            self.assertEqual(self.client.post('/api/zonal/', body, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/zonal/', {'img_id': 9, 'alg_id': 1, 'features': [feature]}, format='json').status_code, 404)
+
+class OverzoomTileServingTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.tile_dir = tempfile.mkdtemp()
+        self.previous_directory = api.views.TILES_DIRECTORY
+        api.views.TILES_DIRECTORY = self.tile_dir
+
+        os.makedirs(os.path.join(self.tile_dir, '0', '1', '10', '5'))
+        with open(os.path.join(self.tile_dir, '0', '1', 'layer.json'), 'w') as manifest:
+            json.dump({'minzoom': 9, 'maxzoom': 10, 'tilesize': 128}, manifest)
+
+        # Native tile with a different color in every quadrant
+        tile = PILImage.new('RGBA', (128, 128))
+        tile.paste((255, 0, 0, 255), (0, 0, 64, 64))
+        tile.paste((0, 255, 0, 255), (64, 0, 128, 64))
+        tile.paste((0, 0, 255, 255), (0, 64, 64, 128))
+        tile.paste((255, 255, 255, 255), (64, 64, 128, 128))
+        tile.save(os.path.join(self.tile_dir, '0', '1', '10', '5', '7.png'))
+
+    def tearDown(self):
+        api.views.TILES_DIRECTORY = self.previous_directory
+        shutil.rmtree(self.tile_dir)
+
+    def get_tile(self, path: str) -> PILImage.Image:
+        response = self.client.get(path, HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        return PILImage.open(io.BytesIO(response.content))
+
+    def test_overzoom_tile_uses_the_right_quadrant(self):
+        # TMS rows count from the south, so the northern children have the odd row
+        north_west = self.get_tile('/tiles/0/1/11/10/15.png')
+        self.assertEqual(north_west.size, (128, 128))
+        self.assertEqual(north_west.getpixel((5, 5)), (255, 0, 0, 255))
+        self.assertEqual(north_west.getpixel((120, 120)), (255, 0, 0, 255))
+
+        south_east = self.get_tile('/tiles/0/1/11/11/14.png')
+        self.assertEqual(south_east.getpixel((64, 64)), (255, 255, 255, 255))
+
+        # Two levels deeper still crops from the native tile
+        deeper = self.get_tile('/tiles/0/1/12/23/31.png')
+        self.assertEqual(deeper.getpixel((0, 0)), (0, 255, 0, 255))
+
+    def test_overzoom_tile_not_built_within_native_zoom(self):
+        self.assertEqual(self.client.get('/tiles/0/1/10/5/8.png').status_code, 404)
+
+    def test_overzoom_tile_limited_depth(self):
+        self.assertEqual(self.client.get('/tiles/0/1/16/320/448.png').status_code, 200)
+        self.assertEqual(self.client.get('/tiles/0/1/17/640/896.png').status_code, 404)
+
+class DynamicTileServingTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.image_dir = tempfile.mkdtemp()
+        self.previous_directory = api.views.IMAGES_DIRECTORY
+        api.views.IMAGES_DIRECTORY = self.image_dir
+
+        # 600x600 pixels of 60m in UTM zone 34N, one constant value per band
+        values = {'b2': 60, 'b3': 120, 'b4': 200, 'b8': 100, 'b8a': 100, 'b11': 50}
+        image = {'img_id': 3, 'title': 'scene'}
+        for band, value in values.items():
+            image[band] = os.path.join(self.image_dir, f'scene_{band}.tiff')
+            with rio.open(image[band], 'w', driver='GTiff', width=600, height=600, count=1, dtype='uint8', crs='EPSG:32634',
+                          transform=rio.transform.from_origin(600000.0, 4800000.0, 60.0, 60.0)) as dst:
+                dst.write(np.full((1, 600, 600), value, dtype=np.uint8))
+
+        with open(os.path.join(self.image_dir, 'images.json'), 'w') as catalog:
+            json.dump({'images': [image]}, catalog)
+
+        footprint = rio.warp.transform_bounds('EPSG:32634', 'EPSG:3857', 600000.0, 4764000.0, 636000.0, 4800000.0)
+        x_min, _, y_min, _ = tiles.tile_range(footprint, 11)
+        self.inside = f'11/{x_min + 1}/{y_min + 1}'
+
+    def tearDown(self):
+        api.views.IMAGES_DIRECTORY = self.previous_directory
+        shutil.rmtree(self.image_dir)
+
+    def test_dynamic_tile_true_color(self):
+        response = self.client.get(f'/tiles/dynamic/3/0/{self.inside}.png', HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+        tile = PILImage.open(io.BytesIO(response.content))
+        self.assertEqual(tile.size, (128, 128))
+        self.assertEqual(tile.getpixel((64, 64)), (200, 120, 60, 255))
+
+    def test_dynamic_tile_index(self):
+        response = self.client.get(f'/tiles/dynamic/3/1/{self.inside}.png', HTTP_ACCEPT='image/png')
+        tile = PILImage.open(io.BytesIO(response.content))
+        self.assertEqual(tile.getpixel((64, 64)), (0, 85, 0, 255))        # NDVI of -1/3 stored in the green channel
+
+        # Browsers accepting webp get the smaller variant
+        response = self.client.get(f'/tiles/dynamic/3/1/{self.inside}.png', HTTP_ACCEPT='image/webp,*/*')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('Accept', response['Vary'])
+
+    def test_dynamic_tile_missing(self):
+        self.assertEqual(self.client.get(f'/tiles/dynamic/4/0/{self.inside}.png').status_code, 404)     # Unknown image
+        self.assertEqual(self.client.get(f'/tiles/dynamic/3/7/{self.inside}.png').status_code, 404)     # Unknown algorithm
+        self.assertEqual(self.client.get('/tiles/dynamic/3/0/11/0/0.png').status_code, 404)             # Outside of the image
+
+        catalog_path = os.path.join(self.image_dir, 'images.json')
+        catalog = json.load(open(catalog_path))
+        catalog['images'][0]['b2'] = None           # Recorded by the creator when dumping the band failed
+        with open(catalog_path, 'w') as file:
+            json.dump(catalog, file)
+        self.assertEqual(self.client.get(f'/tiles/dynamic/3/0/{self.inside}.png').status_code, 404)
+        self.assertEqual(self.client.get(f'/tiles/dynamic/3/1/{self.inside}.png').status_code, 200)     # Other bands are still served
+
+
+class TimeSeriesViewTest(IndexImageMixin, TestCase):
+    def test_timeseries(self):
+        from image_util.cube import CubeWriter
+        from image_util.models import Environment
+        image = json.load(open(os.path.join(self.image_dir, 'images.json')))['images'][0]
+        CubeWriter().add_image(Image(img_id=3, title='S2A_MSIL2A_20240323T092031_T34TGL', b4=image['b4'], b8=image['b8']), 1, Environment(create_output=f'{self.image_dir}/'))
+
+        response = self.client.get('/api/timeseries/', {'alg_id': 1, 'point': f'{self.inside[0]},{self.inside[1]}', 'window': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['series'][0]['time'], '20240323T092031')
+        self.assertAlmostEqual(response.data['results'][0]['series'][0]['value'], -1 / 3, places=4)
+
+        response = self.client.get('/api/timeseries/', {'alg_id': 1, 'point': '0,0'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_timeseries_invalid(self):
+        for query in [{'alg_id': 0, 'point': '0,0'}, {'alg_id': 1}, {'alg_id': 1, 'point': '0,0', 'window': 100}]:
+            self.assertEqual(self.client.get('/api/timeseries/', query).status_code, 400)
+
+
+class ExportViewTest(IndexImageMixin, TestCase):
+    def test_export_bbox(self):
+        bbox = f'{self.inside[0] - 0.05},{self.inside[1] - 0.05},{self.inside[0] + 0.05},{self.inside[1] + 0.05}'
+        response = self.client.get('/api/export/', {'img_id': 3, 'alg_id': 1, 'bbox': bbox})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('3_NDVI.tif', response['Content-Disposition'])
+
+        data = b''.join(response.streaming_content)
+        self.assertEqual(len(data), int(response['Content-Length']))
+        with rio.io.MemoryFile(data) as memory, memory.open() as src:
+            values = src.read(1)
+        self.assertAlmostEqual(float(np.nanmean(values)), -1 / 3, places=5)
+
+    def test_export_invalid(self):
+        self.assertEqual(self.client.get('/api/export/', {'img_id': 3, 'alg_id': 1}).status_code, 400)
+        self.assertEqual(self.client.get('/api/export/', {'img_id': 3, 'alg_id': 1, 'bbox': '0,0,1,1'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/export/', {'img_id': 4, 'alg_id': 1, 'bbox': [0, 0, 1, 1]}, format='json').status_code, 404)
+
+
+class StatisticsViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(username='viewer', password='viewerpass'))
+        self.work_dir = tempfile.mkdtemp()
+        self.previous_directory = api.views.TILES_DIRECTORY
+        api.views.TILES_DIRECTORY = self.work_dir
+
+        # NDVI of 600x600 pixels of 60m in UTM zone 34N, 0.5 in the west half and -0.5 in the east half
+        values = np.full((600, 600), 0.5)
+        values[:, 300:] = -0.5
+        rendered = os.path.join(self.work_dir, 'scene_NDVI.tiff')
+        histograms.write_statistics(rendered, values, np.ones((600, 600), dtype=bool),
+                                    {'transform': rio.transform.from_origin(600000.0, 4800000.0, 60.0, 60.0), 'crs': rio.crs.CRS.from_epsg(32634)})
+        os.makedirs(os.path.join(self.work_dir, '3', '1'))
+        with open(os.path.join(self.work_dir, '3', '1', 'layer.json'), 'w') as manifest:
+            json.dump({'source': rendered}, manifest)
+
+    def tearDown(self):
+        api.views.TILES_DIRECTORY = self.previous_directory
+        shutil.rmtree(self.work_dir)
+
+    def test_statistics(self):
+        response = self.client.get('/api/statistics/', {'img_id': 3, 'alg_id': 1, 'percentiles': '10,90'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 360000)
+        self.assertAlmostEqual(response.data['mean'], 0)
+        self.assertAlmostEqual(response.data['percentiles']['10'], -0.495)
+        self.assertEqual(len(response.data['histogram']['counts']), histograms.histogram_bins)
+
+    def test_statistics_bbox(self):
+        # The west part of the image, within the first block of 256 pixels
+        west, south, east, north = rio.warp.transform_bounds('EPSG:32634', 'EPSG:4326', 601000.0, 4790000.0, 610000.0, 4799000.0)
+        response = self.client.get('/api/statistics/', {'img_id': 3, 'alg_id': 1, 'bbox': f'{west},{south},{east},{north}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['blocks'], [0, 0, 1, 1])
+        self.assertEqual((response.data['count'], response.data['mean']), (256 * 256, 0.5))
+
+    def test_statistics_missing(self):
+        self.assertEqual(self.client.get('/api/statistics/', {'img_id': 4, 'alg_id': 1}).status_code, 404)
+        self.assertEqual(self.client.get('/api/statistics/', {'img_id': 3, 'alg_id': 0}).status_code, 400)
@@ -0,0 +1,70 @@
+from corsheaders.middleware import CorsMiddleware
+from django.core.handlers.asgi import ASGIRequest
+from django.core.handlers.exception import response_for_exception
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import Http404, HttpResponseNotFound
+from . import views
+import io
+
+tiles_prefix: str = "/tiles/"
+django_prefixes: tuple[str] = ("/tiles/dynamic/", "/tiles/batch/")      # Rendered and batched tiles stay behind the full Django stack
+
+def is_tile_path(path: str) -> bool:
+    return path.startswith(tiles_prefix) and not path.startswith(django_prefixes)
+
+def serve(request):
+    try:
+        return views.tile_serving(request, request.path_info[len(tiles_prefix):])
+    except Http404:
+        return HttpResponseNotFound()
+    except Exception as e:
+        return response_for_exception(request, e)          # Logged and answered with a 500 like Django does for its views
+
+async def async_serve(request):
+    try:
+        return await views.async_tile_serving(request, request.path_info[len(tiles_prefix):])
+    except Http404:
+        return HttpResponseNotFound()
+    except Exception as e:
+        return response_for_exception(request, e)
+
+
+class TileWSGIApp():
+    """WSGI application answering stored tile requests before they reach Django
+
+    Tile requests skip the middleware chain and URL resolution. They only pass the CORS middleware and
+    the same tile view Django routes them to, so CORS headers, preflight requests and every check of the
+    view behave exactly as behind the full stack. All other requests are passed to the wrapped application.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.handler = CorsMiddleware(serve)
+
+    def __call__(self, environ, start_response):
+        if not is_tile_path(environ.get("PATH_INFO", "")):
+            return self.application(environ, start_response)
+
+        response = self.handler(WSGIRequest(environ))
+        start_response(f"{response.status_code} {response.reason_phrase}", list(response.items()))
+        return response
+
+
+class TileASGIApp():
+    """ASGI application answering stored tile requests before they reach Django (see TileWSGIApp)"""
+
+    def __init__(self, application):
+        self.application = application
+        self.handler = CorsMiddleware(async_serve)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_tile_path(scope["path"]):
+            return await self.application(scope, receive, send)
+
+        response = await self.handler(ASGIRequest(scope, io.BytesIO()))     # Tile requests do not have a body
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [(name.encode("latin1"), value.encode("latin1")) for name, value in response.items()],
+        })
+        await send({"type": "http.response.body", "body": response.content})
@@ -0,0 +1,843 @@
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from django.utils._os import safe_join
+from functools import lru_cache
+from PIL import Image as PILImage
+from image_util import dynamic, tiles
+from image_util.flight import SingleFlight
+from image_util.models import image_catalog_file, TILE_SIZE_INIT
+import base64, fcntl, glob, hashlib, hmac, io, json, mmap, os, queue, re, struct, threading, time
+
+versioned_pattern = re.compile(r"^(?P<layer>\d+/\d+)/v(?P<version>[0-9a-f]+)/(?P<tile>.+)$")                               # img#id/alg#id/v<version>/...
+signed_pattern = re.compile(r"^s/(?P<expires>\d+)/(?P<signature>[A-Za-z0-9_-]+)/(?P<path>(?P<layer>\d+/\d+)/.+)$")                 # s/<expires>/<signature>/img#id/alg#id/...
+tile_pattern = re.compile(r"^(?P<layer>\d+/\d+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.(?P<extension>[a-z]+)$")     # img#id/alg#id/level#id/x/y.ext
+
+manifest_cache_size: int = 256
+overzoom_cache_size: int = 1024     # Number of upscaled tiles kept in memory
+max_overzoom_levels: int = 6        # Deepest level below the native zoom of a layer that is served by upscaling
+dynamic_cache_size: int = 2048      # Number of tiles rendered on request kept in memory
+dynamic_tile_size: int = TILE_SIZE_INIT
+dynamic_encodings: list[str] = ["webp", "png"]      # Encodings offered for tiles rendered on request, by preference
+
+popularity_capacity: int = 10000             # Number of most requested tiles kept in the popularity table
+popularity_half_life: float = 7 * 24 * 60 * 60      # Seconds after which old request counts weigh half
+popularity_flush_every: int = 256            # Requests recorded by a process before they are merged into the table
+popularity_flush_seconds: float = 60.0
+
+tile_flights: SingleFlight = SingleFlight()      # Tiles being built on request, concurrent requests for the same tile wait for one build
+
+max_batch_tiles: int = 256                  # Largest number of tiles returned by one batch request
+bundle_content_type: str = "application/vnd.dlbackend.tile-bundle"
+bundle_record_header = struct.Struct(">BIIHBI")             # z, x, y, status, content type length, data length
+
+shared_cache_magic: bytes = b"DLTILES1"
+shared_cache_stripes: int = 16              # Independently locked parts of the shared cache
+shared_cache_record_bytes: int = 4096       # Expected average size of a cached tile, sets the number of index slots
+shared_cache_min_slots: int = 64
+shared_cache_header = struct.Struct("<8sIIQ")               # magic, stripes, slots per stripe, data bytes per stripe
+shared_stripe_header = struct.Struct("<QQQQ")               # write position, hits, misses, evictions
+shared_slot = struct.Struct("<16sQQI4x")                    # key digest, mtime_ns, write position, length
+shared_record_header = struct.Struct("<16sI")               # key digest, length, in front of the data of every record
+shared_header_bytes: int = 64
+
+
+def variant_path(tiles_directory: str, path_bare: str, accept: str) -> str:
+    """Get the stored variant of a tile best matching the Accept header of the request
+
+    Keyword arguments:
+    - tiles_directory -- The folder where the tiles are stored
+    - path_bare       -- The path of the tile relative to the tiles folder, without extension
+    - accept          -- The value of the Accept header
+
+    Returns:
+    - The relative path of the chosen variant, or None when no acceptable variant is stored
+    """
+
+    available: list[str] = [ext for ext in tiles.preference if os.path.isfile(os.path.join(tiles_directory, f"{path_bare}.{ext}"))]
+    chosen: str = tiles.negotiate_extension(accept, available)
+    return f"{path_bare}.{chosen}" if chosen else None
+
+
+def versioned_path(path: str) -> dict:
+    """Split a tile path containing the version of its layer
+
+    Keyword arguments:
+    - path -- The requested path relative to the tiles folder
+
+    Returns:
+    - Dictionary with the "layer" (img#id/alg#id), the requested "version" and the "tile" path within the layer,
+      or None when the path is not versioned
+    """
+
+    match = versioned_pattern.match(path)
+    return match.groupdict() if match else None
+
+def signing_key(secret: str) -> bytes:
+    # Derived once from the configured secret, so tile signatures cannot be reused for anything else signed with it
+    return hashlib.sha256(f"dlbackend.tile-urls:{secret}".encode()).digest()
+
+def sign_layer(key: bytes, layer: str, expires: int) -> str:
+    """Sign the tile URLs of a layer until the given time
+
+    Keyword arguments:
+    - key     -- The signing key (see signing_key)
+    - layer   -- The layer as img#id/alg#id
+    - expires -- The Unix time after which the signature is no longer accepted
+
+    Returns:
+    - The signature, 22 URL safe characters
+    """
+
+    digest: bytes = hmac.new(key, f"{expires}/{layer}".encode(), hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+def signed_path(path: str) -> dict:
+    """Split a tile path behind a signed prefix
+
+    Keyword arguments:
+    - path -- The requested path relative to the tiles folder
+
+    Returns:
+    - Dictionary with the "expires" time, the "signature", the signed "prefix", the "layer" and the "path" behind the prefix,
+      or None when the path is not signed
+    """
+
+    match = signed_pattern.match(path)
+    if not match:
+        return None
+    return {"expires": int(match["expires"]), "signature": match["signature"], "prefix": f"s/{match['expires']}/{match['signature']}/",
+            "layer": match["layer"], "path": match["path"]}
+
+def plain_path(path: str) -> bool:
+    # Without empty, "." or ".." segments, so a path below a layer cannot leave it
+    return all(part not in ("", ".", "..") for part in path.split("/"))
+
+def valid_signature(key: bytes, layer: str, expires: int, signature: str, now: float) -> bool:
+    # Compared in constant time, so the signature cannot be guessed from response times
+    return expires >= now and hmac.compare_digest(sign_layer(key, layer, expires), signature)
+
+def signature_expiry(now: float, lifetime: int) -> int:
+    # Rounded up to whole lifetimes, so signed URLs stay the same (and cacheable) for a while and are valid for at least one lifetime
+    return (int(now) // lifetime + 2) * lifetime
+
+@lru_cache(maxsize=manifest_cache_size)
+def read_json(json_path: str, mtime_ns: int) -> dict:
+    with open(json_path) as file:           # mtime_ns is only part of the cache key, a rewritten file is read again
+        return json.load(file)
+
+
+def layer_manifest(tiles_directory: str, layer: str) -> dict:
+    """Get the manifest written by the tiler for the given layer
+
+    Keyword arguments:
+    - tiles_directory -- The folder where the tiles are stored
+    - layer           -- The layer as img#id/alg#id
+
+    Returns:
+    - The manifest of the layer, or None if the layer has no manifest
+    """
+
+    manifest_path: str = os.path.join(tiles_directory, layer, tiles.layer_manifest_file)
+    try:
+        return read_json(manifest_path, os.stat(manifest_path).st_mtime_ns)
+    except (OSError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=overzoom_cache_size)
+def upscale(ancestor_path: str, mtime_ns: int, dz: int, x_offset: int, y_offset: int) -> bytes:
+    """Crop the part of an ancestor tile covered by a deeper tile and upscale it to a full tile
+
+    Keyword arguments:
+    - ancestor_path -- The path of the stored ancestor tile
+    - mtime_ns      -- The modification time of the ancestor tile, invalidating cached results when it is retiled
+    - dz            -- The number of zoom levels between the ancestor and the requested tile
+    - x_offset      -- The column of the requested tile within the ancestor, from the west
+    - y_offset      -- The row of the requested tile within the ancestor, from the north
+
+    Returns:
+    - The upscaled tile, encoded in the same format as the ancestor
+    """
+
+    with PILImage.open(ancestor_path) as ancestor:
+        size: int = ancestor.width
+        step: float = size / (2 ** dz)
+        box: tuple = (round(x_offset * step), round(y_offset * step), round((x_offset + 1) * step), round((y_offset + 1) * step))
+
+        tile: PILImage.Image = ancestor.crop(box).resize((size, size), PILImage.Resampling.NEAREST)      # Nearest keeps the look of upsampled pre-generated levels
+
+    extension: str = os.path.splitext(ancestor_path)[1][1:]
+    return tiles.encode_tile(tile, tiles.extension_encodings[extension])
+
+
+def overzoom_tile(tiles_directory: str, path: str, accept: str) -> tuple[bytes, str]:
+    """Build a tile deeper than the native zoom of its layer from the nearest stored ancestor
+
+    Keyword arguments:
+    - tiles_directory -- The folder where the tiles are stored
+    - path            -- The requested tile path relative to the tiles folder (img#id/alg#id/level#id/x/y.ext)
+    - accept          -- The value of the Accept header
+
+    Returns:
+    - The tile data and its content type, or None when the tile cannot be built
+    """
+
+    match = tile_pattern.match(path)
+    if not match:
+        return None
+
+    manifest: dict = layer_manifest(tiles_directory, match["layer"])
+    z, x, y = int(match["z"]), int(match["x"]), int(match["y"])
+    if not manifest or z <= manifest["maxzoom"]:     # Missing tiles within the native zoom range really do not exist
+        return None
+
+    for ancestor_z in range(manifest["maxzoom"], max(z - max_overzoom_levels, manifest["minzoom"]) - 1, -1):
+        dz: int = z - ancestor_z
+        ancestor_x, ancestor_y = x >> dz, y >> dz
+        ancestor_bare: str = f"{match['layer']}/{ancestor_z}/{ancestor_x}/{ancestor_y}"
+
+        if match["extension"] == tiles.base_encoding:
+            ancestor: str = variant_path(tiles_directory, ancestor_bare, accept)
+        else:                                                                   # Explicitly requested variants are only built from the same variant
+            ancestor: str = f"{ancestor_bare}.{match['extension']}" if os.path.isfile(os.path.join(tiles_directory, f"{ancestor_bare}.{match['extension']}")) else None
+
+        if ancestor:
+            ancestor_path: str = os.path.join(tiles_directory, ancestor)
+            y_offset: int = (2 ** dz - 1) - (y - (ancestor_y << dz))            # TMS rows count from the south, image rows from the north
+            key: tuple = (ancestor_path, os.stat(ancestor_path).st_mtime_ns, dz, x - (ancestor_x << dz), y_offset)
+            data: bytes = tile_flights.do(("overzoom",) + key, lambda: upscale(*key))
+            return data, tiles.content_types[os.path.splitext(ancestor)[1][1:]]
+
+    return None
+
+
+def load_into(cache, path: str) -> tuple[bytes, int]:
+    """Read a tile file and store it in the given cache
+
+    Keyword arguments:
+    - cache -- The TileCache or SharedTileCache to store the file in
+    - path  -- The path of the tile file
+
+    Returns:
+    - The content of the file and its modification time in nanoseconds
+    """
+
+    with open(path, "rb") as file:
+        mtime_ns: int = os.fstat(file.fileno()).st_mtime_ns
+        data: bytes = file.read()
+
+    cache.put(path, mtime_ns, data)
+    return data, mtime_ns
+
+
+class TileCache():
+    """In-memory cache of stored tile files with a byte budget and least recently used eviction
+
+    Entries are keyed by the tile path and hold the modification time they were read at,
+    so a retiled file is read again instead of being served stale.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.entries: OrderedDict = OrderedDict()       # path -> (mtime_ns, data), least recently used first
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def get(self, path: str, count: bool = True) -> tuple[bytes, int]:
+        """Get the content of a tile file only when it is cached and did not change since, without reading the file
+
+        Keyword arguments:
+        - path  -- The path of the tile file
+        - count -- (Optional) If the lookup is counted as a hit or miss, lookups of the prefetcher are not
+
+        Returns:
+        - The cached content of the file and its modification time in nanoseconds, or None when it is not cached
+
+        Exceptions:
+        - When the file does not exist
+        """
+
+        mtime_ns: int = os.stat(path).st_mtime_ns
+
+        with self.lock:
+            entry: tuple = self.entries.get(path)
+            if entry is not None and entry[0] == mtime_ns:
+                self.entries.move_to_end(path)
+                self.hits += count
+                return entry[1], mtime_ns
+            self.misses += count
+            return None
+
+    def read(self, path: str) -> tuple[bytes, int]:
+        """Get the content of a tile file, from memory when it did not change since it was cached
+
+        Keyword arguments:
+        - path -- The path of the tile file
+
+        Returns:
+        - The content of the file and its modification time in nanoseconds
+
+        Exceptions:
+        - When the file cannot be read
+        """
+
+        return self.get(path) or load_into(self, path)
+
+    def put(self, path: str, mtime_ns: int, data: bytes):
+        with self.lock:
+            previous: tuple = self.entries.pop(path, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+
+            if len(data) > self.max_bytes:          # Files larger than the whole budget are never cached
+                return
+
+            self.entries[path] = (mtime_ns, data)
+            self.size += len(data)
+
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class SharedTileCache():
+    """Tile file cache in a memory-mapped file shared by all server processes of a node
+
+    The file is split into stripes, each with its own lock, a direct-mapped index and a ring buffer of records.
+    New records overwrite the oldest ones, and an index entry is only used while its record was not overwritten,
+    so readers never see data of another tile. Adding workers does not add cache memory.
+    """
+
+    def __init__(self, path: str, max_bytes: int, stripes: int = shared_cache_stripes):
+        self.path: str = path
+        self.stripes: int = stripes
+        self.stripe_bytes: int = max_bytes // stripes
+        self.slots: int = max(shared_cache_min_slots, self.stripe_bytes // shared_cache_record_bytes)
+        self.stripe_size: int = shared_stripe_header.size + self.slots * shared_slot.size + self.stripe_bytes
+        self.size: int = shared_header_bytes + self.stripes * self.stripe_size
+        self.locks: list[threading.Lock] = [threading.Lock() for _ in range(stripes)]
+        self.map: mmap.mmap = None
+        self.fd: int = None
+        self.open_lock: threading.Lock = threading.Lock()
+
+    def open(self):
+        """Map the cache file, (re)initializing it when it does not exist yet or was made with another geometry"""
+
+        with self.open_lock:
+            if self.map is not None:
+                return
+
+            fd: int = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)          # Only one process initializes the file
+            try:
+                expected: bytes = shared_cache_header.pack(shared_cache_magic, self.stripes, self.slots, self.stripe_bytes)
+                if os.fstat(fd).st_size != self.size or os.pread(fd, shared_cache_header.size, 0) != expected:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)     # Zero filled, so every index slot starts empty
+                    os.pwrite(fd, expected, 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+            self.map = mmap.mmap(fd, self.size)
+            self.fd = fd
+
+    @contextmanager
+    def locked(self, stripe: int):
+        with self.locks[stripe]:                                    # Threads of this process
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, stripe)          # Other processes, one byte of the header per stripe
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, stripe)
+
+    def locate(self, path: str) -> tuple[bytes, int, int]:
+        digest: bytes = hashlib.blake2b(path.encode(), digest_size=16).digest()
+        stripe: int = digest[0] % self.stripes
+        slot: int = int.from_bytes(digest[1:9], "little") % self.slots
+        return digest, stripe, slot
+
+    def stripe_offset(self, stripe: int) -> int:
+        return shared_header_bytes + stripe * self.stripe_size
+
+    def slot_offset(self, stripe: int, slot: int) -> int:
+        return self.stripe_offset(stripe) + shared_stripe_header.size + slot * shared_slot.size
+
+    def data_offset(self, stripe: int, position: int) -> int:
+        return self.stripe_offset(stripe) + shared_stripe_header.size + self.slots * shared_slot.size + position % self.stripe_bytes
+
+    def count(self, stripe: int, field: int):
+        counters: list[int] = list(shared_stripe_header.unpack_from(self.map, self.stripe_offset(stripe)))
+        counters[field] += 1
+        shared_stripe_header.pack_into(self.map, self.stripe_offset(stripe), *counters)
+
+    def get(self, path: str, count: bool = True) -> tuple[bytes, int]:
+        """Get the content of a tile file only when it is cached and did not change since, without reading the file
+
+        Keyword arguments:
+        - path  -- The path of the tile file
+        - count -- (Optional) If the lookup is counted as a hit or miss, lookups of the prefetcher are not
+
+        Returns:
+        - The cached content of the file and its modification time in nanoseconds, or None when it is not cached
+
+        Exceptions:
+        - When the file does not exist
+        """
+
+        mtime_ns: int = os.stat(path).st_mtime_ns
+        self.open()
+        digest, stripe, slot = self.locate(path)
+
+        with self.locked(stripe):
+            head: int = shared_stripe_header.unpack_from(self.map, self.stripe_offset(stripe))[0]
+            key, cached_mtime_ns, position, length = shared_slot.unpack_from(self.map, self.slot_offset(stripe, slot))
+            record: int = shared_record_header.size + length
+
+            # The record is still intact while the ring did not wrap past its position
+            if key == digest and cached_mtime_ns == mtime_ns and head <= position + self.stripe_bytes \
+                    and shared_record_header.unpack_from(self.map, self.data_offset(stripe, position)) == (digest, length):
+                start: int = self.data_offset(stripe, position) + shared_record_header.size
+                data: bytes = self.map[start:start + length]
+                if count:
+                    self.count(stripe, 1)
+                return data, mtime_ns
+
+            if count:
+                self.count(stripe, 2)
+            return None
+
+    def read(self, path: str) -> tuple[bytes, int]:
+        """Get the content of a tile file, from shared memory when it did not change since it was cached
+
+        Keyword arguments:
+        - path -- The path of the tile file
+
+        Returns:
+        - The content of the file and its modification time in nanoseconds
+
+        Exceptions:
+        - When the file cannot be read
+        """
+
+        return self.get(path) or load_into(self, path)
+
+    def put(self, path: str, mtime_ns: int, data: bytes):
+        record: int = shared_record_header.size + len(data)
+        if record > self.stripe_bytes:              # Files larger than a stripe are never cached
+            return
+
+        self.open()
+        digest, stripe, slot = self.locate(path)
+
+        with self.locked(stripe):
+            head, hits, misses, evictions = shared_stripe_header.unpack_from(self.map, self.stripe_offset(stripe))
+            key, _, position, _ = shared_slot.unpack_from(self.map, self.slot_offset(stripe, slot))
+
+            if key not in (digest, bytes(16)) and head <= position + self.stripe_bytes:     # Another cached tile uses the same slot
+                evictions += 1
+
+            start: int = head
+            if head % self.stripe_bytes + record > self.stripe_bytes:      # Records never wrap, continue at the start of the ring
+                start += self.stripe_bytes - head % self.stripe_bytes
+            if start > 0 and start % self.stripe_bytes == 0:
+                evictions += 1                                              # The ring wrapped and overwrites the oldest records
+
+            offset: int = self.data_offset(stripe, start)
+            shared_record_header.pack_into(self.map, offset, digest, len(data))
+            self.map[offset + shared_record_header.size:offset + record] = data
+            shared_slot.pack_into(self.map, self.slot_offset(stripe, slot), digest, mtime_ns, start, len(data))
+            shared_stripe_header.pack_into(self.map, self.stripe_offset(stripe), start + record, hits, misses, evictions)
+
+    def stats(self) -> dict:
+        self.open()
+        totals: list[int] = [0, 0, 0]
+        for stripe in range(self.stripes):
+            with self.locked(stripe):
+                _, hits, misses, evictions = shared_stripe_header.unpack_from(self.map, self.stripe_offset(stripe))
+            totals = [totals[0] + hits, totals[1] + misses, totals[2] + evictions]
+
+        return {"path": self.path, "max_bytes": self.stripes * self.stripe_bytes, "hits": totals[0], "misses": totals[1], "evictions": totals[2]}
+
+    def clear(self):
+        self.open()
+        for stripe in range(self.stripes):
+            with self.locked(stripe):
+                start: int = self.stripe_offset(stripe)
+                self.map[start:start + shared_stripe_header.size + self.slots * shared_slot.size] = bytes(shared_stripe_header.size + self.slots * shared_slot.size)
+
+
+class TilePrefetcher():
+    """Loads the neighbours and children of missed tiles into the tile cache in the background
+
+    A client which requested a tile almost always requests the tiles around it next, or its four children
+    after zooming in. Prefetch jobs wait in a bounded queue, new jobs are dropped when it is full, and a fixed
+    number of worker threads load them. Requests answered from a prefetched cache entry are counted as hits.
+    """
+
+    def __init__(self, cache, max_queue: int, workers: int, tracked: int = 4096):
+        self.cache = cache
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.workers: int = workers
+        self.started: bool = False
+        self.prefetched: OrderedDict = OrderedDict()        # Paths loaded by the prefetcher which were not requested yet
+        self.tracked: int = tracked
+        self.lock: threading.Lock = threading.Lock()
+        self.counters: dict[str, int] = {"queued": 0, "dropped": 0, "loaded": 0, "hits": 0}
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+
+        for _ in range(self.workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def candidates(self, tiles_directory: str, tile: str) -> list[str]:
+        """Get the paths of the tiles likely requested after the given one: its eight neighbours and four children
+
+        Keyword arguments:
+        - tiles_directory -- The folder where the tiles are stored
+        - tile            -- The path of the stored tile variant relative to the tiles folder (img#id/alg#id/level#id/x/y.ext)
+
+        Returns:
+        - The absolute paths of the candidate tiles in the same layer and variant, which may not exist. They are
+          joined like the views locate tiles, so the cache entries are found by the requests
+        """
+
+        match = tile_pattern.match(tile)
+        if not match:
+            return []
+
+        z, x, y = int(match["z"]), int(match["x"]), int(match["y"])
+        neighbours: list = [(z, x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+        children: list = [(z + 1, 2 * x + dx, 2 * y + dy) for dx in (0, 1) for dy in (0, 1)]
+
+        return [safe_join(tiles_directory, match["layer"], str(cz), str(cx), f"{cy}.{match['extension']}")
+                for cz, cx, cy in neighbours + children if 0 <= cx < 2 ** cz and 0 <= cy < 2 ** cz]
+
+    def missed(self, tiles_directory: str, tile: str):
+        """Queue the prefetching of the tiles around a tile which was not in the cache, without waiting"""
+
+        if self.workers <= 0:
+            return
+        self.start()
+
+        for path in self.candidates(tiles_directory, tile):
+            try:
+                self.queue.put_nowait(path)
+                counter: str = "queued"
+            except queue.Full:
+                counter: str = "dropped"
+            with self.lock:
+                self.counters[counter] += 1
+
+    def served(self, path: str):
+        """Record that a tile was answered from the cache, counting a hit when the prefetcher loaded it"""
+
+        with self.lock:
+            if self.prefetched.pop(path, None) is not None:
+                self.counters["hits"] += 1
+
+    def work(self):
+        while True:
+            path: str = self.queue.get()
+            try:
+                if os.path.isfile(path) and self.cache.get(path, count=False) is None:
+                    load_into(self.cache, path)
+                    with self.lock:
+                        self.counters["loaded"] += 1
+                        self.prefetched[path] = True
+                        while len(self.prefetched) > self.tracked:
+                            self.prefetched.popitem(last=False)
+            except OSError:
+                pass
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        with self.lock:
+            loaded: int = self.counters["loaded"]
+            return dict(self.counters, pending=self.queue.qsize(), workers=self.workers,
+                        hit_rate=self.counters["hits"] / loaded if loaded else 0.0)
+
+class TilePopularity():
+    """Rolling table of how often every stored tile variant is requested
+
+    Each process counts its requests in memory and regularly merges them into a table shared by all processes,
+    in which older counts decay with a half-life and only the most requested tiles are kept. The table survives
+    restarts and is used to warm the tile cache.
+    """
+
+    def __init__(self, capacity: int = popularity_capacity, half_life: float = popularity_half_life):
+        self.capacity: int = capacity
+        self.half_life: float = half_life
+        self.pending: Counter = Counter()
+        self.lock: threading.Lock = threading.Lock()
+        self.flushed_at: float = time.monotonic()
+        self.layers: dict[str, int] = None          # Modification times of the layer manifests when they were last checked
+
+    def record(self, tile: str) -> bool:
+        """Count a request of a stored tile variant
+
+        Keyword arguments:
+        - tile -- The path of the served tile relative to the tiles folder (img#id/alg#id/level#id/x/y.ext)
+
+        Returns:
+        - True when the pending counts should be merged into the table
+        """
+
+        with self.lock:
+            self.pending[tile] += 1
+            return sum(self.pending.values()) >= popularity_flush_every or time.monotonic() - self.flushed_at >= popularity_flush_seconds
+
+    def load(self, table_path: str) -> dict:
+        try:
+            with open(table_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {"updated": time.time(), "counts": {}}
+
+    def flush(self, table_path: str):
+        """Merge the counts of this process into the table
+
+        Keyword arguments:
+        - table_path -- The path of the popularity table
+        """
+
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.flushed_at = time.monotonic()
+        if not pending:
+            return
+
+        with open(f"{table_path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)        # Processes merge one after the other
+            table: dict = self.load(table_path)
+
+            now: float = time.time()
+            decay: float = 0.5 ** (max(now - table["updated"], 0) / self.half_life)
+            counts: Counter = Counter({tile: count * decay for tile, count in table["counts"].items()})
+            counts.update(pending)
+
+            with open(f"{table_path}.tmp", "w") as file:
+                json.dump({"updated": now, "counts": dict(counts.most_common(self.capacity))}, file)
+            os.replace(f"{table_path}.tmp", table_path)
+
+    def top(self, table_path: str, count: int, layers: list[str] = None) -> list[str]:
+        """Get the most requested tiles
+
+        Keyword arguments:
+        - table_path -- The path of the popularity table
+        - count      -- The number of tiles to return
+        - layers     -- (Optional) Only return tiles of these layers (img#id/alg#id)
+
+        Returns:
+        - The paths of the tiles relative to the tiles folder, most requested first
+        """
+
+        counts: dict = self.load(table_path)["counts"]
+        ranked: list[str] = sorted(counts, key=counts.get, reverse=True)
+        if layers is not None:
+            ranked = [tile for tile in ranked if "/".join(tile.split("/")[:2]) in layers]
+        return ranked[:count]
+
+    def published_layers(self, tiles_directory: str) -> list[str]:
+        """Get the layers whose manifest was written since the last call, the first call only records the current state
+
+        Keyword arguments:
+        - tiles_directory -- The folder where the tiles are stored
+
+        Returns:
+        - The newly published or retiled layers (img#id/alg#id)
+        """
+
+        current: dict[str, int] = {}
+        for manifest_path in glob.glob(os.path.join(tiles_directory, "*", "*", tiles.layer_manifest_file)):
+            try:
+                current["/".join(os.path.relpath(manifest_path, tiles_directory).split(os.sep)[:2])] = os.stat(manifest_path).st_mtime_ns
+            except OSError:
+                pass
+
+        with self.lock:
+            previous, self.layers = self.layers, current
+        if previous is None:
+            return []
+        return [layer for layer, mtime_ns in current.items() if previous.get(layer) != mtime_ns]
+
+def batch_tiles(query: dict) -> list[tuple[int, int, int]]:
+    """Get the tiles requested by a batch request
+
+    Keyword arguments:
+    - query -- The query parameters of the request, either "tiles" as a comma separated list of z/x/y,
+               or "z" with "x" and "y" as a single column/row or an inclusive range such as 10-15
+
+    Returns:
+    - The list of requested (z, x, y) tiles
+
+    Exceptions:
+    - When the parameters are missing or invalid, a tile lies outside of the grid of its zoom level,
+      or more than max_batch_tiles tiles are requested
+    """
+
+    def span(value: str, z: int) -> range:
+        first, _, last = value.partition("-")
+        first, last = int(first), int(last or first)
+        if first < 0 or last >= 2 ** z:            # Before len(), which cannot count ranges beyond the size of a C integer
+            raise ValueError("Tiles must lie within the grid of their zoom level")
+        return range(first, last + 1)
+
+    try:
+        if query.get("tiles"):
+            requested: list = [tuple(int(part) for part in tile.split("/")) for tile in query["tiles"].split(",")]
+        else:
+            z: int = int(query["z"])
+            if not 0 <= z <= tiles.max_zoom_level:
+                raise ValueError("Tiles must be given as z/x/y")
+            xs, ys = span(query["x"], z), span(query["y"], z)
+            if len(xs) * len(ys) > max_batch_tiles:
+                raise ValueError(f"At most {max_batch_tiles} tiles can be requested at once")
+            requested: list = [(z, x, y) for x in xs for y in ys]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Missing batch parameter {e}")
+
+    if len(requested) > max_batch_tiles:
+        raise ValueError(f"At most {max_batch_tiles} tiles can be requested at once")
+    if any(len(tile) != 3 or not 0 <= tile[0] <= tiles.max_zoom_level or min(tile) < 0 for tile in requested):
+        raise ValueError("Tiles must be given as z/x/y")
+    if any(x >= 2 ** z or y >= 2 ** z for z, x, y in requested):          # Checked before streaming, the records could not encode them
+        raise ValueError("Tiles must lie within the grid of their zoom level")
+    return requested
+
+
+def bundle_record(z: int, x: int, y: int, content: tuple[bytes, str]) -> bytes:
+    """Encode one tile of a batch response
+
+    Every record starts with a big-endian header of z (1 byte), x and y (4 bytes each), the HTTP status
+    of the tile (2 bytes), the length of the content type (1 byte) and the length of the data (4 bytes),
+    followed by the content type and the tile data. Missing tiles have status 404 and no data.
+
+    Keyword arguments:
+    - z, x, y -- The TMS coordinates of the tile
+    - content -- The tile data and its content type, or None when the tile does not exist
+
+    Returns:
+    - The encoded record
+    """
+
+    data, content_type = content if content else (b"", "")
+    return bundle_record_header.pack(z, x, y, 200 if content else 404, len(content_type), len(data)) + content_type.encode() + data
+
+
+def read_bundle(bundle: bytes) -> list[dict]:
+    """Decode a batch response (see bundle_record)
+
+    Keyword arguments:
+    - bundle -- The complete body of a batch response
+
+    Returns:
+    - List of dictionaries with z, x, y, status, content_type and data of every tile
+    """
+
+    records: list[dict] = []
+    offset: int = 0
+    while offset < len(bundle):
+        z, x, y, status, type_length, data_length = bundle_record_header.unpack_from(bundle, offset)
+        offset += bundle_record_header.size
+        content_type: str = bundle[offset:offset + type_length].decode()
+        data: bytes = bundle[offset + type_length:offset + type_length + data_length]
+        offset += type_length + data_length
+        records.append({"z": z, "x": x, "y": y, "status": status, "content_type": content_type, "data": data})
+    return records
+
+
+def image_bands(images_directory: str, img_id: int) -> dict:
+    """Get the band files of the given image from the catalog written by the creator
+
+    Keyword arguments:
+    - images_directory -- The folder where the band files of the created images are stored
+    - img_id           -- The ID of the image
+
+    Returns:
+    - Dictionary of band name (b2, b3, ...) to band file path, or None if the image is not in the catalog
+    """
+
+    catalog_path: str = os.path.join(images_directory, image_catalog_file)
+    try:
+        catalog: dict = read_json(catalog_path, os.stat(catalog_path).st_mtime_ns)
+    except (OSError, ValueError):
+        return None
+
+    return next((image for image in catalog["images"] if image["img_id"] == img_id), None)
+
+
+@lru_cache(maxsize=dynamic_cache_size)
+def render_dynamic(band_paths: tuple, mtimes_ns: tuple, alg_id: int, z: int, x: int, y: int, encoding: str) -> bytes:
+    """Render and encode a tile from band files, keeping the result in memory
+
+    Keyword arguments:
+    - band_paths -- The paths of the band files of the algorithm
+    - mtimes_ns  -- The modification times of the band files, invalidating cached results when an image is recreated
+    - alg_id     -- The ID of the algorithm ( 0 - TC | 1 - NDVI | 2 - NDWI | 3 - NDMI )
+    - z, x, y    -- The TMS coordinates of the tile
+    - encoding   -- The encoding of the result (see tiles.tile_encodings)
+
+    Returns:
+    - The encoded tile, or None when the tile does not contain any data
+    """
+
+    tile: PILImage.Image = dynamic.render_tile(list(band_paths), alg_id, z, x, y, dynamic_tile_size)
+    return tiles.encode_tile(tile, encoding) if tile is not None else None
+
+
+def dynamic_tile(images_directory: str, img_id: int, alg_id: int, z: int, x: int, y: int, extension: str, accept: str) -> tuple[bytes, str]:
+    """Build a tile of an image directly from its band files, without a rendered and tiled layer
+
+    Keyword arguments:
+    - images_directory -- The folder where the band files of the created images are stored
+    - img_id           -- The ID of the image
+    - alg_id           -- The ID of the algorithm ( 0 - TC | 1 - NDVI | 2 - NDWI | 3 - NDMI )
+    - z, x, y          -- The TMS coordinates of the tile
+    - extension        -- The requested file extension, png tiles are negotiated using the Accept header
+    - accept           -- The value of the Accept header
+
+    Returns:
+    - The tile data and its content type, or None when the tile cannot be built
+    """
+
+    image: dict = image_bands(images_directory, img_id)
+    if image is None or alg_id not in dynamic.algorithms or z > tiles.max_zoom_level or x >= 2 ** z or y >= 2 ** z:
+        return None
+
+    if extension == tiles.base_encoding:
+        chosen: str = tiles.negotiate_extension(accept, [tiles.tile_encodings[encoding]["extension"] for encoding in dynamic_encodings])
+    else:
+        chosen: str = extension if extension in [tiles.tile_encodings[encoding]["extension"] for encoding in dynamic_encodings] else None
+    if chosen is None:
+        return None
+
+    band_paths: tuple = tuple(image.get(band) for band in dynamic.algorithms[alg_id]["bands"])
+    if not all(band_paths):             # Bands whose creation failed are recorded without a path
+        return None
+    try:
+        mtimes_ns: tuple = tuple(os.stat(path).st_mtime_ns for path in band_paths)
+    except OSError:
+        return None
+
+    key: tuple = (band_paths, mtimes_ns, alg_id, z, x, y, tiles.extension_encodings[chosen])
+    data: bytes = tile_flights.do(("dynamic",) + key, lambda: render_dynamic(*key))
+    return (data, tiles.content_types[chosen]) if data is not None else None
@@ -4,4 +4,12 @@ from . import views
 urlpatterns = [
     # connecting serve image function
     path("image/", views.serve_image, name="serve-image"),
+    path("tiles/stats/", views.TileStatsView.as_view(), name="tile-stats"),
+    path("catalog/", views.CatalogView.as_view(), name="catalog"),
+    path("footprints/", views.FootprintView.as_view(), name="footprints"),
+    path("sample/", views.SampleView.as_view(), name="sample"),
+    path("zonal/", views.ZonalView.as_view(), name="zonal"),
+    path("timeseries/", views.TimeSeriesView.as_view(), name="timeseries"),
+    path("export/", views.ExportView.as_view(), name="export"),
+    path("statistics/", views.StatisticsView.as_view(), name="statistics"),
 ]
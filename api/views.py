@@ -2,27 +2,327 @@ from django.contrib.auth.models import User  # import the User model
 from rest_framework import generics
 from .serializers import UserSerializer
 from rest_framework.permissions import AllowAny
-from django.http import FileResponse, Http404
-from django.views.static import serve
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.paginator import InvalidPage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect, StreamingHttpResponse
+from django.urls import reverse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from image_util import cube, dynamic, export, histograms, sampling, tiles, zonal
+from .analysis import json_values, layer_statistics, parse_export, parse_samples, parse_series, parse_statistics, parse_zonal
+from .catalog import catalog_page, catalog_page_size, max_catalog_page_size, published, sign_catalog
+from .footprints import FootprintIndex, parse_query
+from .overviews import parse_overview, image_overview, render_overview, overview_encoding
+from .tiles import SharedTileCache, TileCache, TilePopularity, TilePrefetcher, image_bands, load_into, tile_flights, tile_pattern, variant_path, versioned_path, layer_manifest, overzoom_tile, dynamic_tile, \
+    batch_tiles, bundle_record, bundle_content_type, plain_path, signature_expiry, signed_path, signing_key, valid_signature
+from urllib.parse import quote
+import asyncio
+import mimetypes
 import os
-import logging
+import threading
+import time
 
 TILES_DIRECTORY = 'image_data/tiles/'
+IMAGES_DIRECTORY = 'image_data/images/'
+OVERVIEW_IMAGE = os.path.join(os.path.dirname(__file__), '../image_data/compressed.webp')
+immutable_max_age = 365 * 24 * 60 * 60     # Lifetime of tiles requested through a versioned layer URL
+# Worker processes on a node share one cache when a shared cache file is configured
+TILE_CACHE = SharedTileCache(settings.TILE_SHARED_CACHE, settings.TILE_CACHE_BYTES) if settings.TILE_SHARED_CACHE else TileCache(settings.TILE_CACHE_BYTES)
+PREFETCHER = TilePrefetcher(TILE_CACHE, settings.TILE_PREFETCH_QUEUE, settings.TILE_PREFETCH_WORKERS)
+POPULARITY = TilePopularity()
+POPULARITY_TABLE = settings.TILE_POPULARITY_FILE
+FOOTPRINTS = FootprintIndex()
+TILE_SIGNING_KEY = signing_key(settings.TILE_SIGNING_KEY or settings.SECRET_KEY)
+
+def warm_tile_cache(layers: list[str] = None):
+    """Load the most requested tiles into the tile cache in the background, requests are served meanwhile
+
+    Keyword arguments:
+    - layers -- (Optional) Only warm the tiles of these layers (img#id/alg#id), for example after they were retiled
+    """
+
+    def warm():
+        for tile in POPULARITY.top(POPULARITY_TABLE, settings.TILE_WARM_COUNT, layers):
+            try:
+                path: str = safe_join(TILES_DIRECTORY, tile)
+                if TILE_CACHE.get(path, count=False) is None:
+                    load_into(TILE_CACHE, path)
+            except (OSError, SuspiciousFileOperation):
+                pass            # Tiles which are not stored anymore
+
+    if settings.TILE_WARM_COUNT > 0:
+        threading.Thread(target=warm, daemon=True).start()
+
+def record_request(tile: str):
+    # Counts the request in the popularity table and warms the layers which were published in the meantime
+    if POPULARITY.record(tile):
+        def flush():
+            POPULARITY.flush(POPULARITY_TABLE)
+            published: list[str] = POPULARITY.published_layers(TILES_DIRECTORY)
+            if published:
+                warm_tile_cache(published)
+
+        threading.Thread(target=flush, daemon=True).start()
+
+def tile_response(request, data: bytes, content_type: str, etag: str = None, last_modified: int = None, immutable: bool = False, vary: bool = False):
+    # Strong ETag from the tile content, so unchanged tiles are revalidated with a 304 without sending the data again
+    etag = etag or f'"{tiles.content_hash(data)}"'
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(data, content_type=content_type)
+
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+
+    if immutable:           # The content behind a versioned URL never changes
+        patch_cache_control(response, public=True, max_age=immutable_max_age, immutable=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    if vary:
+        patch_vary_headers(response, ["Accept"])
+    return response
+
+def locate_tile(path: str, accept: str) -> dict:
+    """Resolve a requested tile path to the stored file to serve, without reading it
+
+    Returns a dictionary with either the "redirect" path of an outdated versioned URL, or the unversioned "path",
+    the chosen stored variant as "tile" and "file" (None when not stored), and the "immutable" and "vary" flags.
+    """
+
+    versioned = versioned_path(path)
+    if versioned:
+        # img#id/alg#id/v<version>/level#id/x/y, the version changes whenever the layer is retiled
+        manifest: dict = layer_manifest(TILES_DIRECTORY, versioned["layer"])
+        if manifest is None:
+            raise Http404
+        if manifest["version"] != versioned["version"]:
+            return {"redirect": f"{versioned['layer']}/v{manifest['version']}/{versioned['tile']}"}
+        path = f"{versioned['layer']}/{versioned['tile']}"
+
+    if not tile_pattern.match(path):
+        raise Http404           # Only tiles are served from the tiles folder, not manifests or other files kept there
+
+    path_bare, extension = os.path.splitext(path)
+    negotiated: bool = extension == f".{tiles.base_encoding}"       # Explicitly requested variants are served as they are
+
+    # Pick the stored variant the client accepts, preferring webp, then jpg, then png (see tiles.preference)
+    tile: str = variant_path(TILES_DIRECTORY, path_bare, accept) if negotiated else path
+    try:
+        file: str = safe_join(TILES_DIRECTORY, tile) if tile else None
+    except SuspiciousFileOperation:
+        file = None
+
+    return {"path": path, "tile": tile, "file": file, "immutable": bool(versioned), "vary": negotiated}
+
+def authorize_tile(path: str) -> dict:
+    """Check the signed prefix of a requested tile path, in memory and without a database or session lookup
+
+    Returns a dictionary with the "path" behind the prefix, the signed "prefix" (empty when unsigned) and the "expires"
+    time of the signature (None when unsigned), or None when the signature is invalid or expired, or when signed
+    URLs are required and the path is not signed.
+    """
+
+    signed: dict = signed_path(path)
+    if signed is None:
+        return None if settings.TILE_SIGNED_URLS else {"path": path, "prefix": "", "expires": None}
+    if not plain_path(signed["path"]):
+        return None             # The signature only covers the layer, the tile path must stay inside it
+    if not valid_signature(TILE_SIGNING_KEY, signed["layer"], signed["expires"], signed["signature"], time.time()):
+        return None
+    return {"path": signed["path"], "prefix": signed["prefix"], "expires": signed["expires"]}
+
+def authorize_layer(request, layer: str) -> bool:
+    # Tiles of other routes are signed with the expires and signature query parameters of the layer
+    signature: str = request.GET.get("signature")
+    if not signature:
+        return not settings.TILE_SIGNED_URLS
+    try:
+        return valid_signature(TILE_SIGNING_KEY, layer, int(request.GET.get("expires", "")), signature, time.time())
+    except (TypeError, ValueError):
+        return False
+
+def forbidden_response():
+    response = HttpResponseForbidden()
+    patch_cache_control(response, no_store=True)
+    return response
+
+def signed_response(response, authorized: dict):
+    # Responses to a signed URL are not cached beyond the signature
+    if authorized["expires"] is not None:
+        patch_cache_control(response, max_age=max(authorized["expires"] - int(time.time()), 0))
+    return response
+
+def redirect_response(location: dict, prefix: str = ""):
+    response = HttpResponseRedirect(reverse("tile_serving", kwargs={"path": prefix + location["redirect"]}))
+    patch_cache_control(response, no_cache=True)
+    return response
+
+def stored_content_type(tile: str) -> str:
+    return tiles.content_types.get(os.path.splitext(tile)[1][1:]) or mimetypes.guess_type(tile)[0] or "application/octet-stream"
+
+def stored_response(request, location: dict, data: bytes, mtime_ns: int):
+    return tile_response(request, data, stored_content_type(location["tile"]), last_modified=mtime_ns // 1_000_000_000, immutable=location["immutable"], vary=location["vary"])
+
+def offload_response(request, location: dict):
+    # The front server sends the file itself (sendfile), Django only answers with the headers.
+    # The ETag is taken from the file identity, because the content is never read here
+    stat = os.stat(location["file"])
+    response = tile_response(request, b"", stored_content_type(location["tile"]), etag=f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+                             last_modified=stat.st_mtime_ns // 1_000_000_000, immutable=location["immutable"], vary=location["vary"])
+
+    if response.status_code == 200:
+        if settings.TILE_SENDFILE == "X-Accel-Redirect":
+            response["X-Accel-Redirect"] = f"{settings.TILE_SENDFILE_PREFIX}{quote(location['tile'])}"
+        else:
+            response["X-Sendfile"] = os.path.abspath(location["file"])
+    return response
+
+def overzoomed_response(request, location: dict, overzoomed: tuple):
+    # Tiles deeper than the native zoom of the layer are built from their nearest stored ancestor
+    if overzoomed is None:
+        raise Http404
+    return tile_response(request, overzoomed[0], overzoomed[1], immutable=location["immutable"], vary=location["vary"])
 
 def tile_serving(request, path):
-    tile_dir = os.path.join(os.path.dirname(__file__), '../image_data/tiles')
-    tile_path = os.path.join(TILES_DIRECTORY, path)
+    authorized: dict = authorize_tile(path)
+    if authorized is None:
+        return forbidden_response()
+    return signed_response(serve_tile(request, authorized), authorized)
+
+def serve_tile(request, authorized: dict):
+    accept: str = request.headers.get("Accept", "")
+    location: dict = locate_tile(authorized["path"], accept)
+    if "redirect" in location:
+        return redirect_response(location, authorized["prefix"])
+
+    if location["file"]:
+        try:
+            if settings.TILE_SENDFILE:
+                return offload_response(request, location)
+            cached = TILE_CACHE.get(location["file"])
+            if cached:
+                PREFETCHER.served(location["file"])
+            else:
+                PREFETCHER.missed(TILES_DIRECTORY, location["tile"])
+            data, mtime_ns = cached or load_into(TILE_CACHE, location["file"])
+            record_request(location["tile"])
+            return stored_response(request, location, data, mtime_ns)
+        except OSError:
+            pass
+
+    return overzoomed_response(request, location, overzoom_tile(TILES_DIRECTORY, location["path"], accept))
+
+async def async_tile_serving(request, path):
+    # Used under ASGI: everything which touches the disk or the cache locks runs in worker threads, never on the event loop
+    authorized: dict = authorize_tile(path)
+    if authorized is None:
+        return forbidden_response()
+    return signed_response(await async_serve_tile(request, authorized), authorized)
+
+def cached_tile(path: str, accept: str) -> tuple[dict, tuple[bytes, int]]:
+    # The location of a tile and its cached data (None when not cached), looked up in one worker thread by the async view
+    location: dict = locate_tile(path, accept)
+    if "redirect" in location or not location["file"] or settings.TILE_SENDFILE:
+        return location, None
+    try:
+        return location, TILE_CACHE.get(location["file"])
+    except OSError:
+        return dict(location, file=None), None          # Removed since it was located, overzoomed like the sync view does
+
+async def async_serve_tile(request, authorized: dict):
+    accept: str = request.headers.get("Accept", "")
+    location, cached = await asyncio.to_thread(cached_tile, authorized["path"], accept)
+    if "redirect" in location:
+        return redirect_response(location, authorized["prefix"])
+
+    if location["file"]:
+        try:
+            if settings.TILE_SENDFILE:
+                return await asyncio.to_thread(offload_response, request, location)
+            if cached:
+                PREFETCHER.served(location["file"])
+            else:
+                PREFETCHER.missed(TILES_DIRECTORY, location["tile"])
+            data, mtime_ns = cached or await asyncio.to_thread(load_into, TILE_CACHE, location["file"])
+            record_request(location["tile"])
+            return stored_response(request, location, data, mtime_ns)
+        except OSError:
+            pass
 
-    # Log the absolute paths
-    logging.info(f'Tile directory: {os.path.abspath(tile_dir)}')
-    logging.info(f'Requested tile: {os.path.abspath(tile_path)}')
+    return overzoomed_response(request, location, await asyncio.to_thread(overzoom_tile, TILES_DIRECTORY, location["path"], accept))
 
-    return serve(request, path, document_root=TILES_DIRECTORY)
+def stored_content(path: str, accept: str) -> tuple[bytes, str]:
+    # The data and content type of a stored or overzoomed tile, or None when it does not exist
+    location: dict = locate_tile(path, accept)
+    if location["file"]:
+        try:
+            return TILE_CACHE.read(location["file"])[0], stored_content_type(location["tile"])
+        except OSError:
+            pass
+    return overzoom_tile(TILES_DIRECTORY, location["path"], accept)
+
+def batch_tile_serving(request, img_id, alg_id):
+    # Many tiles of one layer in a single streamed response, see tiles.bundle_record for the format
+    if not authorize_layer(request, f"{img_id}/{alg_id}"):
+        return forbidden_response()
+
+    try:
+        requested: list = batch_tiles(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    accept: str = request.headers.get("Accept", "")
+    records = (bundle_record(z, x, y, stored_content(f"{img_id}/{alg_id}/{z}/{x}/{y}.png", accept)) for z, x, y in requested)
+
+    response = StreamingHttpResponse(records, content_type=bundle_content_type)
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+def dynamic_tile_serving(request, img_id, alg_id, z, x, y, extension):
+    # Tiles rendered on request from the band files, available as soon as an image is created
+    if not authorize_layer(request, f"{img_id}/{alg_id}"):
+        return forbidden_response()
+
+    rendered = dynamic_tile(IMAGES_DIRECTORY, int(img_id), int(alg_id), int(z), int(x), int(y), extension, request.headers.get("Accept", ""))
+    if rendered is None:
+        raise Http404
+
+    return tile_response(request, rendered[0], rendered[1], vary=extension == tiles.base_encoding)
 
 def serve_image(request):
+    try:
+        overview: dict = parse_overview(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    if overview["layer"] is not None:
+        # Overview of (part of) the render output a tiled layer was built from, signed like the tiles of the layer
+        if not authorize_layer(request, overview["layer"]):
+            return forbidden_response()
+        manifest: dict = layer_manifest(TILES_DIRECTORY, overview["layer"])
+        try:
+            key: tuple = (manifest["source"], os.stat(manifest["source"]).st_mtime_ns, overview["width"], overview["height"], overview["bbox"])
+        except (KeyError, OSError, TypeError):
+            raise Http404
+        data: bytes = tile_flights.do(("overview",) + key, lambda: render_overview(*key))
+        if data is None:
+            raise Http404
+        return tile_response(request, data, tiles.content_types[overview_encoding])
+
     try:
         # Get the absolute path of the image file
-        img_path = os.path.join(os.path.dirname(__file__), '../image_data/compressed.webp')
+        img_path = OVERVIEW_IMAGE
+
+        if overview["width"] or overview["height"]:
+            # Downscaled copy for small viewports, produced once per size
+            key: tuple = (img_path, os.stat(img_path).st_mtime_ns, overview["width"], overview["height"])
+            return tile_response(request, tile_flights.do(("overview",) + key, lambda: image_overview(*key)), tiles.content_types[overview_encoding])
 
         # Open the image file in binary mode
         img = open(img_path, 'rb')
@@ -32,6 +332,147 @@ def serve_image(request):
     except FileNotFoundError:
         raise Http404
 
+class TileStatsView(APIView):
+    # Counters of the tile cache, the prefetcher and the coalesced tile builds, used to tune their sizes
+    def get(self, request):
+        return Response({"cache": TILE_CACHE.stats(), "prefetch": PREFETCHER.stats(), "coalesced": tile_flights.stats()})
+
+class CatalogView(APIView):
+    # Published images with their tiled layers, cached in memory until the pipeline publishes again
+    def get(self, request):
+        try:
+            page: int = int(request.GET.get("page", 1))
+            page_size: int = min(max(int(request.GET.get("page_size", catalog_page_size)), 1), max_catalog_page_size)
+        except ValueError:
+            return Response({"detail": "page and page_size must be integers"}, status=400)
+
+        try:
+            result: dict = catalog_page(published(IMAGES_DIRECTORY), page, page_size)
+        except InvalidPage as e:
+            return Response({"detail": str(e)}, status=404)
+
+        if settings.TILE_SIGNED_URLS:
+            # The cached page is shared, the short-lived signed layer URLs are added to a copy
+            result = sign_catalog(result, TILE_SIGNING_KEY, signature_expiry(time.time(), settings.TILE_URL_LIFETIME))
+        return Response(result)
+
+class FootprintView(APIView):
+    # Published images covering a point or intersecting a bbox, answered from an in-memory R-tree
+    def get(self, request):
+        try:
+            crs, bounds = parse_query(request.GET)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        FOOTPRINTS.load(published(IMAGES_DIRECTORY))
+        results: list[dict] = FOOTPRINTS.query(crs, bounds)
+        return Response({"crs": crs, "count": len(results), "results": results})
+
+class SampleView(APIView):
+    # Index values of one image, or of every published image covering them, at a batch of locations
+    def post(self, request):
+        try:
+            sample: dict = parse_samples(request.data)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        if sample["img_id"] is not None:
+            img_ids: list[int] = [sample["img_id"]]
+        else:
+            FOOTPRINTS.load(published(IMAGES_DIRECTORY))
+            bounds: tuple = (sample["lons"].min(), sample["lats"].min(), sample["lons"].max(), sample["lats"].max())
+            img_ids: list[int] = [image["img_id"] for image in FOOTPRINTS.query("EPSG:4326", bounds)]
+
+        results: list[dict] = []
+        for img_id in img_ids:
+            image: dict = image_bands(IMAGES_DIRECTORY, img_id)
+            if image is None:
+                continue
+            band_paths: list[str] = [image[band] for band in dynamic.algorithms[sample["alg_id"]]["bands"]]
+            values = sampling.sample_points(band_paths, sample["alg_id"], sample["lons"], sample["lats"])
+            results.append({"img_id": img_id, "title": image["title"], "values": json_values(values)})
+
+        if sample["img_id"] is not None and not results:
+            return Response({"detail": "Unknown image"}, status=404)
+        return Response({"alg_id": sample["alg_id"], "results": results})
+
+class ZonalView(APIView):
+    # Statistics of the index values of an image inside every given polygon
+    def post(self, request):
+        try:
+            zones: dict = parse_zonal(request.data)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        image: dict = image_bands(IMAGES_DIRECTORY, zones["img_id"])
+        if image is None:
+            return Response({"detail": "Unknown image"}, status=404)
+
+        band_paths: list[str] = [image[band] for band in dynamic.algorithms[zones["alg_id"]]["bands"]]
+        try:
+            stats: list[dict] = zonal.zonal_statistics(band_paths, zones["alg_id"], zones["geometries"], zones["percentiles"])
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        return Response({"img_id": zones["img_id"], "alg_id": zones["alg_id"], "results": [dict(stat, id=feature_id) for feature_id, stat in zip(zones["ids"], stats)]})
+
+class TimeSeriesView(APIView):
+    # Index values of every ingested scene at a point or small window, read from the chunks of the temporal cubes
+    def get(self, request):
+        try:
+            query: dict = parse_series(request.GET)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        results: list[dict] = cube.find_series(os.path.join(IMAGES_DIRECTORY, cube.path_to_cube), query["alg_id"], query["lon"], query["lat"], query["window"])
+        return Response({"alg_id": query["alg_id"], "point": [query["lon"], query["lat"]], "window": query["window"], "results": results})
+
+class StatisticsView(APIView):
+    # Histogram and summary statistics of a layer, merged from the block statistics stored while rendering
+    def get(self, request):
+        try:
+            query: dict = parse_statistics(request.GET)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        manifest: dict = layer_manifest(TILES_DIRECTORY, f"{query['img_id']}/{query['alg_id']}")
+        try:
+            path: str = histograms.statistics_path(manifest["source"])
+            stats: dict = layer_statistics(path, os.stat(path).st_mtime_ns, query["bbox"], query["percentiles"])
+        except (KeyError, OSError, TypeError):
+            return Response({"detail": "No statistics for this layer"}, status=404)
+
+        return Response(dict(stats, img_id=query["img_id"], alg_id=query["alg_id"]))
+
+class ExportView(APIView):
+    # Index values of an image inside a bbox or polygon as a GeoTIFF, streamed while it is produced
+    def get(self, request):
+        return self.export(request.GET)
+
+    def post(self, request):
+        return self.export(request.data)
+
+    def export(self, data):
+        try:
+            query: dict = parse_export(data)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        image: dict = image_bands(IMAGES_DIRECTORY, query["img_id"])
+        if image is None:
+            return Response({"detail": "Unknown image"}, status=404)
+
+        band_paths: list[str] = [image[band] for band in dynamic.algorithms[query["alg_id"]]["bands"]]
+        try:
+            size, content = export.stream_geotiff(band_paths, query["alg_id"], query["geometry"])
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        response = StreamingHttpResponse(content, content_type="image/tiff")
+        response["Content-Length"] = size
+        response["Content-Disposition"] = f'attachment; filename="{query["img_id"]}_{dynamic.algorithms[query["alg_id"]]["name"]}.tif"'
+        return response
+
 class CreateUserView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
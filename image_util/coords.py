@@ -1,42 +1,100 @@
-from osgeo import gdal, osr
+from functools import lru_cache
+import rasterio as rio
+import rasterio.warp
+import numpy as np
 
-def get_geotiff_bounds(file_path):
-    # Open the dataset
-    ds = gdal.Open(file_path)
-    if ds is None:
-        print('Could not open file')
-        return
+geographic_epsg: int = 4326
+mercator_epsg: int = 3857
+densify_points: int = 21         # Points per raster edge, so curved or skewed edges of reprojected footprints are followed
+
+@lru_cache(maxsize=64)
+def get_transformer(source_epsg: int, target_epsg: int):
+    """Get the function transforming coordinates between two EPSG codes, created once per pair
+
+    Keyword arguments:
+    - source_epsg -- The EPSG code of the coordinates
+    - target_epsg -- The EPSG code to transform them to
+
+    Returns:
+    - Function transforming arrays of x and y coordinates in one call, returning the transformed arrays
+    """
+
+    source, target = rio.crs.CRS.from_epsg(source_epsg), rio.crs.CRS.from_epsg(target_epsg)
+
+    def transform(xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if source_epsg == target_epsg:
+            return np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        tx, ty = rio.warp.transform(source, target, xs, ys)
+        return np.asarray(tx), np.asarray(ty)
+
+    return transform
+
+def footprint_ring(transform: list[float], width: int, height: int, densify: int = densify_points) -> tuple[np.ndarray, np.ndarray]:
+    """Get the outline of a raster in its own CRS, with extra points along every edge
 
-    # Get the source projection
-    source_proj = osr.SpatialReference()
-    source_proj.ImportFromWkt(ds.GetProjection())
+    Keyword arguments:
+    - transform -- The first six values of the affine transform of the raster
+    - width     -- The width of the raster in pixels
+    - height    -- The height of the raster in pixels
+    - densify   -- (Optional) The number of points per edge
 
-    # Create the destination projection (WGS84)
-    target_proj = osr.SpatialReference()
-    target_proj.ImportFromEPSG(4326)
+    Returns:
+    - The x and y coordinates of the closed ring, clockwise from the upper left corner
+    """
 
-    # Create a coordinate transformation
-    transform = osr.CoordinateTransformation(source_proj, target_proj)
+    steps: np.ndarray = np.linspace(0, 1, densify, endpoint=False)
+    cols: np.ndarray = np.concatenate([steps * width, np.full(densify, width), (1 - steps) * width, np.zeros(densify), [0]])
+    rows: np.ndarray = np.concatenate([np.zeros(densify), steps * height, np.full(densify, height), (1 - steps) * height, [0]])
 
-    # Get the geotransform
-    gt = ds.GetGeoTransform()
+    a, b, c, d, e, f = transform[:6]
+    return a * cols + b * rows + c, d * cols + e * rows + f
 
-    # Get the dimensions
-    width = ds.RasterXSize
-    height = ds.RasterYSize
+def get_footprints(grids: list[dict], target_epsg: int = geographic_epsg, densify: int = densify_points) -> list[dict]:
+    """Reproject the footprints of many rasters, with one transformation per source EPSG code
 
-    # Get the corner coordinates in the source projection
-    ulx, uly = gt[0], gt[3]
-    lrx, lry = gt[0] + width*gt[1], gt[3] + height*gt[5]
+    Keyword arguments:
+    - grids       -- The rasters, each as a dictionary of "epsg", "transform" (affine values), "width" and "height"
+    - target_epsg -- (Optional) The EPSG code of the footprints
+    - densify     -- (Optional) The number of points per raster edge
 
-    # Transform the corner coordinates to the destination projection
-    ul_lon, ul_lat, _ = transform.TransformPoint(ulx, uly)
-    lr_lon, lr_lat, _ = transform.TransformPoint(lrx, lry)
+    Returns:
+    - For every raster, in the given order, its "bounds" as (min x, min y, max x, max y) and its "polygon"
+      as a closed list of [x, y] points in the target CRS
+    """
+
+    result: list[dict] = [None] * len(grids)
+    ring_size: int = 4 * densify + 1
+
+    groups: dict[int, list[int]] = {}
+    for index, grid in enumerate(grids):
+        groups.setdefault(grid["epsg"], []).append(index)
+
+    for epsg, indexes in groups.items():
+        rings: list[tuple] = [footprint_ring(grids[index]["transform"], grids[index]["width"], grids[index]["height"], densify) for index in indexes]
+        xs, ys = get_transformer(epsg, target_epsg)(np.concatenate([ring[0] for ring in rings]), np.concatenate([ring[1] for ring in rings]))
+        xs, ys = xs.reshape(len(indexes), ring_size), ys.reshape(len(indexes), ring_size)
+
+        bounds: np.ndarray = np.stack([xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1)
+        for position, index in enumerate(indexes):
+            result[index] = {"bounds": tuple(float(value) for value in bounds[position]),
+                             "polygon": np.stack([xs[position], ys[position]], axis=1).tolist()}
+
+    return result
+
+def get_geotiff_bounds(file_path):
+    # Only the header of the file is read
+    try:
+        with rio.open(file_path) as src:
+            grid: dict = {"epsg": src.crs.to_epsg(), "transform": list(src.transform)[:6], "width": src.width, "height": src.height}
+    except rio.errors.RasterioIOError:
+        print('Could not open file')
+        return
 
-    return ul_lon, ul_lat, lr_lon, lr_lat
+    west, south, east, north = get_footprints([grid])[0]["bounds"]
+    return west, north, east, south
 
 if __name__ == "__main__":
     file_path = '../image_data/image.tif'  # Replace with your file path
     ul_lon, ul_lat, lr_lon, lr_lat = get_geotiff_bounds(file_path)
     print(f'Upper Left: ({ul_lon}, {ul_lat})')
-    print(f'Lower Right: ({lr_lon}, {lr_lat})')
\ No newline at end of file
+    print(f'Lower Right: ({lr_lon}, {lr_lat})')
@@ -0,0 +1,230 @@
+from .models import Environment, Image
+from . import coords, dynamic
+from functools import lru_cache
+import rasterio as rio
+import numpy as np
+import hashlib, json, os, re
+
+path_to_cube: str = "cube/"             # Folder inside the create output where the temporal cubes are stored
+cube_metadata_file: str = "cube.json"
+chunk_file_type: str = ".npy"
+
+chunk_times: int = 16                   # Scenes per chunk
+chunk_pixels: int = 128                 # Pixels per side of a chunk
+value_scale: int = 10000                # Index values are stored as int16 multiplied by this scale
+value_nodata: int = np.iinfo(np.int16).min
+
+acquisition_pattern = re.compile(r"(\d{8}T\d{6})")        # Sensing time in Sentinel-2 product names, e.g. 20240323T092031
+
+index_algorithms: list[int] = [1, 2, 3]
+
+def grid_key(src) -> str:
+    """Get the key identifying the pixel grid of a raster, equal for every scene of the same granule
+
+    Keyword arguments:
+    - src -- The opened rasterio dataset
+
+    Returns:
+    - The key of the grid
+    """
+
+    grid: list = [src.crs.to_string(), list(src.transform)[:6], src.width, src.height]
+    return hashlib.sha1(json.dumps(grid).encode()).hexdigest()[:16]
+
+def acquisition_time(title: str) -> str:
+    """Get the sensing time of a scene from its title
+
+    Keyword arguments:
+    - title -- The title of the image
+
+    Returns:
+    - The time as YYYYMMDDTHHMMSS, or None when the title does not contain one
+    """
+
+    match = acquisition_pattern.search(title)
+    return match.group(1) if match else None
+
+def chunk_path(cube_path: str, time_chunk: int, row_chunk: int, col_chunk: int) -> str:
+    return os.path.join(cube_path, str(time_chunk), f"{row_chunk}.{col_chunk}{chunk_file_type}")      # Zarr style t/y.x
+
+def read_metadata(cube_path: str) -> dict:
+    # The metadata is replaced atomically once all chunks of a scene are written
+    try:
+        with open(os.path.join(cube_path, cube_metadata_file)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+class CubeWriter():
+
+    def add_image(self, img: Image, alg_id: int, environment: Environment = Environment()) -> str:
+        """Add the index values of an image to the temporal cube of its grid
+
+        The values are computed from the band files strip by strip and written in place into the chunks of
+        the time slot of the image, so adding a scene never rewrites the other scenes. An image which is
+        already in the cube is only written again when its band files changed.
+
+        Keyword arguments:
+        - img         -- The Image object to add
+        - alg_id      -- The ID of the index algorithm ( 1 - NDVI | 2 - NDWI | 3 - NDMI )
+        - environment -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+
+        Returns:
+        - The path of the cube the image was added to
+        """
+
+        band_paths: list[str] = [getattr(img, band) for band in dynamic.algorithms[alg_id]["bands"]]
+        mtimes: list[int] = [os.stat(path).st_mtime_ns for path in band_paths]
+
+        with rio.open(band_paths[0]) as src, rio.open(band_paths[1]) as other:          # All bands of an image share the same grid
+            cube_path: str = f"{environment.create_output}{path_to_cube}{grid_key(src)}/{alg_id}/"
+            metadata: dict = read_metadata(cube_path) or {
+                "grid": {"width": src.width, "height": src.height, "crs": src.crs.to_string(), "epsg": src.crs.to_epsg(), "transform": list(src.transform)[:6]},
+                "chunks": [chunk_times, chunk_pixels, chunk_pixels], "scale": value_scale, "nodata": value_nodata, "times": [],
+            }
+
+            slots: dict[str, int] = {scene["title"]: slot for slot, scene in enumerate(metadata["times"])}
+            slot: int = slots.get(img.title, len(metadata["times"]))
+            scene: dict = {"img_id": img.img_id, "title": img.title, "time": acquisition_time(img.title), "mtimes": mtimes}
+            if slot < len(metadata["times"]) and metadata["times"][slot]["mtimes"] == mtimes:
+                return cube_path            # Already up to date
+
+            time_chunk, time_offset = divmod(slot, chunk_times)
+            os.makedirs(os.path.join(cube_path, str(time_chunk)), exist_ok=True)
+
+            for row in range(0, src.height, chunk_pixels):
+                window = rio.windows.Window(0, row, src.width, min(chunk_pixels, src.height - row))
+                a: np.ndarray = src.read(1, window=window)
+                b: np.ndarray = other.read(1, window=window)
+
+                values: np.ndarray = np.round(dynamic.normalized_difference(a, b) * value_scale).astype(np.int16)
+                values[(a.astype('float64') + b) == 0] = value_nodata
+                if src.nodata is not None:
+                    values[a == src.nodata] = value_nodata
+                if other.nodata is not None:
+                    values[b == other.nodata] = value_nodata
+
+                for col in range(0, src.width, chunk_pixels):
+                    path: str = chunk_path(cube_path, time_chunk, row // chunk_pixels, col // chunk_pixels)
+                    if os.path.isfile(path):
+                        chunk = np.load(path, mmap_mode="r+")
+                    else:
+                        chunk = np.lib.format.open_memmap(path, mode="w+", dtype=np.int16, shape=(chunk_times, chunk_pixels, chunk_pixels))
+                        chunk[:] = value_nodata
+                    part: np.ndarray = values[:, col:col + chunk_pixels]
+                    chunk[time_offset, :part.shape[0], :part.shape[1]] = part
+                    chunk.flush()
+                    del chunk
+
+        if slot < len(metadata["times"]):
+            metadata["times"][slot] = scene
+        else:
+            metadata["times"].append(scene)
+
+        with open(os.path.join(cube_path, f"{cube_metadata_file}.tmp"), "w") as file:
+            json.dump(metadata, file)
+        os.replace(os.path.join(cube_path, f"{cube_metadata_file}.tmp"), os.path.join(cube_path, cube_metadata_file))     # Readers only see complete scenes
+        return cube_path
+
+    def add_images(self, images: list[Image], environment: Environment = Environment()):
+        """Add all index algorithms of the given images to the temporal cubes
+
+        Keyword arguments:
+        - images      -- The Image objects to add
+        - environment -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+        """
+
+        print(f"\nLOGGER: --> Starting building of the temporal cubes")
+
+        for img in images:
+            for alg_id in index_algorithms:
+                try:
+                    self.add_image(img, alg_id, environment=environment)
+                except Exception as e:
+                    print(f"\nEXCEPTION: {e}")
+
+        print(f"\nLOGGER: <-- Finished building of the temporal cubes")
+
+
+def read_series(cube_path: str, metadata: dict, lon: float, lat: float, size: int = 1) -> list[dict]:
+    """Get the time series of the index at a location from a temporal cube, reading only the chunks containing it
+
+    Keyword arguments:
+    - cube_path -- The path of the cube
+    - metadata  -- The metadata of the cube
+    - lon, lat  -- The location in degrees
+    - size      -- (Optional) The side in pixels of the window around the location whose mean is returned
+
+    Returns:
+    - Per scene, ordered by time, its img_id, title, time and the mean value (None without data),
+      or None when the location is outside of the grid
+    """
+
+    grid: dict = metadata["grid"]
+    xs, ys = coords.get_transformer(coords.geographic_epsg, grid["epsg"])(np.array([lon]), np.array([lat]))
+    inverse = ~rio.Affine(*grid["transform"])
+    col, row = (int(np.floor(value)) for value in inverse * (xs[0], ys[0]))
+    if not (0 <= col < grid["width"] and 0 <= row < grid["height"]):
+        return None
+
+    top, left = max(row - size // 2, 0), max(col - size // 2, 0)
+    bottom, right = min(top + size, grid["height"]), min(left + size, grid["width"])
+    count: int = len(metadata["times"])
+    values: np.ndarray = np.full((count, bottom - top, right - left), value_nodata, dtype=np.int16)
+
+    for time_chunk in range(-(-count // chunk_times)):
+        for row_chunk in range(top // chunk_pixels, (bottom - 1) // chunk_pixels + 1):
+            for col_chunk in range(left // chunk_pixels, (right - 1) // chunk_pixels + 1):
+                path: str = chunk_path(cube_path, time_chunk, row_chunk, col_chunk)
+                if not os.path.isfile(path):
+                    continue
+                chunk = np.load(path, mmap_mode="r")            # Only the requested pixels are read from the file
+                r0, r1 = max(top, row_chunk * chunk_pixels), min(bottom, (row_chunk + 1) * chunk_pixels)
+                c0, c1 = max(left, col_chunk * chunk_pixels), min(right, (col_chunk + 1) * chunk_pixels)
+                times: int = min(chunk_times, count - time_chunk * chunk_times)
+                values[time_chunk * chunk_times:time_chunk * chunk_times + times, r0 - top:r1 - top, c0 - left:c1 - left] = \
+                    chunk[:times, r0 - row_chunk * chunk_pixels:r1 - row_chunk * chunk_pixels, c0 - col_chunk * chunk_pixels:c1 - col_chunk * chunk_pixels]
+
+    series: list[dict] = []
+    for scene, scene_values in zip(metadata["times"], values.reshape(count, -1)):
+        valid: np.ndarray = scene_values[scene_values != value_nodata]
+        series.append({"img_id": scene["img_id"], "title": scene["title"], "time": scene["time"],
+                       "value": float(valid.mean()) / value_scale if len(valid) else None})
+    return sorted(series, key=lambda scene: (scene["time"] is None, scene["time"] or "", scene["img_id"]))
+
+@lru_cache(maxsize=256)
+def cached_metadata(cube_path: str, mtime_ns: int) -> dict:
+    # Keyed by the modification time, so a cube is read again once a scene was added to it
+    return read_metadata(cube_path)
+
+def find_series(cube_directory: str, alg_id: int, lon: float, lat: float, size: int = 1) -> list[dict]:
+    """Get the time series of the index at a location from every temporal cube containing it
+
+    Keyword arguments:
+    - cube_directory -- The path of the folder with the cubes (create output + path_to_cube)
+    - alg_id         -- The ID of the index algorithm ( 1 - NDVI | 2 - NDWI | 3 - NDMI )
+    - lon, lat       -- The location in degrees
+    - size           -- (Optional) The side in pixels of the window around the location whose mean is returned
+
+    Returns:
+    - Per cube containing the location its grid key, crs and series (see read_series)
+    """
+
+    result: list[dict] = []
+    try:
+        keys: list[str] = sorted(os.listdir(cube_directory))
+    except OSError:
+        return result
+
+    for key in keys:
+        cube_path: str = os.path.join(cube_directory, key, str(alg_id))
+        try:
+            mtime_ns: int = os.stat(os.path.join(cube_path, cube_metadata_file)).st_mtime_ns
+        except OSError:
+            continue
+        metadata: dict = cached_metadata(cube_path, mtime_ns)
+        series: list[dict] = read_series(cube_path, metadata, lon, lat, size) if metadata else None
+        if series is not None:
+            result.append({"grid": key, "crs": metadata["grid"]["crs"], "series": series})
+    return result
@@ -0,0 +1,91 @@
+from .models import colors, value_max, true_color_inc, ndvi_inc, ndwi_inc, ndmi_inc
+from . import tiles
+from PIL import Image as PILImage
+import rasterio as rio
+import numpy as np
+import math
+
+# Band files read by every algorithm and the way their values are turned into colors, matching ImageManager.create_*
+algorithms: dict[int, dict] = {
+    0: {"name": "TC",   "bands": ["b4", "b3", "b2"]},
+    1: {"name": "NDVI", "bands": ["b8", "b4"],  "color": colors["Green"], "increase": ndvi_inc},
+    2: {"name": "NDWI", "bands": ["b3", "b8"],  "color": colors["Blue"],  "increase": ndwi_inc},
+    3: {"name": "NDMI", "bands": ["b8a", "b11"], "color": colors["Red"],  "increase": ndmi_inc},
+}
+
+def normalized_difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Compute the normalized difference index (a - b) / (a + b) of two bands
+
+    Keyword arguments:
+    - a, b -- The values of the two bands of the index (see algorithms)
+
+    Returns:
+    - The index values in [-1, 1], 0 where both bands are 0
+    """
+
+    a, b = a.astype('float64'), b.astype('float64')
+    return np.where(a + b == 0., 0, (a - b) / np.where(a + b == 0., 1, a + b))
+
+def colorize(alg_id: int, bands: list[np.ndarray]) -> np.ndarray:
+    """Apply the algorithm of the given ID to band values
+
+    Keyword arguments:
+    - alg_id -- The ID of the algorithm ( 0 - TC | 1 - NDVI | 2 - NDWI | 3 - NDMI )
+    - bands  -- The values of the bands of the algorithm, in the order of algorithms[alg_id]["bands"]
+
+    Returns:
+    - The RGB values as an array of shape (3, ...) and type uint8
+    """
+
+    if alg_id == 0:
+        return np.stack([np.clip(band * true_color_inc, 0, value_max) for band in bands]).astype(np.uint8)
+
+    index: np.ndarray = (normalized_difference(*bands) + 1) / 2                # stored as [0, 1], like the rendered output
+
+    result: np.ndarray = np.zeros((3,) + index.shape, dtype=np.uint8)
+    result[algorithms[alg_id]["color"] - 1] = np.clip(index * algorithms[alg_id]["increase"], 0, value_max)
+    return result
+
+def render_tile(band_paths: list[str], alg_id: int, z: int, x: int, y: int, tile_size: int) -> PILImage.Image:
+    """Render a TMS tile of an algorithm directly from the band files of an image
+
+    Only the band pixels under the tile are read. Tiles covering more source pixels than they can show
+    are read decimated, so low zoom levels do not read the whole band at full resolution.
+
+    Keyword arguments:
+    - band_paths -- The paths of the band files of the algorithm, in the order of algorithms[alg_id]["bands"]
+    - alg_id     -- The ID of the algorithm ( 0 - TC | 1 - NDVI | 2 - NDWI | 3 - NDMI )
+    - z          -- The zoom level of the tile
+    - x          -- The column of the tile
+    - y          -- The TMS row of the tile
+    - tile_size  -- The size of the tile in pixels
+
+    Returns:
+    - The RGBA tile image, or None when the tile does not contain any data
+    """
+
+    with rio.open(band_paths[0]) as src:            # All bands of an image share the same grid
+        mapping = tiles.source_pixels(src, tile_size, z, x, y)
+    if mapping is None:
+        return None
+
+    (col_off, row_off, width, height), rows, cols, valid = mapping
+    step: int = max(1, math.ceil(max(width, height) / (2 * tile_size)))     # Keep at least two source pixels per tile pixel
+    out_shape: tuple = (math.ceil(height / step), math.ceil(width / step))
+
+    rows = np.where(valid, np.minimum(rows // step, out_shape[0] - 1), 0)
+    cols = np.where(valid, np.minimum(cols // step, out_shape[1] - 1), 0)
+
+    bands: list[np.ndarray] = []
+    for path in band_paths:
+        with rio.open(path) as band:
+            data: np.ndarray = band.read(1, window=rio.windows.Window(col_off, row_off, width, height), out_shape=out_shape)
+            if band.nodata is not None:
+                valid = valid & (data[rows, cols] != band.nodata)
+            bands.append(data[rows, cols])
+
+    if not valid.any():
+        return None
+
+    rgb: np.ndarray = colorize(alg_id, bands)
+    return PILImage.fromarray(np.dstack([rgb[0], rgb[1], rgb[2], valid.astype(np.uint8) * 255]), "RGBA")
@@ -0,0 +1,178 @@
+from . import dynamic, zonal
+import rasterio as rio
+import rasterio.features
+import numpy as np
+import struct, zlib
+
+export_tile_size: int = 256                 # Pixels per side of the tiles of the exported GeoTIFF
+export_compression_level: int = 6
+max_export_pixels: int = 10980 * 10980      # A whole Sentinel-2 granule at 10m, keeps the file below the 4 GiB of a classic TIFF
+
+# TIFF field types
+tiff_ascii: int = 2
+tiff_short: int = 3
+tiff_long: int = 4
+tiff_double: int = 12
+tiff_type_sizes: dict[int, int] = {tiff_ascii: 1, tiff_short: 2, tiff_long: 4, tiff_double: 8}
+tiff_type_formats: dict[int, str] = {tiff_short: "H", tiff_long: "I", tiff_double: "d"}
+
+def bbox_geometry(bounds: tuple[float, float, float, float]) -> dict:
+    # The bbox as a GeoJSON Polygon, so it is clipped to exactly like a polygon once reprojected
+    west, south, east, north = bounds
+    return {"type": "Polygon", "coordinates": [[[west, south], [east, south], [east, north], [west, north], [west, south]]]}
+
+def export_plan(band_paths: list[str], geometry: dict) -> dict:
+    """Get the part of an image covered by a geometry
+
+    Keyword arguments:
+    - band_paths -- The paths of the band files of the algorithm
+    - geometry   -- A GeoJSON Polygon or MultiPolygon in degrees
+
+    Returns:
+    - Dictionary of the pixel window, its transform, the EPSG code and whether it is geographic, and the geometry in the CRS of the image
+
+    Exceptions:
+    - ValueError when the geometry is invalid, does not intersect the image or covers too many pixels
+    """
+
+    with rio.open(band_paths[0]) as src:            # All bands of an image share the same grid
+        if src.crs.to_epsg() is None:
+            raise ValueError("Only images with an EPSG coordinate system can be exported")
+        zone: dict = zonal.project_zones([geometry], src.crs.to_epsg())[0]
+        top, left, bottom, right = (int(value) for value in zonal.zone_windows([zone], src)[0])
+        plan: dict = {"window": rio.windows.Window(left, top, right - left, bottom - top), "epsg": src.crs.to_epsg(),
+                      "geographic": src.crs.is_geographic, "zone": zone}
+        plan["transform"] = rio.windows.transform(plan["window"], src.transform)
+
+    if right <= left or bottom <= top:
+        raise ValueError("The area does not intersect the image")
+    if (right - left) * (bottom - top) > max_export_pixels:
+        raise ValueError(f"The area covers more than {max_export_pixels} pixels")
+    return plan
+
+def tile_windows(plan: dict):
+    # Windows of the tiles in the image, row by row, as a TIFF stores them
+    window = plan["window"]
+    for row in range(0, int(window.height), export_tile_size):
+        for col in range(0, int(window.width), export_tile_size):
+            yield row, col, rio.windows.Window(int(window.col_off) + col, int(window.row_off) + row,
+                                               min(export_tile_size, int(window.width) - col), min(export_tile_size, int(window.height) - row))
+
+def index_tiles(band_paths: list[str], alg_id: int, plan: dict):
+    """Compute the index values of the tiles of an export, one tile at a time
+
+    Keyword arguments:
+    - band_paths -- The paths of the band files of the algorithm, in the order of dynamic.algorithms[alg_id]["bands"]
+    - alg_id     -- The ID of the index algorithm ( 1 - NDVI | 2 - NDWI | 3 - NDMI )
+    - plan       -- The export plan (see export_plan)
+
+    Returns:
+    - Iterator of the compressed float32 tiles, NaN outside of the geometry and where the image has no data
+    """
+
+    empty: bytes = None
+    with rio.open(band_paths[0]) as src, rio.open(band_paths[1]) as other:
+        for row, col, window in tile_windows(plan):
+            inside: np.ndarray = rio.features.rasterize([(plan["zone"], 1)], out_shape=(int(window.height), int(window.width)),
+                                                        transform=rio.windows.transform(window, src.transform), fill=0, dtype="uint8") > 0
+            if not inside.any():
+                empty = empty or zlib.compress(np.full((export_tile_size, export_tile_size), np.nan, dtype="<f4").tobytes(), export_compression_level)
+                yield empty             # Tiles outside of the geometry are all the same
+                continue
+
+            a: np.ndarray = src.read(1, window=window)
+            b: np.ndarray = other.read(1, window=window)
+            inside &= (a.astype('float64') + b) != 0
+            if src.nodata is not None:
+                inside &= a != src.nodata
+            if other.nodata is not None:
+                inside &= b != other.nodata
+
+            tile: np.ndarray = np.full((export_tile_size, export_tile_size), np.nan, dtype="<f4")          # Edge tiles are padded to the full size
+            tile[:int(window.height), :int(window.width)] = np.where(inside, dynamic.normalized_difference(a, b), np.nan)
+            yield zlib.compress(tile.tobytes(), export_compression_level)
+
+def geotiff_header(plan: dict, byte_counts: list[int]) -> bytes:
+    """Build the start of a tiled, deflate compressed float32 GeoTIFF, everything before the tile data
+
+    Keyword arguments:
+    - plan        -- The export plan (see export_plan)
+    - byte_counts -- The compressed size of every tile, in the order they follow the header
+
+    Returns:
+    - The header, directory and tags of the file
+    """
+
+    window = plan["window"]
+    a, b, c, d, e, f = list(plan["transform"])[:6]
+    geo_keys: list[int] = [1, 1, 0, 3,
+                           1024, 0, 1, 2 if plan["geographic"] else 1,          # GTModelType
+                           1025, 0, 1, 1,                                       # GTRasterType, pixel is area
+                           2048 if plan["geographic"] else 3072, 0, 1, plan["epsg"]]
+
+    entries: list[tuple] = [            # (tag, type, values), in ascending order of the tags
+        (256, tiff_long, [int(window.width)]),
+        (257, tiff_long, [int(window.height)]),
+        (258, tiff_short, [32]),                        # Bits per sample
+        (259, tiff_short, [8]),                         # Deflate compression
+        (262, tiff_short, [1]),                         # Black is zero
+        (277, tiff_short, [1]),                         # Samples per pixel
+        (284, tiff_short, [1]),                         # Chunky planar configuration
+        (322, tiff_short, [export_tile_size]),
+        (323, tiff_short, [export_tile_size]),
+        (324, tiff_long, None),                         # Tile offsets, filled in below
+        (325, tiff_long, byte_counts),
+        (339, tiff_short, [3]),                         # IEEE floating point samples
+        (34264, tiff_double, [a, b, 0, c, d, e, 0, f, 0, 0, 0, 0, 0, 0, 0, 1]),     # Model transformation
+        (34735, tiff_short, geo_keys),
+        (42113, tiff_ascii, b"nan\0"),                  # GDAL nodata
+    ]
+
+    directory_size: int = 2 + 12 * len(entries) + 4
+    sizes: list[int] = [tiff_type_sizes[kind] * len(values if values is not None else byte_counts) for _, kind, values in entries]
+    extra_size: int = sum(size for size in sizes if size > 4)           # Values which do not fit in their entry follow the directory
+    data_offset: int = 8 + directory_size + extra_size
+
+    offsets: list[int] = list(np.cumsum([data_offset] + byte_counts[:-1]).tolist())
+    directory: bytearray = bytearray(struct.pack("<H", len(entries)))
+    extra: bytearray = bytearray()
+    for tag, kind, values in entries:
+        values = offsets if values is None else values
+        data: bytes = bytes(values) if kind == tiff_ascii else struct.pack(f"<{len(values)}{tiff_type_formats[kind]}", *values)
+        if len(data) <= 4:
+            directory += struct.pack("<HHI", tag, kind, len(values)) + data.ljust(4, b"\0")
+        else:
+            directory += struct.pack("<HHII", tag, kind, len(values), 8 + directory_size + len(extra))
+            extra += data
+    directory += struct.pack("<I", 0)                   # No further directories
+
+    return b"II" + struct.pack("<HI", 42, 8) + bytes(directory) + bytes(extra)
+
+def stream_geotiff(band_paths: list[str], alg_id: int, geometry: dict) -> tuple[int, object]:
+    """Export the index values of an image inside a geometry as a GeoTIFF which is produced while it is sent
+
+    The tiles are computed twice: first only to learn their compressed sizes, which the directory at the
+    start of the file needs, then again while streaming. Only one tile is held in memory at a time and
+    no temporary file is written.
+
+    Keyword arguments:
+    - band_paths -- The paths of the band files of the algorithm, in the order of dynamic.algorithms[alg_id]["bands"]
+    - alg_id     -- The ID of the index algorithm ( 1 - NDVI | 2 - NDWI | 3 - NDMI )
+    - geometry   -- A GeoJSON Polygon or MultiPolygon in degrees
+
+    Returns:
+    - The size of the file in bytes and an iterator of its content
+
+    Exceptions:
+    - ValueError when the geometry is invalid, does not intersect the image or covers too many pixels
+    """
+
+    plan: dict = export_plan(band_paths, geometry)
+    byte_counts: list[int] = [len(tile) for tile in index_tiles(band_paths, alg_id, plan)]
+    header: bytes = geotiff_header(plan, byte_counts)
+
+    def content():
+        yield header
+        yield from index_tiles(band_paths, alg_id, plan)
+
+    return len(header) + sum(byte_counts), content()
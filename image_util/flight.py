@@ -0,0 +1,96 @@
+from concurrent.futures import Future
+import fcntl, hashlib, os, threading
+
+lock_file_type: str = ".lock"
+
+def modified(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class SingleFlight():
+    """Coalesces concurrent computations of the same output
+
+    The first caller of a key computes the result, callers asking for the same key meanwhile wait for it
+    and receive the same result (or exception) instead of computing it again. Outputs written to files can
+    also be coalesced between processes through a lock file.
+    """
+
+    def __init__(self):
+        self.lock: threading.Lock = threading.Lock()
+        self.flights: dict = {}
+        self.computed: int = 0
+        self.shared: int = 0
+
+    def do(self, key, compute):
+        """Compute the result of the given key, unless it is already being computed
+
+        Keyword arguments:
+        - key     -- The hashable identity of the output
+        - compute -- Function without arguments computing the output
+
+        Returns:
+        - The result of compute, shared by all concurrent callers of the key
+
+        Exceptions:
+        - Any exception raised by compute, raised for all concurrent callers of the key
+        """
+
+        with self.lock:
+            future: Future = self.flights.get(key)
+            leader: bool = future is None
+            if leader:
+                future = self.flights[key] = Future()
+                self.computed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+    def produce(self, output_path: str, compute, lock_directory: str):
+        """Produce the file at the given path once, even when several threads or processes ask for it at the same time
+
+        A process waiting for the lock of another one does not compute the output again when the other
+        process wrote it in the meantime.
+
+        Keyword arguments:
+        - output_path    -- The path of the produced file, identifying the output
+        - compute        -- Function without arguments writing the file and returning its path
+        - lock_directory -- The folder where the lock files are kept
+
+        Returns:
+        - The result of compute, or the output path when another process produced it
+        """
+
+        def exclusive():
+            os.makedirs(lock_directory, exist_ok=True)
+            lock_name: str = hashlib.sha1(os.path.abspath(output_path).encode()).hexdigest()[:16]
+            before: int = modified(output_path)
+
+            with open(os.path.join(lock_directory, f"{lock_name}{lock_file_type}"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)            # Released when the file is closed
+                after: int = modified(output_path)
+                if after is not None and after != before:
+                    return output_path
+                return compute()
+
+        return self.do(os.path.abspath(output_path), exclusive)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"computed": self.computed, "shared": self.shared, "in_flight": len(self.flights)}
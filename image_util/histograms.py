@@ -0,0 +1,150 @@
+from . import coords
+import rasterio as rio
+import numpy as np
+import math, os
+
+statistics_block_size: int = 256        # Pixels per side of the blocks with their own partial histogram
+histogram_bins: int = 200              # Bins of the index range [-1, 1], 0.01 wide, also used for the percentiles of the zonal statistics
+statistics_file_type: str = ".stats.npz"
+default_percentiles: list[float] = [2, 50, 98]      # The usual stretch of a legend, with the median
+
+def value_bins(values: np.ndarray) -> np.ndarray:
+    # The histogram bin of every index value in [-1, 1]
+    return np.clip(((values + 1) / 2 * histogram_bins).astype(np.int64), 0, histogram_bins - 1)
+
+def histogram_percentiles(histogram: np.ndarray, count: int, minimum: float, maximum: float, percentiles: list[float]) -> dict:
+    """Get percentiles of index values from their histogram
+
+    Keyword arguments:
+    - histogram   -- The counts of the histogram_bins bins over [-1, 1]
+    - count       -- The number of values, at least 1
+    - minimum     -- The smallest value, returned for the 0th percentile
+    - maximum     -- The largest value, returned for the 100th percentile
+    - percentiles -- The percentiles to compute, between 0 and 100
+
+    Returns:
+    - Dictionary of the value of every percentile, accurate to the histogram bins and clipped to the minimum and maximum
+    """
+
+    cumulative: np.ndarray = np.cumsum(histogram)
+    result: dict = {}
+    for p in percentiles:
+        position: int = int(np.searchsorted(cumulative, max(p / 100 * count, 1)))
+        value: float = -1 + (position + 0.5) * 2 / histogram_bins            # Center of the bin
+        result[f"{p:g}"] = minimum if p == 0 else maximum if p == 100 else float(np.clip(value, minimum, maximum))
+    return result
+
+def statistics_path(rendered_path: str) -> str:
+    # The statistics are stored next to the render output they describe
+    return f"{os.path.splitext(rendered_path)[0]}{statistics_file_type}"
+
+def block_statistics(values: np.ndarray, valid: np.ndarray) -> dict:
+    """Reduce index values to the statistics of every block of statistics_block_size pixels
+
+    The values are reduced one strip of blocks at a time, so no per-pixel temporary of the full raster is made.
+
+    Keyword arguments:
+    - values -- The index values in [-1, 1] of the whole image, as computed while rendering
+    - valid  -- The mask of pixels with data
+
+    Returns:
+    - Dictionary of arrays per block (rows x columns): "count", "sum", "squares", "min", "max" and "histogram"
+      (with an extra axis of histogram_bins bins over [-1, 1])
+    """
+
+    height, width = values.shape
+    block_rows, block_cols = -(-height // statistics_block_size), -(-width // statistics_block_size)
+    blocks: int = block_rows * block_cols
+    stats: dict = {"count": np.zeros(blocks, dtype=np.int64), "sum": np.zeros(blocks), "squares": np.zeros(blocks),
+                   "min": np.full(blocks, np.inf), "max": np.full(blocks, -np.inf), "histogram": np.zeros((blocks, histogram_bins), dtype=np.int64)}
+
+    col_blocks: np.ndarray = np.arange(width) // statistics_block_size
+    for block_row, row in enumerate(range(0, height, statistics_block_size)):
+        strip_valid: np.ndarray = valid[row:row + statistics_block_size]
+        strip: np.ndarray = values[row:row + statistics_block_size][strip_valid]
+        block: np.ndarray = (block_row * block_cols + np.broadcast_to(col_blocks, strip_valid.shape))[strip_valid]
+        bins: np.ndarray = value_bins(strip)
+
+        stats["count"] += np.bincount(block, minlength=blocks)
+        stats["sum"] += np.bincount(block, weights=strip, minlength=blocks)
+        stats["squares"] += np.bincount(block, weights=strip * strip, minlength=blocks)
+        np.minimum.at(stats["min"], block, strip)
+        np.maximum.at(stats["max"], block, strip)
+        stats["histogram"] += np.bincount(block * histogram_bins + bins, minlength=blocks * histogram_bins).reshape(blocks, histogram_bins)
+
+    shape: tuple = (block_rows, block_cols)
+    return {name: array.reshape(shape + array.shape[1:]) for name, array in stats.items()}
+
+def write_statistics(rendered_path: str, values: np.ndarray, valid: np.ndarray, profile: rio.profiles.Profile):
+    """Store the block statistics of a rendered index next to its render output
+
+    Keyword arguments:
+    - rendered_path -- The path of the render output
+    - values        -- The index values in [-1, 1] of the whole image
+    - valid         -- The mask of pixels with data
+    - profile       -- The profile of the image, whose grid the blocks follow
+    """
+
+    stats: dict = block_statistics(values, valid)
+    temp_path: str = f"{statistics_path(rendered_path)}.tmp.npz"
+    transform = profile.get("transform") or rio.Affine.identity()
+    np.savez(temp_path, transform=np.array(list(transform)[:6]), epsg=np.array(profile["crs"].to_epsg() or 0),
+             shape=np.array(values.shape), **stats)
+    os.replace(temp_path, statistics_path(rendered_path))          # Readers never see a partly written file
+
+def read_statistics(path: str) -> dict:
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+def block_window(stats: dict, bounds: tuple[float, float, float, float]) -> tuple[int, int, int, int]:
+    """Get the blocks covering a bbox
+
+    Keyword arguments:
+    - stats  -- The stored statistics (see read_statistics)
+    - bounds -- The bbox as west, south, east, north in degrees
+
+    Returns:
+    - The first block row, first block column, last block row + 1 and last block column + 1, every block
+      which overlaps the bbox is included
+    """
+
+    height, width = (int(value) for value in stats["shape"])
+    west, south, east, north = bounds
+    lons, lats = coords.footprint_ring([east - west, 0, west, 0, south - north, north], 1, 1)         # The outline of the bbox, densified
+    xs, ys = coords.get_transformer(coords.geographic_epsg, int(stats["epsg"]))(lons, lats)
+    inverse = ~rio.Affine(*stats["transform"])
+    cols: np.ndarray = inverse.a * xs + inverse.b * ys + inverse.c
+    rows: np.ndarray = inverse.d * xs + inverse.e * ys + inverse.f
+
+    top, bottom = (min(max(value, 0), height) for value in (math.floor(rows.min()), math.ceil(rows.max())))
+    left, right = (min(max(value, 0), width) for value in (math.floor(cols.min()), math.ceil(cols.max())))
+    return (top // statistics_block_size, left // statistics_block_size,
+            -(-bottom // statistics_block_size), -(-right // statistics_block_size))
+
+def summarize(stats: dict, blocks: tuple[int, int, int, int] = None, percentiles: list[float] = default_percentiles) -> dict:
+    """Merge the partial statistics of blocks into the statistics of the area they cover
+
+    Keyword arguments:
+    - stats       -- The stored statistics (see read_statistics)
+    - blocks      -- (Optional) The blocks to merge (see block_window), all blocks when not given
+    - percentiles -- (Optional) The percentiles to compute, between 0 and 100, accurate to the histogram bins
+
+    Returns:
+    - Dictionary of the count of pixels with data, their mean, std, min, max and percentiles (None without data),
+      and the histogram as its bin edges and counts
+    """
+
+    top, left, bottom, right = blocks if blocks is not None else (0, 0) + stats["count"].shape
+    part: dict = {name: stats[name][top:bottom, left:right] for name in ("count", "sum", "squares", "min", "max", "histogram")}
+    count: int = int(part["count"].sum())
+    histogram: np.ndarray = part["histogram"].reshape(-1, histogram_bins).sum(axis=0)
+    result: dict = {"count": count, "mean": None, "std": None, "min": None, "max": None, "percentiles": {f"{p:g}": None for p in percentiles},
+                    "histogram": {"edges": np.linspace(-1, 1, histogram_bins + 1).round(6).tolist(), "counts": histogram.tolist()}}
+    if count == 0:
+        return result
+
+    mean: float = float(part["sum"].sum() / count)
+    result.update({"mean": mean, "std": float(np.sqrt(max(part["squares"].sum() / count - mean * mean, 0))),
+                   "min": float(part["min"].min()), "max": float(part["max"].max())})
+    result["percentiles"] = histogram_percentiles(histogram, count, result["min"], result["max"], percentiles)
+    return result
@@ -18,6 +18,8 @@ class Command(BaseCommand):
         parser.add_argument("-t", action='store_true', help='Enables the tiling of algorithm output')
         parser.add_argument("-to", type=str, help='Overrides the location where tiled images will be stored')
         parser.add_argument("-tmp", type=str, help='Overrides the location where temporary images will be stored while tiling')
+        parser.add_argument("-ts", type=int, choices=[128, 256, 512], help='Overrides the size of the tiles in pixels')
+        parser.add_argument("-te", type=str, help='Comma separated tile encodings to store next to png (webp, webp_lossless, jpeg)')
 
     def handle(self, *args, **options):
         environment: Environment = Environment()
@@ -42,6 +44,12 @@ class Command(BaseCommand):
             
         if (options["tmp"]):
             environment.temp_output = options["tmp"]
+
+        if (options["ts"]):
+            environment.tile_size = options["ts"]
+
+        if (options["te"]):
+            environment.tile_encodings = options["te"]
         
         Starter().start(environment=environment)
         api.views.TILES_DIRECTORY = environment.tile_output
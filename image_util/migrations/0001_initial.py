@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:35
+
+import django.db.models.deletion
+import django.db.models.manager
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Environment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('create', models.BooleanField(default=False)),
+                ('create_input', models.CharField(default='image_data/original_images/', max_length=100)),
+                ('create_output', models.CharField(default='image_data/images/', max_length=100)),
+                ('recreate', models.BooleanField(default=False)),
+                ('render', models.BooleanField(default=False)),
+                ('render_output', models.CharField(default='image_data/output/', max_length=100)),
+                ('rerender', models.BooleanField(default=False)),
+                ('tile', models.BooleanField(default=False)),
+                ('tile_output', models.CharField(default='image_data/tiles/', max_length=100)),
+                ('temp_output', models.CharField(default='image_data/temp/', max_length=100)),
+                ('tile_encodings', models.CharField(default='png', max_length=100)),
+                ('tile_size', models.IntegerField(default=128)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('driver', models.CharField(max_length=100)),
+                ('dtype', models.CharField(max_length=100)),
+                ('nodata', models.CharField(max_length=100, null=True)),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('count', models.IntegerField()),
+                ('crs', models.IntegerField()),
+                ('transform', models.CharField(max_length=200)),
+                ('blockxsize', models.IntegerField()),
+                ('blockysize', models.IntegerField()),
+                ('tiled', models.BooleanField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Image',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('img_id', models.IntegerField(unique=True)),
+                ('title', models.CharField(db_index=True, max_length=100)),
+                ('b2', models.CharField(max_length=100)),
+                ('b3', models.CharField(max_length=100)),
+                ('b4', models.CharField(max_length=100)),
+                ('b8', models.CharField(max_length=100)),
+                ('b8a', models.CharField(max_length=100)),
+                ('b11', models.CharField(max_length=100)),
+                ('tc', models.CharField(max_length=100)),
+                ('ndvi', models.CharField(max_length=100)),
+                ('ndwi', models.CharField(max_length=100)),
+                ('ndmi', models.CharField(max_length=100)),
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='image_util.profile')),
+            ],
+            managers=[
+                ('manager', django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Layer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alg_id', models.IntegerField()),
+                ('version', models.CharField(max_length=12)),
+                ('minzoom', models.IntegerField()),
+                ('maxzoom', models.IntegerField()),
+                ('tilesize', models.IntegerField()),
+                ('west', models.FloatField()),
+                ('south', models.FloatField()),
+                ('east', models.FloatField()),
+                ('north', models.FloatField()),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='layers', to='image_util.image')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['alg_id'], name='image_util__alg_id_4a407c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('image', 'alg_id'), name='unique_image_layer')],
+            },
+        ),
+    ]
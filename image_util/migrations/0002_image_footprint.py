@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_util', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='east',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='max_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='max_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='min_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='min_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='north',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='south',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='west',
+            field=models.FloatField(null=True),
+        ),
+    ]
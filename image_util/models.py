@@ -1,7 +1,9 @@
 from django.db import models
+from .flight import SingleFlight
+from . import histograms
 import rasterio as rio
 import numpy as np
-import glob, json, os, warnings
+import functools, glob, json, os, warnings
         
 warnings.filterwarnings("ignore")
 
@@ -12,6 +14,7 @@ path_to_images: str = "images/"
 path_to_output: str = "output/"
 path_to_tiles: str = "tiles/"
 path_to_temp: str = "temp/"
+path_to_locks: str = "locks/"       # Folder inside the temp output with the lock files of renders in progress
 
 CREATE_INPUT_INIT: str = f"{path_to_data}{path_to_originals}"
 CREATE_OUTPUT_INIT: str = f"{path_to_data}{path_to_images}"
@@ -24,6 +27,8 @@ RENDER_INIT = False
 TILE_INIT = False
 FORCE_RECREATE_INIT = False
 FORCE_RERENDER_INIT = False
+TILE_ENCODINGS_INIT: str = "png"
+TILE_SIZE_INIT: int = 128
 
 image_folder: str = ".SAFE/GRANULE/"
 image_data_folder: str = "/IMG_DATA/"
@@ -32,6 +37,9 @@ tif: str = ".tif"
 data_file_type: str = ".jp2"
 rendered_file_type: str = ".tiff"
 
+image_catalog_file: str = "images.json"      # Record of the created images and their band files, stored in the create output folder
+catalog_published_file: str = "catalog.published"    # Touched whenever the catalog in the database is published, stored in the create output folder
+
 output_tc_naming: str = "_TC"
 output_ndvi_naming: str = "_NDVI"
 output_ndwi_naming: str = "_NDWI"
@@ -77,6 +85,8 @@ class Environment(models.Model):
         - tile          -- (Optional) If the application should tile the images
         - tile_output   -- (Optional) The path to the location where the tiles will be stored
         - temp_output   -- (Optional) The path to the location where the temporary file, used for tiling, will be stored
+        - tile_encodings -- (Optional) Comma separated list of encodings in which the tiles will be stored (png, webp, webp_lossless, jpeg)
+        - tile_size     -- (Optional) The size of the tiles in pixels (128, 256 or 512)
     """
         
     create = models.BooleanField(default=CREATE_INIT)
@@ -89,14 +99,16 @@ class Environment(models.Model):
     tile = models.BooleanField(default=TILE_INIT)
     tile_output = models.CharField(max_length=100, default=TILE_OUTPUT_INIT)
     temp_output = models.CharField(max_length=100, default=TEMP_OUTPUT_INIT)
+    tile_encodings = models.CharField(max_length=100, default=TILE_ENCODINGS_INIT)
+    tile_size = models.IntegerField(default=TILE_SIZE_INIT)
 
     def __str__(self):
-        return f"[\n  create: {self.create}\n  create_input: {self.create_input}\n  create_output: {self.create_output}\n  recreate: {self.recreate}\n  render: {self.render}\n  render_output: {self.render_output}\n  rerender: {self.rerender}\n  tile: {self.tile}\n  tile_output: {self.tile_output}\n  temp_output: {self.temp_output}\n]"
+        return f"[\n  create: {self.create}\n  create_input: {self.create_input}\n  create_output: {self.create_output}\n  recreate: {self.recreate}\n  render: {self.render}\n  render_output: {self.render_output}\n  rerender: {self.rerender}\n  tile: {self.tile}\n  tile_output: {self.tile_output}\n  temp_output: {self.temp_output}\n  tile_encodings: {self.tile_encodings}\n  tile_size: {self.tile_size}\n]"
 
 class Profile(models.Model):
     driver = models.CharField(max_length=100)
     dtype = models.CharField(max_length=100)
-    nodata = models.CharField(max_length=100)
+    nodata = models.CharField(max_length=100, null=True)       # None when the band files do not define a nodata value
     width = models.IntegerField()
     height = models.IntegerField()
     count = models.IntegerField()
@@ -169,6 +181,25 @@ class ProfileFactory(models.Manager):
         return result
 
 
+renders: SingleFlight = SingleFlight()      # Renders in progress in this process
+
+def single_flight(naming: str):
+    """Coalesce concurrent calls of a create_* method rendering the same output file, across threads and processes
+
+    Keyword arguments:
+    - naming -- The suffix of the output file written by the method (output_*_naming)
+    """
+
+    def decorator(create):
+        @functools.wraps(create)
+        def wrapper(self, image, environment: Environment = Environment()) -> str:
+            image_path: str = f"{environment.render_output}{image.title}{naming}{rendered_file_type}"
+            return renders.produce(image_path, lambda: create(self, image, environment=environment), f"{environment.temp_output}{path_to_locks}")
+        return wrapper
+
+    return decorator
+
+
 class ImageManager(models.Manager):
 
     def load(self, path: str) -> np.ndarray:
@@ -185,6 +216,7 @@ class ImageManager(models.Manager):
 
        return rio.open(path).read(1)
 
+    @single_flight(output_tc_naming)
     def create_true_color(self, image, environment: Environment = Environment()) -> str:
         """Render the True-Color visualization of the given image
 
@@ -225,6 +257,7 @@ class ImageManager(models.Manager):
             return None         # The method is required to return a string, as such after an Exception it will return None       
         
 
+    @single_flight(output_ndvi_naming)
     def create_NDVI(self, image, environment: Environment = Environment()) -> str:
         """Render the NDVI visualization of the given image
 
@@ -248,6 +281,7 @@ class ImageManager(models.Manager):
                 b8: np.ndarray = self.load(image.b8).astype('float64')      # Nir band
 
                 ndvi: np.ndarray = np.where(b4 + b8 == 0., 0, ((b8 - b4) / (b8 + b4)))                      # Calculate the NDVI values
+                histograms.write_statistics(image_path, ndvi, b4 + b8 != 0., ProfileFactory().get_rio_profile(image.profile))      # Value distribution for legends, from the values already in memory
                 #small_ndvi: np.ndarray = (ndvi[::ndvi_size_reduction, ::ndvi_size_reduction] + 1) / 2      # Reducing size of the NDVI images in relation to the resolution of the other algorithms (deprecated)
                                                                                                             # Since the tiff will be using int and the values are stored as floats [-1, 1],
                 ndvi: np.ndarray = (ndvi + 1) / 2                                                    # conversion is done by adding 1 and dividing by 2
@@ -269,6 +303,7 @@ class ImageManager(models.Manager):
             return None         # The method is required to return a string, as such after an Exception it will return None
         
         
+    @single_flight(output_ndwi_naming)
     def create_NDWI(self, image, environment: Environment = Environment()) -> str:
         """Render the NDWI visualization of the given image
 
@@ -292,6 +327,7 @@ class ImageManager(models.Manager):
                 b8: np.ndarray = self.load(image.b8).astype('float64')      # Nir band
 
                 ndwi: np.ndarray = np.where(b3 + b8 == 0., 0, ((b3 - b8) / (b3 + b8)))                      # Calculate the NDWI values
+                histograms.write_statistics(image_path, ndwi, b3 + b8 != 0., ProfileFactory().get_rio_profile(image.profile))      # Store the value distribution
                 # small_ndwi: np.ndarray = (ndwi[::ndwi_size_reduction, ::ndwi_size_reduction] + 1) / 2     # Reducing size of the NDWI images in relation to the resolution of the other algorithms (deprecated)
                                                                                                             # Since the tiff will be using int and the values are stored as floats [-1, 1],
                 ndwi: np.ndarray = (ndwi + 1) / 2                                                     # conversion is done by adding 1 and dividing by 2
@@ -313,6 +349,7 @@ class ImageManager(models.Manager):
             return None         # The method is required to return a string, as such after an Exception it will return None
 
         
+    @single_flight(output_ndmi_naming)
     def create_NDMI(self, image, environment: Environment = Environment()) -> str:
         """Render the NDMI visualization of the given image
 
@@ -336,6 +373,7 @@ class ImageManager(models.Manager):
                 b11: np.ndarray = self.load(image.b11).astype('float64')    # Swir band
 
                 ndmi: np.ndarray = np.where(b11 + b8a == 0., 0, ((b8a - b11) / (b8a + b11)))      # Calculate the NDMI values
+                histograms.write_statistics(image_path, ndmi, b11 + b8a != 0., ProfileFactory().get_rio_profile(image.profile))      # Store the value distribution
                 ndmi = (ndmi + 1) / 2                                                      # Since the tiff will be using int and the values are stored as floats [-1, 1],
                                                                                                 # conversion is done by adding 1 and dividing by 2
 
@@ -355,8 +393,8 @@ class ImageManager(models.Manager):
     
 
 class Image(models.Model):
-    img_id = models.IntegerField()                  # Id of the image
-    title = models.CharField(max_length=100)        # Name of the image file
+    img_id = models.IntegerField(unique=True)       # Id of the image, also the folder of its tiles
+    title = models.CharField(max_length=100, db_index=True)        # Name of the image file
     b2 = models.CharField(max_length=100)           # The paths to the band files of the image
     b3 = models.CharField(max_length=100)
     b4 = models.CharField(max_length=100)
@@ -368,12 +406,53 @@ class Image(models.Model):
     ndwi = models.CharField(max_length=100)
     ndmi = models.CharField(max_length=100)
     profile = models.OneToOneField(Profile, on_delete = models.CASCADE)     # The base profile of the image
+    west = models.FloatField(null=True)             # The footprint of the image in degrees, computed when the catalog is published
+    south = models.FloatField(null=True)
+    east = models.FloatField(null=True)
+    north = models.FloatField(null=True)
+    min_x = models.FloatField(null=True)            # The footprint of the image in EPSG:3857 meters
+    min_y = models.FloatField(null=True)
+    max_x = models.FloatField(null=True)
+    max_y = models.FloatField(null=True)
     manager = ImageManager() 
 
     def __str__(self):
         return f"[\n  img_id: {self.img_id}\n  title: {self.title}\n  b2: {self.b2}\n  b3: {self.b3}\n  b4: {self.b4}\n  b8: {self.b8}\n  b8a: {self.b8a}\n  b11: {self.b11}\n  tc: {self.tc}\n  ndvi: {self.ndvi}\n  ndwi: {self.ndwi}\n  ndmi: {self.ndmi}\n  profile: {self.profile}\n]"
 
 
+class Layer(models.Model):
+    """Tiled algorithm output of an image, as recorded in the manifest of its tile folder
+
+    Fields:
+        - image    -- The image the layer was rendered from
+        - alg_id   -- The ID of the algorithm ( 0 - TC | 1 - NDVI | 2 - NDWI | 3 - NDMI ), also the folder of its tiles
+        - version  -- The version of the tiles, used in versioned tile URLs
+        - minzoom  -- The lowest stored zoom level
+        - maxzoom  -- The deepest stored zoom level
+        - tilesize -- The size of the tiles in pixels
+        - west, south, east, north -- The bounds of the layer in degrees
+    """
+
+    image = models.ForeignKey(Image, related_name="layers", on_delete=models.CASCADE)
+    alg_id = models.IntegerField()
+    version = models.CharField(max_length=12)
+    minzoom = models.IntegerField()
+    maxzoom = models.IntegerField()
+    tilesize = models.IntegerField()
+    west = models.FloatField()
+    south = models.FloatField()
+    east = models.FloatField()
+    north = models.FloatField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["image", "alg_id"], name="unique_image_layer")]
+        indexes = [models.Index(fields=["alg_id"])]
+
+    def __str__(self):
+        return f"[\n  image: {self.image.img_id}\n  alg_id: {self.alg_id}\n  version: {self.version}\n  zoom: {self.minzoom}-{self.maxzoom}\n  bounds: {[self.west, self.south, self.east, self.north]}\n]"
+
+
+
 class ImageFactory(models.Manager):
     current_id: int = 0         # Internal value to keep track of currently to be assigned ID for images
 
@@ -0,0 +1,82 @@
+from . import coords, dynamic
+import rasterio as rio
+import numpy as np
+
+index_algorithms: list[int] = [1, 2, 3]      # NDVI, NDWI and NDMI, the algorithms with a value per pixel
+
+def block_groups(src, rows: np.ndarray, cols: np.ndarray):
+    """Group pixels by the internal block of the raster containing them
+
+    Keyword arguments:
+    - src        -- The opened rasterio dataset
+    - rows, cols -- The pixel coordinates, all inside the raster
+
+    Returns:
+    - Iterator of (window of the block, indexes of the pixels inside it)
+    """
+
+    block_height, block_width = src.block_shapes[0]
+    blocks_per_row: int = -(-src.width // block_width)
+    blocks: np.ndarray = (rows // block_height) * blocks_per_row + cols // block_width
+
+    order: np.ndarray = np.argsort(blocks, kind="stable")
+    unique, starts = np.unique(blocks[order], return_index=True)
+    for block, group in zip(unique, np.split(order, starts[1:])):
+        block_row, block_col = divmod(int(block), blocks_per_row)
+        yield rio.windows.Window(block_col * block_width, block_row * block_height,
+                                 min(block_width, src.width - block_col * block_width), min(block_height, src.height - block_row * block_height)), group
+
+def sample_band(src, rows: np.ndarray, cols: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Read the values of a band at the given pixels, reading only the blocks which contain them
+
+    Keyword arguments:
+    - src        -- The opened rasterio dataset of the band
+    - rows, cols -- The pixel coordinates, all inside the raster
+
+    Returns:
+    - The values of the pixels and the mask of pixels which are not nodata
+    """
+
+    values: np.ndarray = np.zeros(len(rows), dtype=src.dtypes[0])
+    for window, group in block_groups(src, rows, cols):
+        data: np.ndarray = src.read(1, window=window)
+        values[group] = data[rows[group] - int(window.row_off), cols[group] - int(window.col_off)]
+
+    valid: np.ndarray = values != src.nodata if src.nodata is not None else np.ones(len(rows), dtype=bool)
+    return values, valid
+
+def sample_points(band_paths: list[str], alg_id: int, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """Get the index values of an image at many locations at once
+
+    Keyword arguments:
+    - band_paths -- The paths of the band files of the algorithm, in the order of dynamic.algorithms[alg_id]["bands"]
+    - alg_id     -- The ID of the index algorithm ( 1 - NDVI | 2 - NDWI | 3 - NDMI )
+    - lons, lats -- The locations in degrees
+
+    Returns:
+    - The index value in [-1, 1] of every location, NaN outside the image or where it has no data
+    """
+
+    result: np.ndarray = np.full(len(lons), np.nan)
+
+    with rio.open(band_paths[0]) as src:            # All bands of an image share the same grid
+        xs, ys = coords.get_transformer(coords.geographic_epsg, src.crs.to_epsg())(lons, lats)
+        inverse = ~src.transform
+        cols: np.ndarray = np.floor(inverse.a * xs + inverse.b * ys + inverse.c).astype(np.int64)
+        rows: np.ndarray = np.floor(inverse.d * xs + inverse.e * ys + inverse.f).astype(np.int64)
+        inside: np.ndarray = np.flatnonzero((cols >= 0) & (cols < src.width) & (rows >= 0) & (rows < src.height))
+
+    if len(inside) == 0:
+        return result
+
+    bands: list[np.ndarray] = []
+    valid: np.ndarray = np.ones(len(inside), dtype=bool)
+    for path in band_paths:
+        with rio.open(path) as band:
+            values, band_valid = sample_band(band, rows[inside], cols[inside])
+        bands.append(values)
+        valid &= band_valid
+
+    valid &= (bands[0].astype('float64') + bands[1]) != 0          # Both bands empty, outside of the scene
+    result[inside[valid]] = dynamic.normalized_difference(bands[0], bands[1])[valid]
+    return result
@@ -1,21 +1,30 @@
-from .models import Environment, Image, ImageManager, ImageFactory
-import os, shutil
+from .models import Environment, Image, Layer, Profile, ImageManager, ImageFactory, image_catalog_file, catalog_published_file, path_to_locks
+from django.db import transaction
+from . import coords, dynamic, tiles
+from .cube import CubeWriter
+from PIL import Image as PILImage
+import rasterio as rio
+import rasterio.warp
+import numpy as np
+import glob, hashlib, json, math, os, shutil, time
 
 safe: str = ".SAFE/"
 granule: str = "GRANULE/"
 
 safe_folder_construction: str = f"{safe}{granule}"
 
-output_format: str = "GTiff"
-output_type: str = "Byte" # Byte/Int8/Int16/UInt16/UInt32/Int32/UInt64/Int64/Float32/Float64/CInt16/CInt32/CFloat32/CFloat64
 min_val = 0
 max_val = 255
-width_percentage = 100
-height_percentage = 100
-start_level: int = 6
-end_level: int = 13
-web_viewer: str = "leaflet"
-tilesize: int = 128
+tile_file_type: str = ".png"
+mercator_crs: str = "EPSG:3857"
+geographic_crs: str = "EPSG:4326"
+manifest_block_size: int = 256               # Size of the pixel blocks which are compared to find changed regions
+partial_retile_max_fraction: float = 0.5     # Above this fraction of changed pixels the whole layer is retiled
+true_color_alg_id: int = 0      # Only the True-Color output is opaque imagery, the index layers are stored with transparency
+
+warp_plan_folder: str = "warp/"              # Folder inside the temp output where warp plans are kept between runs
+warp_plan_file_type: str = ".npz"
+warp_outside: int = np.iinfo(np.uint16).max  # Resampling index of tile pixels which fall outside of the source raster
 
 funcs = {
     "TC":   (lambda a, b : ImageManager().create_true_color(a, environment=b)),
@@ -100,6 +109,7 @@ class Creator():
             
                     print(f"\nLOGGER: < .tif image for {filename} created")
         
+            self.write_catalog(images, environment=environment)
             print(f"\nLOGGER: <-- Finished image creation in [ {environment.create_input} ]")
                 
             return images
@@ -109,6 +119,27 @@ class Creator():
             return []
 
 
+    def write_catalog(self, images: list[Image], environment: Environment = Environment()):
+        """Store the IDs and band files of the created images, so their layers can be rendered on request
+
+        Keyword arguments:
+        - images      -- The created Image objects
+        - environment -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+        """
+
+        catalog: dict = {"images": [
+            {"img_id": img.img_id, "title": img.title, "b2": img.b2, "b3": img.b3, "b4": img.b4, "b8": img.b8, "b8a": img.b8a, "b11": img.b11}
+            for img in images if img is not None
+        ]}
+
+        catalog_path: str = f"{environment.create_output}{image_catalog_file}"
+        os.makedirs(environment.create_output, exist_ok=True)
+
+        with open(f"{catalog_path}.tmp", "w") as file:
+            json.dump(catalog, file, indent=2)
+        os.replace(f"{catalog_path}.tmp", catalog_path)       # Readers never see a partially written catalog
+
+
 class Renderer():
 
     def render(self, img: Image, name: str, environment: Environment = Environment()):
@@ -166,8 +197,99 @@ class Renderer():
             return []
 
 
+class WarpPlanner():
+    plans: dict = {}        # Plan of the grid which was used last, shared by all layers tiled from the same image
+
+    def plan_key(self, src, tile_size: int, zoom: int) -> str:
+        """Get the key identifying the warp plan of a grid
+
+        Keyword arguments:
+        - src       -- The opened rasterio dataset of the render output
+        - tile_size -- The size of the tiles in pixels
+        - zoom      -- The zoom level for which the plan is made
+
+        Returns:
+        - The key of the plan, equal for every render output of the same image profile
+        """
+
+        grid: list = [src.crs.to_string(), list(src.transform)[:6], src.width, src.height, tile_size, zoom]
+        return hashlib.sha1(json.dumps(grid).encode()).hexdigest()[:16]
+
+    def get_plan(self, src, tile_size: int, zoom: int, environment: Environment = Environment()) -> dict:
+        """Get the warp plan for the grid of the given render output, computing and storing it only the first time
+
+        Keyword arguments:
+        - src         -- The opened rasterio dataset of the render output
+        - tile_size   -- The size of the tiles in pixels
+        - zoom        -- The zoom level for which the plan is made
+        - environment -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+
+        Returns:
+        - The warp plan (see compute_plan)
+        """
+
+        key: str = self.plan_key(src, tile_size, zoom)
+        if key in self.plans:
+            return self.plans[key]
+
+        plan_path: str = f"{environment.temp_output}{warp_plan_folder}{key}{warp_plan_file_type}"
+
+        if os.path.isfile(plan_path):
+            with np.load(plan_path) as stored:
+                plan: dict = {name: stored[name] for name in stored.files}
+        else:
+            print(f"\nLOGGER: Computing warp plan {key} for zoom level {zoom}")
+            plan: dict = self.compute_plan(src, tile_size, zoom)
+
+            os.makedirs(os.path.dirname(plan_path), exist_ok=True)
+            with open(f"{plan_path}.tmp", "wb") as file:
+                np.savez_compressed(file, **plan)
+            os.replace(f"{plan_path}.tmp", plan_path)
+
+        self.plans.clear()              # Images are tiled one after the other, only the current plan is kept in memory
+        self.plans[key] = plan
+        return plan
+
+    def compute_plan(self, src, tile_size: int, zoom: int) -> dict:
+        """Compute the mapping from the pixels of every Web-Mercator tile to the pixels of the source grid
+
+        Keyword arguments:
+        - src       -- The opened rasterio dataset of the render output
+        - tile_size -- The size of the tiles in pixels
+        - zoom      -- The zoom level for which the plan is made
+
+        Returns:
+        - Dictionary with, for every tile containing data, its (z, x, y) in "tiles", the source window it reads
+          as (column offset, row offset, width, height) in "windows", and the nearest source row and column for
+          every tile pixel, relative to that window, in "rows" and "cols" (warp_outside for pixels without data)
+        """
+
+        x_min, x_max, y_min, y_max = tiles.tile_range(rio.warp.transform_bounds(src.crs, mercator_crs, *src.bounds, densify_pts=21), zoom)
+        found_tiles, found_windows, found_rows, found_cols = [], [], [], []
+
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                mapping = tiles.source_pixels(src, tile_size, zoom, x, y)
+                if mapping is None:
+                    continue
+
+                window, rows, cols, valid = mapping
+                found_tiles.append((zoom, x, y))
+                found_windows.append(window)
+                found_rows.append(np.where(valid, rows, warp_outside).astype(np.uint16))
+                found_cols.append(np.where(valid, cols, warp_outside).astype(np.uint16))
+
+        return {
+            "tiles": np.array(found_tiles, dtype=np.int32).reshape(-1, 3),
+            "windows": np.array(found_windows, dtype=np.int32).reshape(-1, 4),
+            "rows": np.array(found_rows, dtype=np.uint16).reshape(-1, tile_size, tile_size),
+            "cols": np.array(found_cols, dtype=np.uint16).reshape(-1, tile_size, tile_size),
+        }
+
+
 class Tiler():
     # img#id/alg#id/level#id/x/y
+    planner: WarpPlanner = WarpPlanner()          # Local WarpPlanner() reference so all layers of an image share its warp plan
 
     def tile_image(self, img: Image, rendered_path: str, alg_id: int, environment: Environment = Environment()):
         """Tile the algorithm output of the given image
@@ -185,21 +307,345 @@ class Tiler():
                 print(f"\nLOGGER: The folder {environment.temp_output} has been created where the temporary tiling data will be stored")
             
             path_to_img_tiles: str = f"{environment.tile_output}{img.img_id}/{alg_id}/"             # Tiles_Location/img#id/alg#id/
-            img_title_bare: str = os.path.splitext(os.path.basename(img.title))[0]                  # filename
-            path_to_temp_img: str = f"{environment.temp_output}{img_title_bare}.tif"
 
             if not os.path.exists(path_to_img_tiles):          # If the folder for the tiled images from does not exist yet, create it
                 os.makedirs(path_to_img_tiles)
                 print(f"\nLOGGER: The folder {path_to_img_tiles} has been created where the tile data will be stored")
 
-            # Using the GDAL libraries for tiling
-            # os.system(f"gdal_translate -of {output_format} -ot {output_type} -scale {rendered_path} {path_to_temp_img}")
-            os.system(f"gdal_translate -of {output_format} -ot {output_type} -scale {min_val} {max_val} -outsize {width_percentage}% {height_percentage}% {rendered_path} {path_to_temp_img}")
-            os.system(f"gdal2tiles.py -z {start_level}-{end_level} -w {web_viewer} --tilesize={tilesize} {path_to_temp_img} {path_to_img_tiles}")
+            previous: dict = self.read_manifest(path_to_img_tiles)
+            checksum: str = self.checksum(rendered_path)
+            parameters: dict = self.tile_parameters(rendered_path, environment)
+
+            if previous and previous["checksum"] == checksum and previous["params"] == parameters:     # Nothing changed since the layer was last tiled
+                print(f"\nLOGGER: Tiles in {path_to_img_tiles} are up to date. Skipping.")
+                return
+
+            manifest: dict = self.describe_render(rendered_path, checksum, parameters)
+            window: rio.windows.Window = self.changed_window(previous, manifest)
+
+            if window is None:              # New layer, changed tiling parameters or changed extent, retile everything
+                shutil.rmtree(path_to_img_tiles)
+                os.makedirs(path_to_img_tiles)
+                self.generate_tiles(rendered_path, path_to_img_tiles, alg_id, parameters, environment=environment)
+
+            elif window.width > 0 and window.height > 0:        # Only a region of the render output changed
+                print(f"\nLOGGER: Retiling changed region {window} of {rendered_path}")
+                self.generate_tiles(rendered_path, path_to_img_tiles, alg_id, parameters, window=window, environment=environment)
+
+            self.write_manifest(path_to_img_tiles, manifest)
         
         except Exception as e:
             print(f"\nEXCEPTION: {e}")
 
+    def generate_tiles(self, rendered_path: str, path_to_tiles: str, alg_id: int, parameters: dict, window: rio.windows.Window = None, environment: Environment = Environment()):
+        """Generate the tiles of the render output, or only the tiles affected by a changed window of it
+
+        The deepest zoom level is resampled from the render output using the warp plan of its grid,
+        every lower level is averaged from its four children, the same way gdal2tiles builds its overview levels.
+
+        Keyword arguments:
+        - rendered_path -- The path where the rendered algorithm output can be found
+        - path_to_tiles -- The path to the folder where the tiles will be stored
+        - alg_id        -- The ID of the algorithm to be tiled ( 0 - TC | 1 - NDVI | 2 - NDWI | 3 - NDMI )
+        - parameters    -- The tiling parameters of the layer (see tile_parameters)
+        - window        -- (Optional) The pixel window of the render output which changed, only the tiles intersecting it and their ancestors are regenerated
+        - environment   -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+        """
+
+        encodings: list[str] = parameters["encodings"]
+        tile_size: int = parameters["tilesize"]
+
+        with rio.open(rendered_path) as src:
+            plan: dict = self.planner.get_plan(src, tile_size, parameters["end_level"], environment=environment)
+            selected: np.ndarray = np.arange(len(plan["tiles"]))
+
+            if window is not None:
+                changed = rio.warp.transform_bounds(src.crs, mercator_crs, *rio.windows.bounds(window, src.transform), densify_pts=21)
+                x_min, x_max, y_min, y_max = tiles.tile_range(changed, parameters["end_level"])
+                xs, ys = plan["tiles"][:, 1], plan["tiles"][:, 2]
+                selected = np.flatnonzero((xs >= x_min) & (xs <= x_max) & (ys >= y_min) & (ys <= y_max))
+
+            level: dict = {}                # (x, y) -> tile image (None when empty) of the level which was generated last
+            for index in selected:
+                z, x, y = (int(value) for value in plan["tiles"][index])
+                level[(x, y)] = self.warp_tile(src, plan, index)
+                self.write_tile(level[(x, y)], f"{path_to_tiles}{z}/{x}/{y}", alg_id, encodings)
+
+        for z in range(parameters["end_level"] - 1, parameters["start_level"] - 1, -1):
+            parents: set = {(x >> 1, y >> 1) for x, y in level}
+            children: dict = level
+            level = {}
+
+            for x, y in parents:
+                quadrants: dict = {}
+                for child_x in (2 * x, 2 * x + 1):
+                    for child_y in (2 * y, 2 * y + 1):
+                        if (child_x, child_y) in children:
+                            quadrants[(child_x - 2 * x, child_y - 2 * y)] = children[(child_x, child_y)]
+                        else:                                                       # Unchanged child of a partially regenerated parent
+                            quadrants[(child_x - 2 * x, child_y - 2 * y)] = self.read_tile(f"{path_to_tiles}{z + 1}/{child_x}/{child_y}")
+
+                level[(x, y)] = self.downsample(quadrants, tile_size)
+                self.write_tile(level[(x, y)], f"{path_to_tiles}{z}/{x}/{y}", alg_id, encodings)
+
+    def warp_tile(self, src, plan: dict, index: int) -> PILImage.Image:
+        """Resample one tile of the deepest zoom level from the render output using the warp plan
+
+        Keyword arguments:
+        - src   -- The opened rasterio dataset of the render output
+        - plan  -- The warp plan of the grid of the render output (see WarpPlanner)
+        - index -- The index of the tile in the plan
+
+        Returns:
+        - The RGBA tile image, or None when the tile does not contain any data
+        """
+
+        col_off, row_off, width, height = (int(value) for value in plan["windows"][index])
+        data: np.ndarray = src.read(window=rio.windows.Window(col_off, row_off, width, height))      # Only the source pixels under the tile are read
+
+        rows: np.ndarray = plan["rows"][index]
+        cols: np.ndarray = plan["cols"][index]
+        valid: np.ndarray = rows != warp_outside
+        pixels: np.ndarray = data[:, np.where(valid, rows, 0), np.where(valid, cols, 0)]
+
+        if src.nodata is not None:
+            valid &= ~np.all(pixels == src.nodata, axis=0)
+        if not valid.any():
+            return None
+
+        if pixels.dtype != np.uint8:        # Same scaling gdal_translate -scale applied to non byte output
+            pixels = np.clip((pixels.astype("float64") - min_val) * 255 / (max_val - min_val), 0, 255)
+        if pixels.shape[0] < 3:
+            pixels = np.repeat(pixels[:1], 3, axis=0)
+
+        rgba: np.ndarray = np.dstack([pixels[0], pixels[1], pixels[2], valid * 255]).astype(np.uint8)
+        return PILImage.fromarray(rgba, "RGBA")
+
+    def downsample(self, quadrants: dict, tile_size: int) -> PILImage.Image:
+        """Average four child tiles into their parent tile
+
+        Keyword arguments:
+        - quadrants -- Dictionary of (x offset, TMS y offset) to the child tile image, or None for empty children
+        - tile_size -- The size of the tiles in pixels
+
+        Returns:
+        - The RGBA parent tile image, or None when all children are empty
+        """
+
+        if all(tile is None for tile in quadrants.values()):
+            return None
+
+        canvas: PILImage.Image = PILImage.new("RGBA", (2 * tile_size, 2 * tile_size))
+        for (dx, dy), tile in quadrants.items():
+            if tile is not None:
+                canvas.paste(tile, (dx * tile_size, (1 - dy) * tile_size))      # TMS rows count from the south, image rows from the north
+
+        pixels: np.ndarray = np.asarray(canvas, dtype="float64").reshape(tile_size, 2, tile_size, 2, 4)
+        alpha: np.ndarray = pixels[..., 3].sum(axis=(1, 3))
+        color: np.ndarray = (pixels[..., :3] * pixels[..., 3:]).sum(axis=(1, 3))       # Weighted by alpha so transparent pixels do not darken the edges of the data
+
+        rgb: np.ndarray = np.divide(color, alpha[..., None], out=np.zeros_like(color), where=alpha[..., None] > 0)
+        rgba: np.ndarray = np.dstack([rgb, alpha / 4]).round().astype(np.uint8)
+        return PILImage.fromarray(rgba, "RGBA")
+
+    def read_tile(self, path_bare: str) -> PILImage.Image:
+        """Read a stored tile
+
+        Keyword arguments:
+        - path_bare -- The path of the tile without extension
+
+        Returns:
+        - The RGBA tile image, or None when the tile is not stored
+        """
+
+        if not os.path.isfile(f"{path_bare}{tile_file_type}"):
+            return None
+
+        with PILImage.open(f"{path_bare}{tile_file_type}") as tile:
+            return tile.convert("RGBA")
+
+    def write_tile(self, tile: PILImage.Image, path_bare: str, alg_id: int, encodings: list[str]):
+        """Store a tile in all requested encodings, replacing any previously stored variants
+
+        Keyword arguments:
+        - tile      -- The RGBA tile image, or None for an empty tile which is not stored
+        - path_bare -- The path of the tile without extension
+        - alg_id    -- The ID of the algorithm which is tiled ( 0 - TC | 1 - NDVI | 2 - NDWI | 3 - NDMI )
+        - encodings -- The encodings in which the tile is stored (see tiles.parse_encodings)
+        """
+
+        for outdated in glob.glob(f"{path_bare}.*"):
+            os.remove(outdated)
+
+        if tile is None or tile.getchannel("A").getextrema()[1] == 0:       # Fully transparent tiles are not stored, like gdal2tiles does
+            return
+
+        os.makedirs(os.path.dirname(path_bare), exist_ok=True)
+        opaque: bool = tiles.is_opaque(tile)
+
+        for encoding in encodings:
+            if encoding in tiles.opaque_only and (alg_id != true_color_alg_id or not opaque):     # JPEG has no alpha channel, so it is only offered for opaque True-Color tiles
+                continue
+
+            with open(f"{path_bare}.{tiles.tile_encodings[encoding]['extension']}", "wb") as file:
+                file.write(tiles.encode_tile(tile, encoding))
+
+    def zoom_range(self, rendered_path: str, tile_size: int) -> tuple[int, int]:
+        """Get the useful zoom levels of a render output, following the rules gdal2tiles uses by default
+
+        Keyword arguments:
+        - rendered_path -- The path where the rendered algorithm output can be found
+        - tile_size     -- The size of the tiles in pixels
+
+        Returns:
+        - The lowest zoom level, at which the whole extent fits in about one tile,
+          and the deepest zoom level which is not upsampled beyond the native resolution
+        """
+
+        with rio.open(rendered_path) as src:
+            transform, width, height = rio.warp.calculate_default_transform(src.crs, mercator_crs, src.width, src.height, *src.bounds)     # Same warp GDAL suggests when tiling
+
+        pixel_size: float = transform.a
+        max_zoom: int = tiles.zoom_for_pixel_size(pixel_size, tile_size)
+        min_zoom: int = tiles.zoom_for_pixel_size(pixel_size * max(width, height) / tile_size, tile_size)
+
+        return min(min_zoom, max_zoom), max_zoom
+
+    def tile_parameters(self, rendered_path: str, environment: Environment = Environment()) -> dict:
+        """Get the parameters which determine the tiles generated from a render output
+
+        Keyword arguments:
+        - rendered_path -- The path where the rendered algorithm output can be found
+        - environment   -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+
+        Returns:
+        - Dictionary of the tiling parameters
+        """
+
+        start_level, end_level = self.zoom_range(rendered_path, environment.tile_size)
+
+        return {
+            "start_level": start_level,
+            "end_level": end_level,
+            "tilesize": environment.tile_size,
+            "scheme": "tms",
+            "resampling": "nearest",
+            "scale": [min_val, max_val],
+            "encodings": tiles.parse_encodings(environment.tile_encodings),
+        }
+
+    def checksum(self, path: str) -> str:
+        """Get the checksum of the file at the given path
+
+        Keyword arguments:
+        - path -- The path to the file
+
+        Returns:
+        - The hexadecimal SHA-256 digest of the file contents
+        """
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def describe_render(self, rendered_path: str, checksum: str, parameters: dict) -> dict:
+        """Build the manifest recording which render output a layer was tiled from
+
+        Keyword arguments:
+        - rendered_path -- The path where the rendered algorithm output can be found
+        - checksum      -- The checksum of the render output
+        - parameters    -- The tiling parameters used (see tile_parameters)
+
+        Returns:
+        - The manifest containing the checksum, the parameters, the raster grid and a hash for every block of pixels
+        """
+
+        with rio.open(rendered_path) as src:
+            hashes: list[str] = []
+            for row in range(0, src.height, manifest_block_size):
+                for col in range(0, src.width, manifest_block_size):
+                    block = rio.windows.Window(col, row, min(manifest_block_size, src.width - col), min(manifest_block_size, src.height - row))
+                    hashes.append(hashlib.blake2b(src.read(window=block).tobytes(), digest_size=8).hexdigest())
+
+            return {
+                "source": rendered_path,
+                "checksum": checksum,
+                "version": hashlib.sha256(json.dumps([checksum, parameters], sort_keys=True).encode()).hexdigest()[:12],      # Changes with every change of the tiles, used in versioned tile URLs
+                "minzoom": parameters["start_level"],         # Zoom range and bounds so the front end can clamp the layer
+                "maxzoom": parameters["end_level"],
+                "tilesize": parameters["tilesize"],
+                "bounds": list(rio.warp.transform_bounds(src.crs, geographic_crs, *src.bounds, densify_pts=21)),
+                "params": parameters,
+                "grid": {"width": src.width, "height": src.height, "crs": src.crs.to_string(), "transform": list(src.transform)[:6]},
+                "blocks": {"size": manifest_block_size, "hashes": hashes},
+            }
+
+    def changed_window(self, previous: dict, manifest: dict) -> rio.windows.Window:
+        """Get the pixel window containing every block which differs between two manifests of a layer
+
+        Keyword arguments:
+        - previous -- The manifest the layer was last tiled from, or None
+        - manifest -- The manifest of the current render output
+
+        Returns:
+        - The changed window (empty when no pixel changed), or None when the layer has to be retiled completely
+        """
+
+        if not previous or previous.get("params") != manifest["params"] or previous.get("grid") != manifest["grid"] or previous.get("blocks", {}).get("size") != manifest["blocks"]["size"]:
+            return None
+
+        old: np.ndarray = np.array(previous["blocks"]["hashes"])
+        new: np.ndarray = np.array(manifest["blocks"]["hashes"])
+        if old.shape != new.shape:
+            return None
+
+        changed: np.ndarray = np.flatnonzero(old != new)
+        if changed.size == 0:
+            return rio.windows.Window(0, 0, 0, 0)
+
+        size: int = manifest["blocks"]["size"]
+        blocks_per_row: int = math.ceil(manifest["grid"]["width"] / size)
+        rows, cols = np.divmod(changed, blocks_per_row)
+
+        col_off, row_off = int(cols.min()) * size, int(rows.min()) * size
+        width: int = min((int(cols.max()) + 1) * size, manifest["grid"]["width"]) - col_off
+        height: int = min((int(rows.max()) + 1) * size, manifest["grid"]["height"]) - row_off
+
+        if width * height > partial_retile_max_fraction * manifest["grid"]["width"] * manifest["grid"]["height"]:     # Most of the layer changed, a full retile is cheaper
+            return None
+
+        return rio.windows.Window(col_off, row_off, width, height)
+
+    def read_manifest(self, path_to_img_tiles: str) -> dict:
+        """Read the manifest of the given tiled layer
+
+        Keyword arguments:
+        - path_to_img_tiles -- The path to the folder where the tiles of the layer are stored
+
+        Returns:
+        - The manifest of the layer, or None if the layer was not tiled before
+        """
+
+        try:
+            with open(f"{path_to_img_tiles}{tiles.layer_manifest_file}") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def write_manifest(self, path_to_img_tiles: str, manifest: dict):
+        """Store the manifest of the given tiled layer
+
+        Keyword arguments:
+        - path_to_img_tiles -- The path to the folder where the tiles of the layer are stored
+        - manifest          -- The manifest to store
+        """
+
+        with open(f"{path_to_img_tiles}{tiles.layer_manifest_file}.tmp", "w") as file:
+            json.dump(manifest, file)
+        os.replace(f"{path_to_img_tiles}{tiles.layer_manifest_file}.tmp", f"{path_to_img_tiles}{tiles.layer_manifest_file}")        # Readers never see a half written manifest
+
     def tile_images(self, images: list[Image], environment: Environment = Environment()):
         """Tile the algorithm output of all given images
 
@@ -231,12 +677,92 @@ class Tiler():
         print(f"\nLOGGER: <-- Finished tiling")
 
 
+class Publisher():
+
+    def read_layers(self, img: Image, environment: Environment = Environment()) -> list[Layer]:
+        """Get the tiled layers of the given image from the manifests in its tile folders
+
+        Keyword arguments:
+        - img         -- The Image object whose layers should be read
+        - environment -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+
+        Returns:
+        - The unsaved Layer objects of the image
+        """
+
+        layers: list[Layer] = []
+        for alg_id in dynamic.algorithms:
+            manifest: dict = Tiler().read_manifest(f"{environment.tile_output}{img.img_id}/{alg_id}/")
+            if manifest is None or "bounds" not in manifest:
+                continue
+
+            west, south, east, north = manifest["bounds"]
+            layers.append(Layer(image=img, alg_id=alg_id, version=manifest["version"], minzoom=manifest["minzoom"], maxzoom=manifest["maxzoom"],
+                                tilesize=manifest["tilesize"], west=west, south=south, east=east, north=north))
+        return layers
+
+    def footprints(self, images: list[Image]):
+        """Compute the footprints of the given images from their profiles in one batch, without opening their band files
+
+        Keyword arguments:
+        - images -- The Image objects whose footprint fields (degrees and EPSG:3857 meters) are set
+        """
+
+        located: list[Image] = [img for img in images if img.profile.transform]
+        grids: list[dict] = [{"epsg": img.profile.crs, "transform": json.loads(img.profile.transform), "width": img.profile.width, "height": img.profile.height}
+                             for img in located]
+
+        for img, geographic, mercator in zip(located, coords.get_footprints(grids, coords.geographic_epsg), coords.get_footprints(grids, coords.mercator_epsg)):
+            img.west, img.south, img.east, img.north = geographic["bounds"]
+            img.min_x, img.min_y, img.max_x, img.max_y = mercator["bounds"]
+
+    def publish(self, images: list[Image], environment: Environment = Environment()):
+        """Store the given images, their profiles and tiled layers in the database, replacing the previous catalog
+
+        Keyword arguments:
+        - images      -- The Image objects to publish
+        - environment -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+        """
+
+        print(f"\nLOGGER: --> Starting publishing of the image catalog")
+
+        images = [img for img in images if img is not None and getattr(img, "profile", None) is not None]       # Scenes whose creation failed
+        for img in images:
+            for field in ("b2", "b3", "b4", "b8", "b8a", "b11", "tc", "ndvi", "ndwi", "ndmi"):
+                if getattr(img, field) is None:
+                    setattr(img, field, "")             # Failed renders are published without their layer
+
+        try:
+            self.footprints(images)
+
+            with transaction.atomic():          # Readers see either the previous or the new catalog
+                Layer.objects.all().delete()
+                Image.manager.all().delete()
+                Profile.objects.all().delete()
+
+                Profile.objects.bulk_create([img.profile for img in images])
+                Image.manager.bulk_create(images)
+                Layer.objects.bulk_create([layer for img in images for layer in self.read_layers(img, environment)])
+
+            # Tells the web processes to drop their cached catalog
+            os.makedirs(environment.create_output, exist_ok=True)
+            with open(f"{environment.create_output}{catalog_published_file}", "w") as file:
+                file.write(str(time.time()))
+
+            print(f"\nLOGGER: <-- Published {len(images)} images")
+
+        except Exception as e:
+            print(f"\nEXCEPTION: {e}")
+
+
+
 class Starter():
-    def empty_dir(self, path):
+    def empty_dir(self, path, keep: list[str] = []):
         """Remove all files and folders in the given path
 
         Keyword arguments:
         - path -- path where the files and folders whould be removed
+        - keep -- (Optional) names of files and folders in the path which are not removed
 
         Exceptions:
         - When the specified path cannot be reached
@@ -247,6 +773,8 @@ class Starter():
         try:
             files = os.listdir(path)
             for file in files:
+                if file in keep:
+                    continue
                 file_path = os.path.join(path, file)
                 if os.path.isfile(file_path):
                     os.remove(file_path)
@@ -265,7 +793,8 @@ class Starter():
 
         try:
 
-            self.empty_dir(environment.temp_output)
+            self.empty_dir(environment.temp_output, keep=[warp_plan_folder.strip("/"), path_to_locks.strip("/")])     # Warp plans stay valid for every later render of the same images,
+                                                                                                                # lock files may be held by other processes
 
             # Ugly but I wasn't sure how else to do this. TOO MANY FOLDERS
             img_folders = os.listdir(environment.tile_output)
@@ -338,6 +867,28 @@ class Starter():
         tiler: Tiler = Tiler()
         tiler.tile_images(rendered, environment=environment)                                 # Tile the images
     
+    def start_publishing(self, images: list[Image], environment: Environment = Environment()):
+        """Start the publishing of the catalog of the given images
+
+        Keyword arguments:
+        - images      -- The Image objects to publish
+        - environment -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+        """
+
+        publisher: Publisher = Publisher()
+        publisher.publish(images, environment=environment)                                  # Store the catalog
+
+    def start_cubing(self, images: list[Image], environment: Environment = Environment()):
+        """Start adding the given images to the temporal cubes of the index algorithms
+
+        Keyword arguments:
+        - images      -- The Image objects to add
+        - environment -- (Optional) Environment object with any changes in execution logic of the application (see Environment docs.)
+        """
+
+        writer: CubeWriter = CubeWriter()
+        writer.add_images(images, environment=environment)                                  # Add the scenes to the cubes
+
     def start(self, environment: Environment = Environment()):
         """Startup the logic to-be-executed at the start of the server or tests. Will create,
         renpder and tile all images in the specified locations
@@ -360,4 +911,12 @@ class Starter():
             # Tile the images
             self.start_tiling(rendered, environment=environment)                         
             self.cleanup(environment=environment)
+
+        if (created and environment.render):
+            # Add the rendered scenes to the per-pixel time series
+            self.start_cubing(created, environment=environment)
+
+        if (created):
+            # Publish the catalog of the images and their layers
+            self.start_publishing(created, environment=environment)
     
@@ -1,11 +1,16 @@
 from django.test import TestCase
-from .models import Environment, Profile, ProfileFactory, ImageManager, Image, ImageFactory
-from .startup import Creator, Renderer, Tiler, Starter
+from .models import Environment, Layer, Profile, ProfileFactory, ImageManager, Image, ImageFactory
+from .startup import Creator, Publisher, Renderer, Tiler, Starter, WarpPlanner
+from .flight import SingleFlight
+from . import coords, cube, export, histograms, sampling, zonal
+from . import dynamic, tiles
 from django.test import TestCase
 from unittest.mock import patch, MagicMock
+from PIL import Image as PILImage
 import rasterio as rio
 import numpy as np
-import os, shutil
+import glob, json, os, shutil, tempfile, threading, time
+import rasterio.warp
 
 prof_factory: ProfileFactory = ProfileFactory()
 img_factory: ImageFactory = ImageFactory()
@@ -83,6 +88,14 @@ def create_test(filename: str, width: int, height: int, start_width: int = 0, st
                 band_dump.write(datas[i], i+1)   # Dump the band data to the file
             band_dump.close()
 
+def write_render(path: str, data: np.ndarray, crs: int = 32634, origin: tuple[float, float] = (600000.0, 4800000.0), res: float = 60.0):
+    """Write the given (bands, rows, cols) uint8 data as a rendered GeoTIFF"""
+
+    profile: rio.profiles.Profile = rio.profiles.Profile(driver="GTiff", dtype=rio.dtypes.uint8, nodata=None, width=data.shape[2], height=data.shape[1],
+                                                         count=data.shape[0], crs=rio.crs.CRS.from_epsg(crs), transform=rio.Affine(res, 0, origin[0], 0, -res, origin[1]))
+    with rio.open(path, 'w', **profile) as dst:
+        dst.write(data)
+
 def empty_dir(path):
     """Remove all files and folders in the given path
 
@@ -124,7 +137,7 @@ def environment_equals(a: Environment, b: Environment) -> bool:
         return False
     if (a.render != b.render) or (a.render_output != b.render_output) or (a.rerender != b.rerender):
         return False
-    if (a.tile != b.tile) or (a.tile_output != b.tile_output) or (a.temp_output != b.temp_output):
+    if (a.tile != b.tile) or (a.tile_output != b.tile_output) or (a.temp_output != b.temp_output) or (a.tile_encodings != b.tile_encodings) or (a.tile_size != b.tile_size):
         return False
     return True
 
@@ -183,9 +196,11 @@ class EnvironmentTestCase(TestCase):
             rerender = True,
             tile = True,
             tile_output = "d",
-            temp_output = "e"
+            temp_output = "e",
+            tile_encodings = "f",
+            tile_size = 256
         )
-        environment_string = f"[\n  create: True\n  create_input: a\n  create_output: b\n  recreate: True\n  render: True\n  render_output: c\n  rerender: True\n  tile: True\n  tile_output: d\n  temp_output: e\n]"
+        environment_string = f"[\n  create: True\n  create_input: a\n  create_output: b\n  recreate: True\n  render: True\n  render_output: c\n  rerender: True\n  tile: True\n  tile_output: d\n  temp_output: e\n  tile_encodings: f\n  tile_size: 256\n]"
     
     def test_environment_str(self):
         # Valid execution
@@ -981,3 +996,639 @@ class StarterTestCase(TestCase):
         self.assertTrue(os.path.exists(f"{env.tile_output}{files[0]}/2/"))
         self.assertTrue(os.path.exists(f"{env.tile_output}{files[0]}/3/"))
 
+
+# Tile encoding Tests
+class TileEncodingTestCase(TestCase):
+    def setUp(self):
+        global tile_dir
+        tile_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(tile_dir)
+
+    def test_parse_encodings(self):
+        self.assertEqual(tiles.parse_encodings(""), ["png"])
+        self.assertEqual(tiles.parse_encodings("webp, JPEG"), ["png", "webp", "jpeg"])
+
+        # Only one encoding per extension
+        self.assertEqual(tiles.parse_encodings("webp_lossless,webp"), ["png", "webp_lossless"])
+
+        with self.assertRaises(Exception):
+            tiles.parse_encodings("gif")
+
+    def test_negotiate_extension(self):
+        chrome: str = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+        self.assertEqual(tiles.negotiate_extension(chrome, ["png", "webp"]), "webp")
+        self.assertEqual(tiles.negotiate_extension(chrome, ["png", "jpg"]), "jpg")
+        self.assertEqual(tiles.negotiate_extension("image/png", ["png", "webp", "jpg"]), "png")
+        self.assertEqual(tiles.negotiate_extension("image/webp;q=0, */*", ["png", "webp"]), "png")
+        self.assertEqual(tiles.negotiate_extension("", ["png", "webp"]), "webp")
+        self.assertIsNone(tiles.negotiate_extension("text/html", ["png"]))
+
+    def test_dynamic_colorize(self):
+        b4: np.ndarray = np.array([[200, 0]], dtype=np.uint8)
+        b8: np.ndarray = np.array([[100, 0]], dtype=np.uint8)
+
+        # Same values as ImageManager.create_NDVI: green channel only, zero when both bands are zero
+        ndvi: np.ndarray = dynamic.colorize(1, [b8, b4])
+        self.assertEqual(ndvi.shape, (3, 1, 2))
+        self.assertEqual(ndvi[:, 0, 0].tolist(), [0, 85, 0])
+        self.assertEqual(ndvi[:, 0, 1].tolist(), [0, 127, 0])
+
+        self.assertEqual(dynamic.colorize(0, [b4, b8, b4])[:, 0, 0].tolist(), [200, 100, 200])
+
+    def test_tiler_write_tile(self):
+        opaque: PILImage.Image = PILImage.new("RGBA", (128, 128), (10, 120, 30, 255))
+        border: PILImage.Image = PILImage.new("RGBA", (128, 128), (10, 120, 30, 0))
+        border.paste((10, 120, 30, 255), (0, 0, 64, 128))
+
+        Tiler().write_tile(opaque, f"{tile_dir}/0/6/35/23", 0, ["png", "webp", "jpeg"])
+        Tiler().write_tile(border, f"{tile_dir}/0/6/35/24", 0, ["png", "webp", "jpeg"])
+        Tiler().write_tile(opaque, f"{tile_dir}/1/6/35/23", 1, ["png", "webp", "jpeg"])
+
+        self.assertTrue(os.path.isfile(f"{tile_dir}/0/6/35/23.webp"))
+        self.assertTrue(os.path.isfile(f"{tile_dir}/0/6/35/23.jpg"))
+        self.assertTrue(os.path.isfile(f"{tile_dir}/0/6/35/24.webp"))
+        self.assertFalse(os.path.isfile(f"{tile_dir}/0/6/35/24.jpg"))     # Transparent tiles cannot be stored as JPEG
+        self.assertTrue(os.path.isfile(f"{tile_dir}/1/6/35/23.webp"))
+        self.assertFalse(os.path.isfile(f"{tile_dir}/1/6/35/23.jpg"))     # Index layers are not offered as JPEG
+
+        with PILImage.open(f"{tile_dir}/0/6/35/23.webp") as tile:
+            self.assertEqual(tile.size, (128, 128))
+
+        # Tiles which became empty are removed with all their variants
+        Tiler().write_tile(None, f"{tile_dir}/0/6/35/23", 0, ["png", "webp", "jpeg"])
+        self.assertEqual(glob.glob(f"{tile_dir}/0/6/35/23.*"), [])
+
+
+# Incremental tiling Tests
+class TilerManifestTestCase(TestCase):
+    def setUp(self):
+        global work_dir, env, render_path, img
+        work_dir = tempfile.mkdtemp()
+        env = default_env()
+        env.tile_output = f"{work_dir}/tiles/"
+        env.temp_output = f"{work_dir}/temp/"
+
+        render_path = f"{work_dir}/render_TC.tiff"
+        write_render(render_path, np.full((3, 600, 600), 100, dtype=np.uint8))
+        img = Image(img_id=0, title="render")
+        WarpPlanner.plans.clear()
+
+    def tearDown(self):
+        shutil.rmtree(work_dir)
+        WarpPlanner.plans.clear()
+
+    def change_render(self, row: int, col: int):
+        with rio.open(render_path) as src:
+            data: np.ndarray = src.read()
+        data[:, row, col] = 7
+        write_render(render_path, data)
+
+    def test_tiler_changed_window(self):
+        tiler: Tiler = Tiler()
+        parameters: dict = tiler.tile_parameters(render_path, env)
+        previous: dict = tiler.describe_render(render_path, tiler.checksum(render_path), parameters)
+
+        # New layer
+        self.assertIsNone(tiler.changed_window(None, previous))
+
+        # No pixel changed
+        self.assertEqual(tiler.changed_window(previous, previous), rio.windows.Window(0, 0, 0, 0))
+
+        # Only the block containing the changed pixel is reported
+        self.change_render(300, 520)
+        manifest: dict = tiler.describe_render(render_path, tiler.checksum(render_path), parameters)
+        self.assertEqual(tiler.changed_window(previous, manifest), rio.windows.Window(512, 256, 88, 256))
+
+        self.assertNotEqual(manifest["version"], previous["version"])
+
+        # Changed tiling parameters require a full retile and change the version of the layer
+        manifest["params"] = dict(parameters, tilesize=256)
+        self.assertIsNone(tiler.changed_window(previous, manifest))
+        self.assertNotEqual(tiler.describe_render(render_path, previous["checksum"], dict(parameters, encodings=["png", "webp"]))["version"], previous["version"])
+
+    def test_tiler_zoom_range(self):
+        # 60m pixels around 43 degrees north are about 82m in EPSG:3857
+        self.assertEqual(tiles.zoom_for_pixel_size(82.0, 128), 11)
+        self.assertEqual(tiles.zoom_for_pixel_size(82.0, 256), 10)
+        self.assertEqual(tiles.zoom_for_pixel_size(1e9, 256), 0)
+
+        self.assertEqual(Tiler().zoom_range(render_path, 128), (9, 11))
+        self.assertEqual(Tiler().zoom_range(render_path, 512), (9, 9))      # The whole extent already fits in one tile at the native resolution
+
+    def test_tiler_manifest_zoom_range(self):
+        env.tile_size = 256
+        with patch.object(Tiler, 'generate_tiles') as mock_generate:
+            Tiler().tile_image(img, render_path, 0, env)
+            self.assertEqual(mock_generate.call_args[0][3]["tilesize"], 256)
+
+        manifest: dict = Tiler().read_manifest(f"{env.tile_output}0/0/")
+        self.assertEqual((manifest["minzoom"], manifest["maxzoom"], manifest["tilesize"]), (9, 10, 256))
+        self.assertAlmostEqual(manifest["bounds"][0], 22.2, places=1)
+        self.assertAlmostEqual(manifest["bounds"][3], 43.3, places=1)
+
+    @patch.object(Tiler, 'generate_tiles')
+    def test_tiler_tile_image_incremental(self, mock_generate):
+        tiler: Tiler = Tiler()
+
+        # First run tiles everything and records the manifest
+        tiler.tile_image(img, render_path, 0, env)
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertNotIn("window", mock_generate.call_args[1])
+        self.assertTrue(os.path.isfile(f"{env.tile_output}0/0/layer.json"))
+
+        # Unchanged render output is skipped
+        tiler.tile_image(img, render_path, 0, env)
+        self.assertEqual(mock_generate.call_count, 1)
+
+        # A local change only retiles the changed region
+        self.change_render(10, 10)
+        tiler.tile_image(img, render_path, 0, env)
+        self.assertEqual(mock_generate.call_count, 2)
+        self.assertEqual(mock_generate.call_args[1]["window"], rio.windows.Window(0, 0, 256, 256))
+
+    def test_tiler_generate_tiles(self):
+        Tiler().tile_image(img, render_path, 0, env)
+
+        parameters: dict = Tiler().tile_parameters(render_path, env)
+        with rio.open(render_path) as src:
+            footprint = rio.warp.transform_bounds(src.crs, "EPSG:3857", *src.bounds)
+
+        for z in range(parameters["start_level"], parameters["end_level"] + 1):
+            x_min, x_max, y_min, y_max = tiles.tile_range(footprint, z)
+            written: list[str] = glob.glob(f"{env.tile_output}0/0/{z}/*/*.png")
+            self.assertGreater(len(written), 0)
+            self.assertLessEqual(len(written), (x_max - x_min + 1) * (y_max - y_min + 1))      # Corners of the bounding box may miss the rotated footprint
+
+        self.assertEqual(len(glob.glob(f"{env.tile_output}0/0/{parameters['end_level']}/*/*.png")), len(WarpPlanner.plans.popitem()[1]["tiles"]))
+
+        # Tiles inside the footprint are fully covered, tiles on its border are partially transparent
+        x_min, x_max, y_min, y_max = tiles.tile_range(footprint, parameters["end_level"])
+        with PILImage.open(f"{env.tile_output}0/0/{parameters['end_level']}/{x_min + 1}/{y_min + 1}.png") as tile:
+            self.assertEqual(tile.getpixel((64, 64)), (100, 100, 100, 255))
+            self.assertTrue(tiles.is_opaque(tile))
+        with PILImage.open(f"{env.tile_output}0/0/{parameters['end_level']}/{x_min}/{y_max}.png") as tile:
+            self.assertFalse(tiles.is_opaque(tile))
+
+        with PILImage.open(f"{env.tile_output}0/0/{parameters['start_level']}/{x_min >> 2}/{y_min >> 2}.png") as tile:
+            self.assertEqual(tile.size, (128, 128))
+            self.assertEqual(max(tile.getpixel((x, y))[0] for x in range(128) for y in range(128)), 100)
+
+    def test_tiler_warp_plan_shared(self):
+        write_render(f"{work_dir}/render_NDVI.tiff", np.full((3, 600, 600), 50, dtype=np.uint8))
+
+        with patch.object(WarpPlanner, 'compute_plan', autospec=True, side_effect=WarpPlanner.compute_plan) as mock_compute:
+            Tiler().tile_image(img, render_path, 0, env)
+            Tiler().tile_image(img, f"{work_dir}/render_NDVI.tiff", 1, env)
+            self.assertEqual(mock_compute.call_count, 1)            # Both layers share the grid of the image
+
+            # A new process loads the stored plan instead of computing it again
+            WarpPlanner.plans.clear()
+            shutil.rmtree(f"{env.tile_output}0/1/")
+            Tiler().tile_image(img, f"{work_dir}/render_NDVI.tiff", 1, env)
+            self.assertEqual(mock_compute.call_count, 1)
+
+        self.assertEqual(len(glob.glob(f"{env.temp_output}warp/*.npz")), 1)
+
+        # Cleanup keeps the stored plans
+        Starter().cleanup(env)
+        self.assertEqual(len(glob.glob(f"{env.temp_output}warp/*.npz")), 1)
+
+    def test_tiler_partial_retile(self):
+        Tiler().tile_image(img, render_path, 0, env)
+
+        parameters: dict = Tiler().tile_parameters(render_path, env)
+        modified: dict = {path: os.stat(path).st_mtime_ns for path in glob.glob(f"{env.tile_output}0/0/*/*/*.png")}
+
+        self.change_render(10, 10)
+        with patch.object(Tiler, 'write_tile', autospec=True, side_effect=Tiler.write_tile) as mock_write:
+            Tiler().tile_image(img, render_path, 0, env)
+
+        # Only the tiles over the changed block in the north-west corner and their ancestors are written again
+        with rio.open(render_path) as src:
+            changed = rio.warp.transform_bounds(src.crs, "EPSG:3857", *rio.windows.bounds(rio.windows.Window(0, 0, 256, 256), src.transform), densify_pts=21)
+        x_min, x_max, y_min, y_max = tiles.tile_range(changed, parameters["end_level"])
+        written: list[str] = [call[0][2] for call in mock_write.call_args_list]
+        self.assertLess(len(written), len(modified))
+        self.assertIn(f"{env.tile_output}0/0/{parameters['end_level']}/{x_min}/{y_max}", written)
+
+        with PILImage.open(f"{env.tile_output}0/0/{parameters['end_level']}/{x_min}/{y_max}.png") as tile:
+            self.assertIn((7, 7, 7, 255), [color for _, color in tile.getcolors()])
+
+
+class SingleFlightTestCase(TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_single_flight_threads(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)         # Keep the flight open while the other threads ask for the same key
+            return "result"
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do("key", compute))) for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(flights.stats(), {"computed": 1, "shared": 4, "in_flight": 0})
+
+        # Later calls compute again, the flight only lasts while the output is computed
+        self.assertEqual(flights.do("key", lambda: "again"), "again")
+
+    def test_single_flight_exception(self):
+        flights = SingleFlight()
+        with self.assertRaises(ValueError):
+            flights.do("key", MagicMock(side_effect=ValueError("failed")))
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    def test_single_flight_produce_between_processes(self):
+        output_path: str = f"{self.work_dir}/render_TC.tiff"
+        lock_directory: str = f"{self.work_dir}/locks/"
+        read, write = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:            # The other process holds the lock while writing the output
+            def produce_slowly():
+                os.write(write, b"1")
+                time.sleep(0.3)
+                with open(output_path, "w") as file:
+                    file.write("rendered")
+                return output_path
+            SingleFlight().produce(output_path, produce_slowly, lock_directory)
+            os._exit(0)
+
+        os.read(read, 1)
+        compute = MagicMock(return_value=output_path)
+        self.assertEqual(SingleFlight().produce(output_path, compute, lock_directory), output_path)
+        os.waitpid(pid, 0)
+
+        compute.assert_not_called()         # Written by the other process while waiting for the lock
+        with open(output_path) as file:
+            self.assertEqual(file.read(), "rendered")
+
+    def test_create_renders_coalesced(self):
+        env: Environment = Environment(render_output=f"{self.work_dir}/output/", temp_output=f"{self.work_dir}/temp/", rerender=True)
+        image = MagicMock(title="coalesced")
+        results = []
+
+        def render(*args, **kwargs):
+            time.sleep(0.2)
+            return "rendered"
+
+        with patch.object(ProfileFactory, 'get_rio_profile', side_effect=render) as mock_render:
+            threads = [threading.Thread(target=lambda: results.append(ImageManager().create_true_color(image, env))) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(mock_render.call_count, 1)     # One render for all concurrent calls, even when rerendering
+        self.assertEqual(len(results), 3)
+
+
+class PublisherTestCase(TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.env: Environment = Environment(create_output=f"{self.work_dir}/images/", tile_output=f"{self.work_dir}/tiles/")
+
+        os.makedirs(f"{self.env.tile_output}1/2/")
+        with open(f"{self.env.tile_output}1/2/{tiles.layer_manifest_file}", "w") as file:
+            json.dump({"version": "abc", "minzoom": 8, "maxzoom": 12, "tilesize": 128, "bounds": [20.0, 42.0, 21.0, 43.0]}, file)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_image(self, img_id: int, title: str) -> Image:
+        profile: Profile = Profile(driver="GTiff", dtype="uint16", nodata=None, width=10, height=10, count=1, crs=32634,
+                                   transform="[60, 0, 600000, 0, -60, 4800000]", blockxsize=10, blockysize=10, tiled=False)
+        return Image(img_id=img_id, title=title, b2="b2", b3="b3", b4="b4", b8="b8", b8a="b8a", b11="b11", profile=profile)
+
+    def test_publisher_publish(self):
+        Publisher().publish([self.make_image(0, "first"), self.make_image(1, "second")], self.env)
+
+        self.assertEqual(list(Image.manager.order_by("img_id").values_list("title", flat=True)), ["first", "second"])
+        self.assertEqual(Profile.objects.count(), 2)
+        layer: Layer = Layer.objects.get()
+        self.assertEqual((layer.image.img_id, layer.alg_id, layer.version, layer.minzoom, layer.maxzoom), (1, 2, "abc", 8, 12))
+        self.assertEqual([layer.west, layer.south, layer.east, layer.north], [20.0, 42.0, 21.0, 43.0])
+        self.assertTrue(os.path.isfile(f"{self.env.create_output}catalog.published"))
+
+        # Footprints computed from the profile, 600x600 m in UTM zone 34N
+        image: Image = Image.manager.get(img_id=0)
+        expected = rio.warp.transform_bounds("EPSG:32634", "EPSG:4326", 600000, 4799400, 600600, 4800000, densify_pts=21)
+        np.testing.assert_allclose([image.west, image.south, image.east, image.north], expected)
+        self.assertAlmostEqual(image.max_x - image.min_x, 600 / np.cos(np.radians(image.north)), delta=30)
+
+        # Publishing again replaces the previous catalog
+        Publisher().publish([self.make_image(0, "only")], self.env)
+        self.assertEqual(list(Image.manager.values_list("title", flat=True)), ["only"])
+        self.assertEqual(Layer.objects.count(), 0)
+        self.assertEqual(Profile.objects.count(), 1)
+
+    def test_publisher_publish_failed_scene(self):
+        rendered: Image = self.make_image(0, "rendered")
+        rendered.tc, rendered.ndvi = "tc.tif", "ndvi.tif"
+        failed: Image = self.make_image(1, "failed")
+        failed.tc = failed.ndvi = failed.ndwi = failed.ndmi = None          # Left unset by a failed render
+
+        Publisher().publish([rendered, None, failed], self.env)            # None for a scene whose creation failed
+
+        self.assertEqual(list(Image.manager.order_by("img_id").values_list("title", "tc", "ndvi")), [("rendered", "tc.tif", "ndvi.tif"), ("failed", "", "")])
+        self.assertEqual(Layer.objects.get().image.img_id, 1)
+        self.assertTrue(os.path.isfile(f"{self.env.create_output}catalog.published"))
+
+
+class CoordsTestCase(TestCase):
+    def setUp(self):
+        coords.get_transformer.cache_clear()
+
+    def test_get_footprints(self):
+        utm = {"epsg": 32634, "transform": [60, 0, 600000, 0, -60, 4800000], "width": 1000, "height": 1000}
+        footprints = coords.get_footprints([utm, {"epsg": 4326, "transform": [0.1, 0, 20, 0, -0.1, 45], "width": 10, "height": 20}, utm])
+
+        np.testing.assert_allclose(footprints[0]["bounds"], rio.warp.transform_bounds("EPSG:32634", "EPSG:4326", 600000, 4740000, 660000, 4800000, densify_pts=21))
+        self.assertEqual(footprints[1]["bounds"], (20, 43, 21, 45))
+        self.assertEqual(footprints[0], footprints[2])
+
+        polygon = footprints[0]["polygon"]
+        self.assertEqual(len(polygon), 4 * coords.densify_points + 1)
+        self.assertEqual(polygon[0], polygon[-1])           # Closed ring
+
+        # One transformer per pair of EPSG codes, whatever the number of rasters
+        self.assertEqual(coords.get_transformer.cache_info().misses, 2)
+
+    def test_get_footprints_rotated(self):
+        # Rotated grid, the footprint follows all four corners instead of two
+        rotated = {"epsg": 3857, "transform": [10, 10, 0, 10, -10, 0], "width": 100, "height": 100}
+        footprint = coords.get_footprints([rotated], coords.mercator_epsg)[0]
+        self.assertEqual(footprint["bounds"], (0, -1000, 2000, 1000))
+
+    def test_get_geotiff_bounds(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(work_dir, "scene.tiff")
+            with rio.open(path, "w", driver="GTiff", width=10, height=20, count=1, dtype="uint8", crs="EPSG:4326",
+                          transform=rio.transform.from_origin(20, 45, 0.1, 0.1)) as dst:
+                dst.write(np.zeros((1, 20, 10), dtype=np.uint8))
+
+            np.testing.assert_allclose(coords.get_geotiff_bounds(path), (20, 45, 21, 43))
+            self.assertIsNone(coords.get_geotiff_bounds(os.path.join(work_dir, "missing.tiff")))
+        finally:
+            shutil.rmtree(work_dir)
+
+
+class BandFilesMixin():
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.transform = rio.transform.from_origin(600000.0, 4800000.0, 10.0, 10.0)
+
+        # 1024x1024 pixels of 10m in UTM zone 34N in blocks of 256, the NIR band increasing to the east
+        cols = np.tile(np.arange(1024, dtype=np.uint16), (1024, 1))
+        self.paths = {"b8": cols + 100, "b4": np.full((1024, 1024), 100, dtype=np.uint16)}
+        self.paths["b4"][:10, :10] = 0
+        self.paths["b8"][:10, :10] = 0          # No data in the north-west corner
+        for band, data in list(self.paths.items()):
+            self.paths[band] = os.path.join(self.work_dir, f"{band}.tiff")
+            with rio.open(self.paths[band], "w", driver="GTiff", width=1024, height=1024, count=1, dtype="uint16", crs="EPSG:32634",
+                          transform=self.transform, tiled=True, blockxsize=256, blockysize=256) as dst:
+                dst.write(data, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def locations(self, cols: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        xs, ys = rio.transform.xy(self.transform, rows, cols)
+        return (np.asarray(values) for values in rio.warp.transform("EPSG:32634", "EPSG:4326", xs, ys))
+
+
+class SamplingTestCase(BandFilesMixin, TestCase):
+
+    def test_sample_points(self):
+        lons, lats = self.locations(np.array([0, 100, 1000, 20]), np.array([500, 500, 3, 5]))
+        lons, lats = np.append(lons, 0.0), np.append(lats, 0.0)         # Far outside of the image
+
+        values = sampling.sample_points([self.paths["b8"], self.paths["b4"]], 1, lons, lats)
+        np.testing.assert_allclose(values[:4], [0, 100 / 300, 1000 / 1200, 20 / 220])
+        self.assertTrue(np.isnan(values[4]))
+
+        lons, lats = self.locations(np.array([5]), np.array([5]))
+        self.assertTrue(np.isnan(sampling.sample_points([self.paths["b8"], self.paths["b4"]], 1, lons, lats)[0]))
+
+    def test_sample_points_reads_blocks(self):
+        rng = np.random.default_rng(0)
+        lons, lats = self.locations(rng.integers(10, 300, 1000), rng.integers(10, 200, 1000))
+
+        windows = []
+        block_groups = sampling.block_groups
+
+        def read_blocks(src, rows, cols):
+            for window, group in block_groups(src, rows, cols):
+                windows.append(window)
+                yield window, group
+
+        with patch.object(sampling, "block_groups", side_effect=read_blocks):
+            start = time.perf_counter()
+            values = sampling.sample_points([self.paths["b8"], self.paths["b4"]], 1, lons, lats)
+            self.assertLess(time.perf_counter() - start, 1.0)
+
+        self.assertEqual(len(windows), 4)           # Two blocks per band
+        self.assertEqual({(window.col_off, window.width) for window in windows}, {(0, 256), (256, 256)})
+        self.assertEqual(np.count_nonzero(np.isnan(values)), 0)
+
+
+class ZonalTestCase(BandFilesMixin, TestCase):
+    def polygon(self, col_min: float, row_min: float, col_max: float, row_max: float, hole: tuple = None) -> dict:
+        def ring(c0, r0, c1, r1):
+            xs, ys = rio.transform.xy(self.transform, [r0, r0, r1, r1, r0], [c0, c1, c1, c0, c0], offset="ul")
+            lons, lats = rio.warp.transform("EPSG:32634", "EPSG:4326", xs, ys)
+            return [[lon, lat] for lon, lat in zip(lons, lats)]
+        return {"type": "Polygon", "coordinates": [ring(col_min, row_min, col_max, row_max)] + ([ring(*hole)] if hole else [])}
+
+    def test_zonal_statistics(self):
+        expected = np.arange(100, 200) / (np.arange(100, 200) + 200)           # NDVI of the columns 100 to 199
+        geometries = [self.polygon(100.2, 500.2, 199.8, 509.8), self.polygon(0.2, 0.2, 9.8, 9.8), {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}]
+
+        stats = zonal.zonal_statistics([self.paths["b8"], self.paths["b4"]], 1, geometries, [0, 50, 100])
+        self.assertEqual(stats[0]["count"], 1000)
+        self.assertAlmostEqual(stats[0]["mean"], expected.mean())
+        self.assertAlmostEqual(stats[0]["min"], expected.min())
+        self.assertAlmostEqual(stats[0]["max"], expected.max())
+        self.assertAlmostEqual(stats[0]["percentiles"]["50"], np.median(expected), delta=0.01)
+        self.assertAlmostEqual(stats[0]["percentiles"]["0"], expected.min())
+
+        # No data in the north-west corner, and outside of the image
+        self.assertEqual([stats[1]["count"], stats[2]["count"]], [0, 0])
+        self.assertIsNone(stats[1]["mean"])
+
+    def test_zonal_statistics_hole_and_chunks(self):
+        # Spans the chunks of 1024 pixels and excludes a hole of 10x10 pixels
+        geometry = self.polygon(0.2, 10.2, 1023.8, 19.8, hole=(500.2, 10.2, 509.8, 19.8))
+        stats = zonal.zonal_statistics([self.paths["b8"], self.paths["b4"]], 1, [geometry])
+        self.assertEqual(stats[0]["count"], 10 * 1014)
+        self.assertEqual(stats[0]["percentiles"], {})
+
+    def test_zonal_statistics_many_polygons(self):
+        geometries = [self.polygon(col + 0.2, row + 0.2, col + 9.8, row + 9.8) for col in range(10, 1010, 20) for row in range(10, 1010, 25)]
+        start = time.perf_counter()
+        stats = zonal.zonal_statistics([self.paths["b8"], self.paths["b4"]], 1, geometries, [50])
+        self.assertLess(time.perf_counter() - start, 5.0)
+        self.assertEqual(len(stats), 2000)
+        self.assertTrue(all(stat["count"] == 100 for stat in stats))
+
+    def test_zonal_statistics_invalid(self):
+        for geometry in [{"type": "Point", "coordinates": [0, 0]}, {"type": "Polygon", "coordinates": [[[0, 0], [1, 1]]]}, {"coordinates": []}]:
+            with self.assertRaises(ValueError):
+                zonal.zonal_statistics([self.paths["b8"], self.paths["b4"]], 1, [geometry])
+
+
+class CubeTestCase(BandFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.env = Environment(create_output=f"{self.work_dir}/")
+
+    def scene(self, img_id: int, title: str) -> Image:
+        return Image(img_id=img_id, title=title, b8=self.paths["b8"], b4=self.paths["b4"])
+
+    def test_acquisition_time(self):
+        self.assertEqual(cube.acquisition_time("S2A_MSIL2A_20240323T092031_N0510_R093_T34TGL_20240323T125850"), "20240323T092031")
+        self.assertIsNone(cube.acquisition_time("Mosaic_Bulgaria"))
+
+    def test_add_images_and_series(self):
+        first = cube.CubeWriter().add_image(self.scene(2, "S2B_MSIL2A_20240402T092029_T34TGL"), 1, self.env)
+        second = cube.CubeWriter().add_image(self.scene(1, "S2A_MSIL2A_20240323T092031_T34TGL"), 1, self.env)
+        self.assertEqual(first, second)             # Scenes of the same grid share one cube
+        self.assertEqual(len(glob.glob(os.path.join(first, "0", "*.npy"))), 64)
+
+        lons, lats = self.locations(np.array([300]), np.array([200]))
+        results = cube.find_series(os.path.join(self.work_dir, cube.path_to_cube), 1, lons[0], lats[0])
+        self.assertEqual(len(results), 1)
+        self.assertEqual([scene["img_id"] for scene in results[0]["series"]], [1, 2])          # Ordered by time
+        self.assertAlmostEqual(results[0]["series"][0]["value"], 300 / 500, places=4)
+
+        # Mean of the window, and no data in the north-west corner
+        window = cube.find_series(os.path.join(self.work_dir, cube.path_to_cube), 1, lons[0], lats[0], size=3)
+        self.assertAlmostEqual(window[0]["series"][0]["value"], np.mean([299 / 499, 300 / 500, 301 / 501]), places=4)
+        lons, lats = self.locations(np.array([5]), np.array([5]))
+        self.assertIsNone(cube.find_series(os.path.join(self.work_dir, cube.path_to_cube), 1, lons[0], lats[0])[0]["series"][0]["value"])
+        self.assertEqual(cube.find_series(os.path.join(self.work_dir, cube.path_to_cube), 1, 0.0, 0.0), [])
+
+    def test_add_image_again(self):
+        writer = cube.CubeWriter()
+        path = writer.add_image(self.scene(1, "S2A_MSIL2A_20240323T092031_T34TGL"), 1, self.env)
+        chunk = os.path.join(path, "0", "0.0.npy")
+        mtime_ns = os.stat(chunk).st_mtime_ns
+
+        writer.add_image(self.scene(1, "S2A_MSIL2A_20240323T092031_T34TGL"), 1, self.env)        # Unchanged bands are not written again
+        self.assertEqual(os.stat(chunk).st_mtime_ns, mtime_ns)
+        self.assertEqual(len(cube.read_metadata(path)["times"]), 1)
+
+    def test_read_series_reads_chunks(self):
+        writer = cube.CubeWriter()
+        for day in range(1, 21):                    # Two chunks in time
+            path = writer.add_image(self.scene(day, f"S2A_MSIL2A_202403{day:02d}T092031_T34TGL"), 1, self.env)
+
+        lons, lats = self.locations(np.array([300]), np.array([200]))
+        with patch.object(cube.np, "load", side_effect=np.load) as load:
+            start = time.perf_counter()
+            series = cube.read_series(path, cube.read_metadata(path), lons[0], lats[0])
+            self.assertLess(time.perf_counter() - start, 0.1)
+        self.assertEqual(load.call_count, 2)        # The chunk of the pixel in both time chunks
+        self.assertEqual(len(series), 20)
+
+
+class ExportTestCase(BandFilesMixin, TestCase):
+    def geometry(self, col_min: float, row_min: float, col_max: float, row_max: float) -> dict:
+        xs, ys = rio.transform.xy(self.transform, [row_min, row_min, row_max, row_max, row_min], [col_min, col_max, col_max, col_min, col_min], offset="ul")
+        lons, lats = rio.warp.transform("EPSG:32634", "EPSG:4326", xs, ys)
+        return {"type": "Polygon", "coordinates": [[[lon, lat] for lon, lat in zip(lons, lats)]]}
+
+    def test_stream_geotiff(self):
+        size, content = export.stream_geotiff([self.paths["b8"], self.paths["b4"]], 1, self.geometry(0.2, 0.2, 299.8, 599.8))
+        data = b"".join(content)
+        self.assertEqual(len(data), size)
+
+        with rio.io.MemoryFile(data) as memory, memory.open() as src:
+            self.assertEqual((src.width, src.height, src.crs.to_epsg()), (300, 600, 32634))
+            self.assertEqual(src.block_shapes[0], (256, 256))
+            self.assertAlmostEqual(src.transform.c, 600000.0)
+            values = src.read(1)
+
+        cols = np.arange(300)
+        np.testing.assert_allclose(values[300], cols / (cols + 200), rtol=1e-6)
+        self.assertTrue(np.isnan(values[:10, :10]).all())           # No data in the north-west corner
+        self.assertFalse(np.isnan(values[10:, :]).any())
+
+    def test_stream_geotiff_clips_polygon(self):
+        geometry = self.geometry(100.2, 100.2, 599.8, 599.8)
+        geometry["coordinates"][0] = [geometry["coordinates"][0][index] for index in [0, 1, 2, 0]]       # Triangle over the north-east half
+        size, content = export.stream_geotiff([self.paths["b8"], self.paths["b4"]], 2, geometry)
+
+        with rio.io.MemoryFile(b"".join(content)) as memory, memory.open() as src:
+            values = src.read(1)
+        self.assertEqual(values.shape, (500, 500))
+        self.assertFalse(np.isnan(values[10, 400]))
+        self.assertTrue(np.isnan(values[400, 10]))
+
+    def test_stream_geotiff_outside(self):
+        with self.assertRaises(ValueError):
+            export.stream_geotiff([self.paths["b8"], self.paths["b4"]], 1, export.bbox_geometry((0.0, 0.0, 1.0, 1.0)))
+
+
+class HistogramsTestCase(BandFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.values = np.random.default_rng(0).uniform(-1, 1, (1024, 1024))
+        self.valid = np.ones((1024, 1024), dtype=bool)
+        self.valid[:10, :10] = False
+
+    def test_summarize(self):
+        stats = histograms.block_statistics(self.values, self.valid)
+        self.assertEqual(stats["histogram"].shape, (4, 4, histograms.histogram_bins))
+
+        summary = histograms.summarize(stats, percentiles=[0, 50])
+        values = self.values[self.valid]
+        self.assertEqual(summary["count"], len(values))
+        self.assertAlmostEqual(summary["mean"], values.mean())
+        self.assertAlmostEqual(summary["std"], values.std())
+        self.assertEqual([summary["min"], summary["percentiles"]["0"]], [values.min(), values.min()])
+        self.assertAlmostEqual(summary["percentiles"]["50"], np.median(values), delta=0.01)
+        self.assertEqual(sum(summary["histogram"]["counts"]), len(values))
+
+        # The blocks of a part are merged without the pixels
+        part = histograms.summarize(stats, (1, 2, 3, 4))
+        self.assertEqual(part["count"], 512 * 512)
+        self.assertAlmostEqual(part["mean"], self.values[256:768, 512:].mean())
+
+    def test_block_window(self):
+        histograms.write_statistics(os.path.join(self.work_dir, "scene_NDVI.tiff"), self.values, self.valid, {"transform": self.transform, "crs": rio.crs.CRS.from_epsg(32634)})
+        stats = histograms.read_statistics(os.path.join(self.work_dir, "scene_NDVI.stats.npz"))
+
+        lons, lats = self.locations(np.array([300, 600]), np.array([100, 200]))
+        self.assertEqual(histograms.block_window(stats, (lons.min(), lats.min(), lons.max(), lats.max())), (0, 1, 1, 3))
+        self.assertEqual(histograms.summarize(stats, histograms.block_window(stats, (0.0, 0.0, 1.0, 1.0)))["count"], 0)
+
+    def test_render_writes_statistics(self):
+        profile = Profile(driver="GTiff", dtype="uint16", nodata=None, width=1024, height=1024, count=1, crs=32634,
+                          transform=json.dumps(list(self.transform)[:6]), blockxsize=256, blockysize=256, tiled=True)
+        image = Image(img_id=1, title="scene", b4=self.paths["b4"], b8=self.paths["b8"], profile=profile)
+        env = Environment(render_output=f"{self.work_dir}/output/", temp_output=f"{self.work_dir}/temp/", rerender=True)
+
+        rendered = img_manager.create_NDVI(image, environment=env)
+        summary = histograms.summarize(histograms.read_statistics(histograms.statistics_path(rendered)))
+        self.assertEqual(summary["count"], 1024 * 1024 - 100)           # No data in the north-west corner
+        self.assertAlmostEqual(summary["max"], 1023 / 1223)
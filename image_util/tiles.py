@@ -0,0 +1,257 @@
+from PIL import Image as PILImage
+import rasterio as rio
+import rasterio.warp
+import numpy as np
+import hashlib, io, math
+
+layer_manifest_file: str = "layer.json"      # Record of the render output a tiled layer was built from, stored in its tile folder
+
+base_encoding: str = "png"      # Always produced by the tiler, used as fallback when no other variant is accepted
+
+webp_quality: int = 80
+jpeg_quality: int = 85
+
+tile_encodings: dict[str, dict] = {
+    "png":           {"extension": "png",  "content_type": "image/png",  "format": "PNG",  "options": {"optimize": True}},
+    "webp":          {"extension": "webp", "content_type": "image/webp", "format": "WEBP", "options": {"quality": webp_quality, "method": 4}},
+    "webp_lossless": {"extension": "webp", "content_type": "image/webp", "format": "WEBP", "options": {"lossless": True}},
+    "jpeg":          {"extension": "jpg",  "content_type": "image/jpeg", "format": "JPEG", "options": {"quality": jpeg_quality}},
+}
+
+content_types: dict[str, str] = {spec["extension"]: spec["content_type"] for spec in tile_encodings.values()}
+extension_encodings: dict[str, str] = {"png": "png", "webp": "webp", "jpg": "jpeg"}     # Encoding used when re-encoding a tile stored with the given extension
+
+opaque_only: list[str] = ["jpeg"]       # Encodings without an alpha channel, only usable for fully opaque tiles
+
+preference: list[str] = ["webp", "jpg", "png"]     # Order in which variants are offered when the client accepts several
+
+def parse_encodings(value: str) -> list[str]:
+    """Parse a comma separated list of tile encodings
+
+    Keyword arguments:
+    - value -- Comma separated encoding names, for example "png,webp"
+
+    Returns:
+    - The list of valid encodings, always starting with the base encoding and containing
+      at most one encoding per file extension
+
+    Exceptions:
+    - When an unknown encoding name is given
+    """
+
+    result: list[str] = [base_encoding]
+    extensions: list[str] = [tile_encodings[base_encoding]["extension"]]
+
+    for name in [name.strip().lower() for name in value.split(",") if name.strip()]:
+        if name not in tile_encodings:
+            raise Exception(f"Unknown tile encoding [{name}], expected one of {list(tile_encodings)}")
+
+        if tile_encodings[name]["extension"] not in extensions:        # webp and webp_lossless share the same file extension
+            result.append(name)
+            extensions.append(tile_encodings[name]["extension"])
+
+    return result
+
+def is_opaque(tile: PILImage.Image) -> bool:
+    """Check if the given tile does not contain any (partially) transparent pixels
+
+    Keyword arguments:
+    - tile -- The opened tile image
+
+    Returns:
+    - True if every pixel of the tile is fully opaque
+    """
+
+    if "A" not in tile.getbands():
+        return True
+    return tile.getchannel("A").getextrema()[0] == 255
+
+def encode_tile(tile: PILImage.Image, encoding: str) -> bytes:
+    """Encode the given tile image using the specified encoding
+
+    Keyword arguments:
+    - tile     -- The opened tile image
+    - encoding -- The name of the encoding (see tile_encodings)
+
+    Returns:
+    - The encoded tile data
+    """
+
+    spec: dict = tile_encodings[encoding]
+    if encoding in opaque_only:
+        tile = tile.convert("RGB")
+
+    buffer = io.BytesIO()
+    tile.save(buffer, format=spec["format"], **spec["options"])
+    return buffer.getvalue()
+
+def content_hash(data: bytes) -> str:
+    """Get the hash identifying the content of an encoded tile
+
+    Keyword arguments:
+    - data -- The encoded tile
+
+    Returns:
+    - The hexadecimal hash of the content
+    """
+
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def accepted_types(accept: str) -> dict[str, float]:
+    """Parse an HTTP Accept header into its media ranges and quality values
+
+    Keyword arguments:
+    - accept -- The value of the Accept header
+
+    Returns:
+    - Dictionary of media range to quality value
+    """
+
+    result: dict[str, float] = {}
+
+    for part in accept.split(","):
+        params: list[str] = part.strip().split(";")
+        media: str = params[0].strip().lower()
+        if not media:
+            continue
+
+        quality: float = 1.0
+        for param in params[1:]:
+            key, _, val = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(val)
+                except ValueError:
+                    quality = 0.0
+
+        result[media] = quality
+
+    return result
+
+def negotiate_extension(accept: str, available: list[str]) -> str:
+    """Choose the tile variant to serve based on the Accept header of the request
+
+    Keyword arguments:
+    - accept    -- The value of the Accept header
+    - available -- The file extensions of the variants available for the tile
+
+    Returns:
+    - The extension of the variant to serve, or None when no variant is acceptable
+    """
+
+    types: dict[str, float] = accepted_types(accept or "*/*")
+    best: str = None
+    best_quality: float = 0.0
+
+    for extension in preference:
+        if extension not in available:
+            continue
+
+        content_type: str = content_types[extension]
+        quality: float = types.get(content_type, types.get("image/*", types.get("*/*", 0.0)))
+        if quality > best_quality:                  # Strictly greater keeps the server preference on ties
+            best, best_quality = extension, quality
+
+    return best
+
+
+mercator_crs: str = "EPSG:3857"
+origin_shift: float = 20037508.342789244       # Half of the circumference of the earth in EPSG:3857 meters
+max_zoom_level: int = 24
+
+def zoom_for_pixel_size(pixel_size: float, tile_size: int) -> int:
+    """Get the deepest zoom level whose resolution is not finer than the given pixel size (as gdal2tiles does)
+
+    Keyword arguments:
+    - pixel_size -- The size of a pixel in EPSG:3857 meters
+    - tile_size  -- The size of the tiles in pixels
+
+    Returns:
+    - The zoom level
+    """
+
+    zoom: int = math.floor(math.log2(2 * origin_shift / (tile_size * pixel_size)) + 1e-9)
+    return min(max(zoom, 0), max_zoom_level)
+
+def tile_span(z: int) -> float:
+    """Get the width and height of a tile at the given zoom level in EPSG:3857 meters
+
+    Keyword arguments:
+    - z -- The zoom level
+
+    Returns:
+    - The size of a tile side in meters
+    """
+
+    return 2 * origin_shift / (2 ** z)
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """Get the EPSG:3857 footprint of the given TMS tile (y counted from the south, as written by gdal2tiles)
+
+    Keyword arguments:
+    - z -- The zoom level of the tile
+    - x -- The column of the tile
+    - y -- The TMS row of the tile
+
+    Returns:
+    - The bounds of the tile as (min x, min y, max x, max y)
+    """
+
+    span: float = tile_span(z)
+    return (x * span - origin_shift, y * span - origin_shift, (x + 1) * span - origin_shift, (y + 1) * span - origin_shift)
+
+def tile_range(bounds: tuple[float, float, float, float], z: int) -> tuple[int, int, int, int]:
+    """Get the TMS tiles at the given zoom level whose footprint intersects the given bounds
+
+    Keyword arguments:
+    - bounds -- EPSG:3857 bounds as (min x, min y, max x, max y)
+    - z      -- The zoom level
+
+    Returns:
+    - The inclusive tile ranges as (min x, max x, min y, max y)
+    """
+
+    span: float = tile_span(z)
+    last: int = 2 ** z - 1
+
+    def clamp(value: float) -> int:
+        return int(min(max(value, 0), last))
+
+    return (clamp(math.floor((bounds[0] + origin_shift) / span)), clamp(math.ceil((bounds[2] + origin_shift) / span) - 1),
+            clamp(math.floor((bounds[1] + origin_shift) / span)), clamp(math.ceil((bounds[3] + origin_shift) / span) - 1))
+
+def source_pixels(src, tile_size: int, z: int, x: int, y: int) -> tuple[tuple[int, int, int, int], np.ndarray, np.ndarray, np.ndarray]:
+    """Get the nearest source pixel of every pixel of the given TMS tile
+
+    Keyword arguments:
+    - src       -- The opened rasterio dataset the tile is resampled from
+    - tile_size -- The size of the tiles in pixels
+    - z         -- The zoom level of the tile
+    - x         -- The column of the tile
+    - y         -- The TMS row of the tile
+
+    Returns:
+    - The source window the tile reads as (column offset, row offset, width, height), the source rows and columns
+      of the tile pixels relative to that window, and the mask of tile pixels which fall inside the source,
+      or None when the tile does not overlap the source
+    """
+
+    inverse = ~src.transform
+    resolution: float = tile_span(z) / tile_size
+    offsets: np.ndarray = (np.arange(tile_size) + 0.5) * resolution          # Pixel centers relative to the tile corner
+
+    left, _, _, top = tile_bounds(z, x, y)
+    mx, my = np.meshgrid(left + offsets, top - offsets)
+    sx, sy = rio.warp.transform(mercator_crs, src.crs, mx.ravel(), my.ravel())
+
+    sx, sy = np.asarray(sx), np.asarray(sy)
+    cols: np.ndarray = np.floor(inverse.a * sx + inverse.b * sy + inverse.c).astype(np.int64).reshape(tile_size, tile_size)
+    rows: np.ndarray = np.floor(inverse.d * sx + inverse.e * sy + inverse.f).astype(np.int64).reshape(tile_size, tile_size)
+    valid: np.ndarray = (cols >= 0) & (cols < src.width) & (rows >= 0) & (rows < src.height)
+
+    if not valid.any():
+        return None
+
+    col_off, row_off = int(cols[valid].min()), int(rows[valid].min())
+    window: tuple = (col_off, row_off, int(cols[valid].max()) - col_off + 1, int(rows[valid].max()) - row_off + 1)
+    return window, rows - row_off, cols - col_off, valid
@@ -0,0 +1,182 @@
+from . import coords, dynamic
+from .histograms import histogram_bins, histogram_percentiles, value_bins
+import rasterio as rio
+import rasterio.features
+import numpy as np
+import math
+
+chunk_size: int = 1024           # Pixels per side of the parts of the raster reduced at once, rounded up to whole blocks
+
+def polygon_rings(geometry: dict) -> list[list[np.ndarray]]:
+    """Get the rings of the polygons of a GeoJSON geometry
+
+    Keyword arguments:
+    - geometry -- A GeoJSON Polygon or MultiPolygon
+
+    Returns:
+    - Per polygon its exterior ring followed by its holes, each as an array of (x, y) points
+
+    Exceptions:
+    - ValueError when the geometry is not a valid Polygon or MultiPolygon
+    """
+
+    try:
+        if geometry["type"] == "Polygon":
+            polygons: list = [geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            polygons: list = geometry["coordinates"]
+        else:
+            raise ValueError(f"Unsupported geometry type {geometry['type']}")
+
+        result: list[list[np.ndarray]] = [[np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon] for polygon in polygons]
+    except (KeyError, TypeError, IndexError):
+        raise ValueError("Geometries must be GeoJSON Polygons or MultiPolygons")
+
+    if not result or any(not polygon or any(ring.ndim != 2 or len(ring) < 4 for ring in polygon) for polygon in result):
+        raise ValueError("Polygon rings need at least 4 points")
+    return result
+
+def project_zones(geometries: list[dict], epsg: int) -> list[dict]:
+    """Reproject GeoJSON geometries in degrees to the CRS of a raster, transforming all their points in one call
+
+    Keyword arguments:
+    - geometries -- The GeoJSON Polygons or MultiPolygons in degrees
+    - epsg       -- The EPSG code of the raster
+
+    Returns:
+    - The geometries as GeoJSON MultiPolygons in the CRS of the raster
+    """
+
+    zones: list[list[list[np.ndarray]]] = [polygon_rings(geometry) for geometry in geometries]
+    rings: list[np.ndarray] = [ring for zone in zones for polygon in zone for ring in polygon]
+    points: np.ndarray = np.concatenate(rings)
+    xs, ys = coords.get_transformer(coords.geographic_epsg, epsg)(points[:, 0], points[:, 1])
+
+    projected: list[np.ndarray] = np.split(np.stack([xs, ys], axis=1), np.cumsum([len(ring) for ring in rings])[:-1])
+    result: list[dict] = []
+    position: int = 0
+    for zone in zones:
+        polygons: list = []
+        for polygon in zone:
+            polygons.append([projected[position + index].tolist() for index in range(len(polygon))])
+            position += len(polygon)
+        result.append({"type": "MultiPolygon", "coordinates": polygons})
+    return result
+
+def zone_windows(zones: list[dict], src) -> np.ndarray:
+    """Get the pixel window of every zone
+
+    Keyword arguments:
+    - zones -- The zones as GeoJSON MultiPolygons in the CRS of the raster
+    - src   -- The opened rasterio dataset
+
+    Returns:
+    - Array of (first row, first column, last row + 1, last column + 1) per zone, clipped to the raster
+    """
+
+    inverse = ~src.transform
+    windows: np.ndarray = np.zeros((len(zones), 4), dtype=np.int64)
+    for index, zone in enumerate(zones):
+        points: np.ndarray = np.concatenate([np.asarray(ring) for polygon in zone["coordinates"] for ring in polygon])
+        cols: np.ndarray = inverse.a * points[:, 0] + inverse.b * points[:, 1] + inverse.c
+        rows: np.ndarray = inverse.d * points[:, 0] + inverse.e * points[:, 1] + inverse.f
+        windows[index] = (math.floor(rows.min()), math.floor(cols.min()), math.ceil(rows.max()), math.ceil(cols.max()))
+
+    windows[:, [0, 2]] = np.clip(windows[:, [0, 2]], 0, src.height)
+    windows[:, [1, 3]] = np.clip(windows[:, [1, 3]], 0, src.width)
+    return windows
+
+def chunk_windows(src):
+    """Split a raster into parts of about chunk_size pixels per side made of whole blocks
+
+    Keyword arguments:
+    - src -- The opened rasterio dataset
+
+    Returns:
+    - Iterator of (row offset, column offset, height, width)
+    """
+
+    block_height, block_width = src.block_shapes[0]
+    height: int = min(src.height, math.ceil(chunk_size / block_height) * block_height)
+    width: int = min(src.width, math.ceil(chunk_size / block_width) * block_width)
+    for row in range(0, src.height, height):
+        for col in range(0, src.width, width):
+            yield row, col, min(height, src.height - row), min(width, src.width - col)
+
+def zonal_statistics(band_paths: list[str], alg_id: int, geometries: list[dict], percentiles: list[float] = []) -> list[dict]:
+    """Compute the statistics of the index values inside every given polygon
+
+    Only the parts of the raster covered by polygons are read. Every part is read once for all polygons
+    inside it, rasterized against the image grid and reduced with bincount per polygon.
+
+    Keyword arguments:
+    - band_paths  -- The paths of the band files of the algorithm, in the order of dynamic.algorithms[alg_id]["bands"]
+    - alg_id      -- The ID of the index algorithm ( 1 - NDVI | 2 - NDWI | 3 - NDMI )
+    - geometries  -- The GeoJSON Polygons or MultiPolygons in degrees
+    - percentiles -- (Optional) The percentiles to compute, between 0 and 100, accurate to the histogram bins
+
+    Returns:
+    - Per geometry the number of pixels with data (pixels whose center is inside, a pixel inside several
+      overlapping polygons counts for the last one) and their mean, min, max and percentiles, None without data
+
+    Exceptions:
+    - ValueError when a geometry is invalid
+    """
+
+    count: int = len(geometries) + 1              # Zone 0 is outside of every polygon
+    sums: np.ndarray = np.zeros(count)
+    counts: np.ndarray = np.zeros(count, dtype=np.int64)
+    minimums: np.ndarray = np.full(count, np.inf)
+    maximums: np.ndarray = np.full(count, -np.inf)
+    histograms: np.ndarray = np.zeros((count, histogram_bins), dtype=np.int64) if percentiles else None
+
+    with rio.open(band_paths[0]) as src, rio.open(band_paths[1]) as other:          # All bands of an image share the same grid
+        zones: list[dict] = project_zones(geometries, src.crs.to_epsg())
+        windows: np.ndarray = zone_windows(zones, src)
+
+        for row, col, height, width in chunk_windows(src):
+            inside: np.ndarray = np.flatnonzero((windows[:, 0] < row + height) & (windows[:, 2] > row) & (windows[:, 1] < col + width) & (windows[:, 3] > col)
+                                                & (windows[:, 0] < windows[:, 2]) & (windows[:, 1] < windows[:, 3]))
+            if len(inside) == 0:
+                continue
+
+            # Only the part of the chunk covered by the bounding windows of its polygons is read
+            top, left = max(row, int(windows[inside, 0].min())), max(col, int(windows[inside, 1].min()))
+            bottom, right = min(row + height, int(windows[inside, 2].max())), min(col + width, int(windows[inside, 3].max()))
+            window = rio.windows.Window(left, top, right - left, bottom - top)
+            labels: np.ndarray = rio.features.rasterize(((zones[index], index + 1) for index in inside), out_shape=(bottom - top, right - left),
+                                                        transform=rio.windows.transform(window, src.transform), fill=0, dtype="int32")
+            covered: np.ndarray = labels > 0
+            if not covered.any():
+                continue
+
+            a: np.ndarray = src.read(1, window=window)[covered]
+            b: np.ndarray = other.read(1, window=window)[covered]
+            valid: np.ndarray = (a.astype('float64') + b) != 0
+            if src.nodata is not None:
+                valid &= a != src.nodata
+            if other.nodata is not None:
+                valid &= b != other.nodata
+
+            zone: np.ndarray = labels[covered][valid]
+            values: np.ndarray = dynamic.normalized_difference(a[valid], b[valid])
+
+            sums += np.bincount(zone, weights=values, minlength=count)
+            counts += np.bincount(zone, minlength=count)
+            np.minimum.at(minimums, zone, values)
+            np.maximum.at(maximums, zone, values)
+            if histograms is not None:
+                histograms += np.bincount(zone * histogram_bins + value_bins(values), minlength=count * histogram_bins).reshape(count, histogram_bins)
+
+    result: list[dict] = []
+    for index in range(1, count):
+        if counts[index] == 0:
+            result.append({"count": 0, "mean": None, "min": None, "max": None, "percentiles": {f"{p:g}": None for p in percentiles}})
+            continue
+
+        stats: dict = {"count": int(counts[index]), "mean": float(sums[index] / counts[index]), "min": float(minimums[index]), "max": float(maximums[index]), "percentiles": {}}
+        if histograms is not None:
+            stats["percentiles"] = histogram_percentiles(histograms[index], int(counts[index]), stats["min"], stats["max"], percentiles)
+        result.append(stats)
+
+    return result